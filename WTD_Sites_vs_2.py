@@ -1,28 +1,48 @@
 import pandas as pd
+import numpy as np
 import geopandas as gpd
 from shapely.geometry import Point
 import json
 import os
-import folium
-from pathlib import Path
-from selenium import webdriver
-#from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.edge.options import Options
 import time
-import base64
-
-
-
-def site_import(file_path, parameter=None):
-    """Import sites from Excel, clean data, and convert to GeoDataFrame"""
-    
-    sites = pd.read_excel(file_path)
-    sites = sites.iloc[:-1]  # Drop last row
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from gis_io import read_layer, write_layer, cache_path, layer_fingerprint
+from table_schema import apply_schema
+from instrumentation import instrumented, stage, print_summary, write_run_report, clear_logs, worker_records, merge_records
+from layer_registry import PROJECTED_CRS, projected, display
+from site_basin_index import attach_basins, update_index, index_values
+from layer_service import publish_layer
+from topology import serialize_topology
+from static_publish import publish_static, precompress
+from map_export import export_job, export_maps, print_exports
+from site_clusters import cluster_levels
+from site_groups import SiteGroups
+from excel_cache import cached_read, load_cached
+from site_diff import snapshot_path as default_snapshot_path, KEY_COLUMN, site_keys, load_snapshot, save_snapshot, diff_sites, diff_is_empty, diff_summary
+
+
+
+# bump when the cleaning below changes so cached site tables are rebuilt
+SITE_CACHE_VERSION = 1
+
+SITE_COLUMNS = [
+    "site", "site_name", "parameter", "latitude", "longitude", 
+    "WRIA", "program", "notes", "Yearly Hours", "KM verified", 
+    "KM notes", "annual equipment cost", "date installed", "WTD vs SWM"
+]
+
+
+def clean_sites(sites, drop_last_row=True):
+    """Clean a raw site sheet and convert to GeoDataFrame"""
+    if drop_last_row:
+        sites = sites.iloc[:-1]  # Drop last row
    
     # Rename columns
     sites = sites.rename(columns={
         "SITE_CODE": "site", 
         "SITE_NAME": "site_name", 
+        "name": "site_name",
         "DATE_INSTA": "date installed",
         "LAT": "latitude", 
         "LON": "longitude", 
@@ -38,75 +58,134 @@ def site_import(file_path, parameter=None):
         'Stream Gauge(Recording with Discharge)': 'discharge',
         'Water Temperature Recorder': 'water_temperature'
     }
-    sites["parameter"] = sites["parameter"].replace(parameter_mapping)
-    
-    # Select relevant columns
-    sites = sites[[
-        "site", "site_name", "parameter", "latitude", "longitude", 
-        "WRIA", "program", "notes", "Yearly Hours", "KM verified", 
-        "KM notes", "annual equipment cost", "date installed", "WTD vs SWM"
-    ]]
+    if "parameter" in sites.columns:
+        sites["parameter"] = sites["parameter"].replace(parameter_mapping)
     
     # Validate coordinates exist
     if 'latitude' not in sites.columns or 'longitude' not in sites.columns:
         raise ValueError("Excel file must contain 'latitude' and 'longitude' columns")
     
+    # Select relevant columns, older workbooks are missing some of these
+    sites = sites.reindex(columns=SITE_COLUMNS)
+    
     # Drop rows with missing coordinates
     sites = sites.dropna(subset=['longitude', 'latitude'])
     
+    # excel mixes numbers and text in columns like site code, store these as text
+    for col in sites.select_dtypes(include="object").columns:
+        sites[col] = sites[col].where(sites[col].isna(), sites[col].astype(str))
+    
     # Create GeoDataFrame
     site_points = [Point(lon, lat) for lon, lat in zip(sites['longitude'], sites['latitude'])]
     sites_gdf = gpd.GeoDataFrame(sites, geometry=site_points, crs='EPSG:4326')
-    return sites_gdf
+    return apply_schema(sites_gdf, "sites")
+
 
+def _site_cache_key(sheet_name, drop_last_row):
+    return f"sheet={sheet_name}|drop_last_row={drop_last_row}|v{SITE_CACHE_VERSION}"
 
+
+def _read_site_workbook(file_path, sheet_name=0, drop_last_row=True):
+    sites = pd.read_excel(file_path, sheet_name=sheet_name)
+    return clean_sites(sites, drop_last_row=drop_last_row)
+
+
+@instrumented
+def site_import(file_path, parameter=None, sheet_name=0, drop_last_row=True, use_cache=True):
+    """Import sites from Excel, clean data, and convert to GeoDataFrame
+    the cleaned table is cached and the workbook is only parsed again when it changes"""
+    if not use_cache:
+        return _read_site_workbook(file_path, sheet_name, drop_last_row)
+    sites_gdf = cached_read(
+        file_path,
+        lambda: _read_site_workbook(file_path, sheet_name, drop_last_row),
+        key=_site_cache_key(sheet_name, drop_last_row),
+    )
+    # parquet does not keep every categorical (ie numeric WRIA codes)
+    return apply_schema(sites_gdf, "sites")
+
+
+def _site_import_source(source):
+    return site_import(**source)
+
+
+@instrumented
+def import_sites(sources, max_workers=None):
+    """Import several workbooks/sheets and merge them into one site table
+    sources are file paths or dicts of site_import arguments, earlier sources win when a site code repeats
+    cached sources are loaded directly, the rest are parsed in parallel processes"""
+    sources = [{"file_path": s} if isinstance(s, (str, os.PathLike)) else dict(s) for s in sources]
+    frames = [None] * len(sources)
+    to_parse = []
+    for i, source in enumerate(sources):
+        if source.get("use_cache", True):
+            key = _site_cache_key(source.get("sheet_name", 0), source.get("drop_last_row", True))
+            frames[i] = load_cached(source["file_path"], key)
+        if frames[i] is None:
+            to_parse.append(i)
+    
+    if len(to_parse) == 1:
+        frames[to_parse[0]] = _site_import_source(sources[to_parse[0]])
+    elif to_parse:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            parsed = pool.map(_site_import_source, [sources[i] for i in to_parse])
+            for i, sites_gdf in zip(to_parse, parsed):
+                frames[i] = sites_gdf
+    
+    sites = pd.concat(frames, ignore_index=True)
+    sites = sites.drop_duplicates(subset="site", keep="first").reset_index(drop=True)
+    sites_gdf = gpd.GeoDataFrame(sites, geometry="geometry", crs='EPSG:4326')
+    return apply_schema(sites_gdf, "sites")
+
+
+@instrumented
 def wtd_service_area_import():
     """Import WTD service area boundary"""
-    os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
-    full_gdf = gpd.read_file("C:/Users/IHiggins/OneDrive - King County/cache_render_gis_data/WTD_service_area.geojson")
-    full_gdf = full_gdf.to_crs("EPSG:4326")
+    full_gdf = read_layer(cache_path("WTD_service_area.geojson"))
+    full_gdf = display(full_gdf)
     return full_gdf
 
 
+@instrumented
 def basin_import():
     """Import or download watershed basins from King County GIS"""
-    cache_path = "C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/watersheds.geojson"
+    basins_path = cache_path("watersheds.geojson")
     
-    if os.path.exists(cache_path):
+    if os.path.exists(basins_path):
         print("Loading cached watersheds")
-        return gpd.read_file(cache_path)
+        return apply_schema(read_layer(basins_path), "watersheds")
     
     print("Downloading watersheds from King County GIS")
     try:
         geojson_url = "https://gisdata.kingcounty.gov/arcgis/rest/services/OpenDataPortal/enviro___base/MapServer/237/query?outFields=*&where=1%3D1&f=geojson"
-        watersheds = gpd.read_file(geojson_url)
-        watersheds = watersheds.to_crs('EPSG:4326')
+        watersheds = read_layer(geojson_url)
+        watersheds = display(watersheds)
         watersheds = watersheds.drop(columns=["OBJECTID_1", "CONDITION"], errors='ignore')
         watersheds = watersheds.rename(columns={"STUDY_UNIT": "basin"})
         watersheds = watersheds.set_index("OBJECTID")
-        watersheds.to_file(cache_path, driver="GeoJSON")
-        return watersheds
+        write_layer(watersheds, basins_path)
+        return apply_schema(watersheds, "watersheds")
     except Exception as e:
         print(f"Error fetching watersheds: {e}")
         return None
 
 
+@instrumented
 def filter_site_basins(sites_gdf, watersheds):
-    """Assign basin to each site using spatial join"""
-    sites_gdf = gpd.sjoin(sites_gdf, watersheds, how='left', predicate='intersects')
-    sites_gdf = sites_gdf.drop(columns=["index_right"], errors='ignore')
-    return sites_gdf
+    """Assign basin to each site, from the persisted site -> basin index (new or moved sites are spatially joined)"""
+    sites_gdf = attach_basins(sites_gdf, watersheds)
+    return apply_schema(sites_gdf, "sites")
 
 
-def wtd_basins(sites_gdf, basins, wtd_service_area, intersect_fraction):
-    """Filter basins to those in WTD service area and mark sites accordingly"""
+@instrumented
+def basin_intersect_frac(basins, wtd_service_area):
+    """Fraction of each basin's area inside the WTD service area, returned in the projected crs"""
     #wtd_basins = basins[basins.intersects(wtd_service_area.union_all())]
     # Union all service areas into a single geometry
     # Assuming both are GeoDataFrames in the same CRS
-    projected_crs = "EPSG:2285"  # good for King County / Seattle area
-
-    basins_proj = basins.to_crs(projected_crs)
-    wtd_service_area_proj = wtd_service_area.to_crs(projected_crs)
+    # layer_registry.PROJECTED_CRS, the same projected crs the other area and buffer steps use
+    basins_proj = projected(basins)
+    wtd_service_area_proj = projected(wtd_service_area)
 
     # Union all service area polygons into one
     wtd_union = wtd_service_area_proj.unary_union
@@ -116,33 +195,92 @@ def wtd_basins(sites_gdf, basins, wtd_service_area, intersect_fraction):
     basins_proj["basin_area"] = basins_proj.geometry.area
     basins_proj["intersect_frac"] = basins_proj["intersect_area"] / basins_proj["basin_area"]
     basins_proj["intersect_frac"] = basins_proj["intersect_frac"].round(2)
-    # Filter for basins where 50% or more overlaps
-    wtd_basins = basins_proj[basins_proj["intersect_frac"] >= intersect_fraction]
-
-    # (Optional) convert back to your original CRS for mapping
-    wtd_basins = wtd_basins.to_crs(basins.crs)
+    return basins_proj
+
+
+@instrumented
+def mark_wtd_sites(sites_gdf, basins, intersect_fraction, basin_fracs=None):
+    """Flag sites in a basin that is at least intersect_fraction inside the WTD service area and add that basin's
+    intersect fraction, both kept in the site -> basin index with the threshold they were worked out for
+    basin_fracs (from basin_intersect_frac) is only needed when the index has none or they changed"""
+    index = update_index(sites_gdf, basins, basin_fracs, intersect_fraction=intersect_fraction)
+    in_wtd = index_values(sites_gdf, index, "wtd_service_area", False).astype(bool)
+    sites_gdf['WTD Service Area'] = in_wtd
+    sites_gdf["Intersect_Frac"] = np.where(in_wtd, index_values(sites_gdf, index, "intersect_frac"), np.nan)
+    return sites_gdf
 
-    wtd_basins = wtd_basins[wtd_basins.intersects(sites_gdf.union_all())]
-    
-    sites_gdf['WTD Service Area'] = sites_gdf.geometry.apply(
-        lambda point: wtd_basins.intersects(point).any()
-    )
-    # add intersect fract to sites
-    from shapely.ops import nearest_points
 
-    def get_intersect_frac(point, basins):
-        for _, basin in basins.iterrows():
-            if basin.geometry.intersects(point):
-                return basin["intersect_frac"]
-        return None
+@instrumented
+def wtd_basins(sites_gdf, basins, wtd_service_area, intersect_fraction, basin_fracs=None):
+    """Filter basins to those in WTD service area and mark sites accordingly"""
+    if basin_fracs is None:
+        basin_fracs = basin_intersect_frac(basins, wtd_service_area)
+    # Filter for basins where 50% or more overlaps
+    # back in the display crs, basin_fracs was projected from basins so this comes from the projection cache
+    wtd_basins = display(basin_fracs)
+    wtd_basins = wtd_basins[wtd_basins["intersect_frac"] >= intersect_fraction]
 
-    sites_gdf["Intersect_Frac"] = sites_gdf.geometry.apply(lambda p: get_intersect_frac(p, wtd_basins))
+    wtd_basins = wtd_basins[wtd_basins.intersects(sites_gdf.union_all())]
     
-    return wtd_basins, sites_gdf
+    # the site flags and fractions come from (and are kept in) the site -> basin index for the app
+    sites_gdf = mark_wtd_sites(sites_gdf, basins, intersect_fraction, basin_fracs)
+    
+    return wtd_basins, apply_schema(sites_gdf, "sites")
+
+
+@instrumented
+def update_sites_incremental(sites_gdf, basins, wtd_service_area, intersect_fraction, snapshot_path=None):
+    """Assign basins and WTD flags only to sites added or moved since the last processed snapshot
+    everything is reprocessed when the basins, service area or intersect fraction change
+    only this per-site processing is incremental, the outputs are not patched: when anything changed __main__
+    rewrites the csv and layers and rebuilds both maps in full (each map is one page embedding every site),
+    and it skips all of them when nothing did
+    returns wtd basins, processed sites, the site diff and the snapshot to save_snapshot(*snapshot) once every
+    output is written, so a run that fails part way reprocesses the same changes next time"""
+    snapshot_path = snapshot_path or default_snapshot_path()
+    sites_gdf = sites_gdf.copy()
+    sites_gdf[KEY_COLUMN] = site_keys(sites_gdf)
+    sites_gdf["_order"] = range(len(sites_gdf))
+    basin_key = f"{layer_fingerprint(basins)}|{layer_fingerprint(wtd_service_area)}|{intersect_fraction}|{PROJECTED_CRS}|v{SITE_CACHE_VERSION}"
+    fracs_path = snapshot_path.replace(".parquet", "_basin_fracs.parquet")
+    snapshot, meta = load_snapshot(snapshot_path)
+
+    if snapshot is None or meta.get("basins") != basin_key or not os.path.exists(fracs_path):
+        print("no matching site snapshot, processing all sites")
+        basin_fracs = basin_intersect_frac(basins, wtd_service_area)
+        basin_fracs.to_parquet(fracs_path)
+        processed = filter_site_basins(sites_gdf, basins)
+        basins_filter, processed = wtd_basins(processed, basins, wtd_service_area, intersect_fraction, basin_fracs)
+        diff = {"added": list(sites_gdf[KEY_COLUMN]), "removed": [], "moved": [], "changed": []}
+    else:
+        basin_fracs = gpd.read_parquet(fracs_path)
+        threshold_basins = display(basin_fracs)
+        threshold_basins = threshold_basins[threshold_basins["intersect_frac"] >= intersect_fraction]
+        diff = diff_sites(sites_gdf, snapshot)
+        print(f"site changes: {diff_summary(diff)}")
+        rerun = set(diff["added"]) | set(diff["moved"])
+
+        # sites that did not move keep the basin columns from the snapshot
+        computed_columns = [c for c in snapshot.columns if c not in sites_gdf.columns]
+        kept = sites_gdf[~sites_gdf[KEY_COLUMN].isin(rerun)]
+        processed = [kept.merge(snapshot[[KEY_COLUMN] + computed_columns], on=KEY_COLUMN, how="left")]
+
+        new_sites = sites_gdf[sites_gdf[KEY_COLUMN].isin(rerun)]
+        if not new_sites.empty:
+            new_sites = filter_site_basins(new_sites, basins)
+            processed.append(mark_wtd_sites(new_sites, basins, intersect_fraction, basin_fracs))
+
+        processed = pd.concat(processed).sort_values("_order", kind="stable").reset_index(drop=True)
+        processed = apply_schema(gpd.GeoDataFrame(processed, geometry="geometry", crs=sites_gdf.crs), "sites")
+        basins_filter = threshold_basins[threshold_basins.intersects(processed.union_all())]
+
+    snapshot = (processed, {"basins": basin_key}, snapshot_path)
+    return basins_filter, processed.drop(columns=[KEY_COLUMN, "_order"]), diff, snapshot
 
 
 def add_map_legend(m, layer_name='WTD Sites', show=True):
     """Add legend to map"""
+    import folium
     legend_html = f'''
     <div id="parameter-legend" style="
         position: fixed; bottom: 10px; right: 10px; width: 250px;
@@ -199,6 +337,7 @@ def add_map_legend(m, layer_name='WTD Sites', show=True):
 
 def add_isp_map_legend(m, layer_name='ISP Sites', show=True):
     """Add legend to map"""
+    import folium
     #  # isp = '#fee08b'  # or blue #8bc9fe non isp = '#D53E4F'
     legend_html = f'''
     <div id="parameter-legend" style="
@@ -259,8 +398,43 @@ def add_isp_map_legend(m, layer_name='ISP Sites', show=True):
     m.get_root().html.add_child(folium.Element(legend_html))
     return m
 
-def add_sites_colored_by_parameter(m, sites_gdf, layer_name='Sites by Parameter', show=True, radius=6):
+# popup and tooltip templates for site markers, filled in the browser from each site's properties
+SITE_POPUP = """
+            <b>Site: {site}</b><br>
+            Site Name: {site_name}<br>
+            Parameter: {parameter}<br>
+            WRIA: {WRIA}<br>
+            Program: {program}<br>
+            Notes: {notes}
+        """
+SITE_POPUP_COLUMNS = {'site': 'N/A', 'site_name': 'N/A', 'parameter': 'N/A', 'WRIA': 'N/A', 'program': 'N/A', 'notes': ''}
+
+
+def site_properties(sites_gdf, positions):
+    """popup properties of the sites at positions as text, columns missing from the table get their default"""
+    properties = {}
+    for col, default in SITE_POPUP_COLUMNS.items():
+        if col in sites_gdf:
+            properties[col] = sites_gdf[col].to_numpy(dtype=object)[positions].astype(str)
+        else:
+            properties[col] = np.full(len(positions), default, dtype=object)
+    return properties
+
+
+def site_marker_layer(x, y, properties, colors, cluster=None, **kwargs):
+    """SiteMarkerLayer of the sites, or a ClusteredSiteLayer when cluster is True or a dict of cluster_levels options"""
+    from map_layers import SiteMarkerLayer, ClusteredSiteLayer, point_features
+    data = point_features(x, y, properties)
+    if not cluster:
+        return SiteMarkerLayer(data, **kwargs)
+    options = cluster if isinstance(cluster, dict) else {}
+    return ClusteredSiteLayer(data, cluster_levels(x, y, colors, **options), **kwargs)
+
+
+@instrumented
+def add_sites_colored_by_parameter(m, sites_gdf, layer_name='Sites by Parameter', show=True, radius=6, cluster=None):
     """Add sites to map with colors based on parameter type"""
+    import folium
     if sites_gdf.empty:
         return m
     
@@ -274,247 +448,168 @@ def add_sites_colored_by_parameter(m, sites_gdf, layer_name='Sites by Parameter'
     }
     
     sites_layer = folium.FeatureGroup(name=layer_name, show=show)
-    
-    for idx, row in sites_gdf.iterrows():
-        # Get site information
-        site = row.get('site', 'N/A')
-        site_name = row.get('site_name', 'N/A')
-        parameter = row.get('parameter', 'unknown')
-        wria = row.get('WRIA', 'N/A')
-        program = row.get('program', 'N/A')
-        notes = row.get('notes', '')
-        
-        # Determine color
-        if pd.isna(parameter):
-            color = parameter_colors['nan']
-            parameter = 'N/A'
-        else:
-            color = parameter_colors.get(parameter, 'gray')
-        
-        # Create popup and tooltip
-        popup_text = f"""
-            <b>Site: {site}</b><br>
-            Site Name: {site_name}<br>
-            Parameter: {parameter}<br>
-            WRIA: {wria}<br>
-            Program: {program}<br>
-            Notes: {notes}
-        """
-        tooltip_text = f"{site} {site_name}"
-        
-        folium.CircleMarker(
-            location=[row.geometry.y, row.geometry.x],
-            radius=radius,
-            popup=folium.Popup(popup_text, max_width=300),
-            tooltip=folium.Tooltip(tooltip_text, permanent=False),  
-            color=color,
-            fillColor=color,
-            fillOpacity=1,
-            weight=0,
-        ).add_to(sites_layer)
+    positions = np.arange(len(sites_gdf))
+    properties = site_properties(sites_gdf, positions)
+    parameter = sites_gdf['parameter'] if 'parameter' in sites_gdf else pd.Series('unknown', index=sites_gdf.index)
+    properties['color'] = parameter.map(parameter_colors).fillna('gray').to_numpy(dtype=object)
+    properties['parameter'] = np.where(parameter.isna(), 'N/A', properties['parameter'])
+    
+    site_marker_layer(
+        sites_gdf.geometry.x.to_numpy(), sites_gdf.geometry.y.to_numpy(), properties, properties['color'], cluster=cluster,
+        marker_options={'radius': radius, 'fillOpacity': 1, 'weight': 0},
+        popup=SITE_POPUP,
+        tooltip="{site} {site_name}",
+    ).add_to(sites_layer)
     
     sites_layer.add_to(m)
     return m
 
 
+@instrumented
 def add_filtered_sites(m, sites_gdf, parameter_filter=None, program_filter=None, 
                        exclude_empty_notes=False, layer_name='Sites', 
-                       color='black', fill_color = 'black', weight = 0, show=True, radius=5):
-    """Add filtered sites to map"""
+                       color='black', fill_color = 'black', weight = 0, show=True, radius=5,
+                       site_filter=None, groups=None, cluster=None):
+    """Add filtered sites to map
+    site_filter is a site layer filter (see MAP_SPECS), groups a SiteGroups of sites_gdf shared between layers
+    so the table is indexed once rather than masked and copied for every layer, cluster draws the layer as
+    precomputed clusters (True, or a dict of site_clusters.cluster_levels options)"""
+    import folium
     if sites_gdf.empty:
         return m
     
-    filtered_sites = sites_gdf.copy()
-    
     # Apply filters
+    site_filter = dict(site_filter or {})
     if parameter_filter is not None:
         if isinstance(parameter_filter, str):
             parameter_filter = [parameter_filter]
-        filtered_sites = filtered_sites[filtered_sites['parameter'].isin(parameter_filter)]
-    
+        site_filter['parameter'] = list(parameter_filter)
     if program_filter is not None:
-        #if isinstance(program_filter, str):
-        #    program_filter = [program_filter]
-        filtered_sites = filtered_sites[filtered_sites['program'] == program_filter]
-    
+        site_filter['program'] = program_filter
     if exclude_empty_notes:
-        filtered_sites = filtered_sites[
-            filtered_sites['notes'].notna() & 
-            (filtered_sites['notes'].astype(str).str.strip() != '')
-        ]
+        site_filter['notes'] = {"not_blank": True}
+    groups = groups if groups is not None else SiteGroups(sites_gdf)
+    positions = groups.positions(site_filter)
     
-    if filtered_sites.empty:
+    if not len(positions):
         return m
     
     sites_layer = folium.FeatureGroup(name=layer_name, show=show)
+    x, y = groups.xy()
     
-    for idx, row in filtered_sites.iterrows():
-        popup_text = f"""
-            <b>Site: {row.get('site', 'N/A')}</b><br>
-            Site Name: {row.get('site_name', 'N/A')}<br>
-            Parameter: {row.get('parameter', 'N/A')}<br>
-            WRIA: {row.get('WRIA', 'N/A')}<br>
-            Program: {row.get('program', 'N/A')}<br>
-            Notes: {row.get('notes', '')}
-        """
-        
-        folium.CircleMarker(
-            location=[row.geometry.y, row.geometry.x],
-            radius=radius,
-            popup=folium.Popup(popup_text, max_width=300),
-            tooltip=f"Site: {row.get('site', 'N/A')}",
-            color=color,
-            fillColor=fill_color,
-            fillOpacity=1,
-            weight=weight,
-        ).add_to(sites_layer)
+    # one FeatureCollection for the layer, markers and popups are built in the browser
+    site_marker_layer(
+        x[positions], y[positions], site_properties(sites_gdf, positions), np.full(len(positions), fill_color), cluster=cluster,
+        marker_options={'radius': radius, 'color': color, 'fillColor': fill_color, 'fillOpacity': 1, 'weight': weight},
+        popup=SITE_POPUP,
+        tooltip="Site: {site}",
+    ).add_to(sites_layer)
     
     sites_layer.add_to(m)
     return m
 
 
-def create_map(sites_gdf, wtd_service_area, wtd_basins):
-    """Create Folium map with sites and WTD service area"""
-    
-    # Center map on sites
-    """bounds = sites_gdf.total_bounds
-    center_lat = (bounds[1] + bounds[3]) / 2
-    center_lon = (bounds[0] + bounds[2]) / 2"""
-    # set bounds to WTD service area
-    bounds = wtd_service_area.total_bounds
-    center_lat = (bounds[1] + bounds[3]) / 2
-    center_lon = (bounds[0] + bounds[2]) / 2
-    
-    # Create base map
-    m = folium.Map(
-        location=[center_lat, center_lon+.1],
-        zoom_start=10,
-        zoom_control=True,
-        scrollWheelZoom=True,
-        doubleClickZoom=True,
-        tiles=None
-    )
-    
-    # Add base layers
-    folium.TileLayer(
-        tiles='OpenStreetMap',
-        name='Street Map',
-        overlay=False,
-        control=True,
-        show = False,
-    ).add_to(m)
-    # Add base layers
-    folium.TileLayer(
-        tiles="Cartodb Positron",
-        name='Simple Carto',
-        overlay=False,
-        control=True,
-        show = True,
-    ).add_to(m)
+# base maps by the name shown in the layer control
+BASE_TILES = {
+    "Street Map": {"tiles": "OpenStreetMap"},
+    "Simple Carto": {"tiles": "Cartodb Positron"},
+    "Dark Carto": {"tiles": "Cartodb dark_matter"},
+    "Satellite": {"tiles": "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}", "attr": "Esri"},
+}
+
+WTD_SERVICE_AREA_LAYER = {
+    "layer": "wtd_service_area", "name": "WTD Service Area", "show": True, "tooltip": "WTD Service Area Boundary",
+    "style": {'fillColor': 'transparent', 'color': '#AF6D23', 'weight': 2, 'dashArray': '10, 5', 'fillOpacity': 0},
+}
+
+# what each map shows, build_maps() makes any number of them from one set of loaded layers
+# site_layers filters are looked up in a SiteGroups index, see site_groups for the filter format, a site layer with
+# "cluster": True (or a dict of site_clusters.cluster_levels options such as radius and max_zoom) is drawn as clusters
+# besides the screenshot a spec can list "exports", {"output": path, "window_size": (w, h), "format": "png" or "pdf"}
+# dicts for other sizes and pdfs, see map_export
+# https://wondernote.org/color-palettes-for-web-digital-blog-graphic-design-with-hexadecimal-codes/
+MAP_SPECS = {
+    "wtd": {
+        "output": "data/wtd_map.html",
+        "screenshot": "data/wtd_map.png",
+        "window_size": (729, 943),
+        "tiles": [("Street Map", False), ("Simple Carto", True), ("Dark Carto", False), ("Satellite", False)],
+        "layers": [
+            WTD_SERVICE_AREA_LAYER,
+            {"layer": "wtd_basins", "name": "WTD Basins", "show": False, "tooltip": "WTD Basins",
+             "style": {'fillColor': '#20B2AA', 'color': 'black', 'weight': 1, 'fillOpacity': 0.5}},
+        ],
+        "site_layers": [
+            {"name": "Stream Gage Sites", "filter": {"parameter": "discharge", "WTD vs SWM": "WTD"},
+             "fill_color": "#009E73", "color": "black", "weight": 1, "radius": 6},
+            {"name": "Rain Gage Sites", "filter": {"parameter": {"not": "discharge"}, "WTD vs SWM": "WTD"},
+             "fill_color": "#56B4E9", "color": "black", "weight": 1, "radius": 6},
+        ],
+        "legends": [(add_map_legend, "discharge sites"), (add_map_legend, "other stream gage sites")],
+    },
+    "isp": {
+        "output": "data/isp_map.html",
+        "screenshot": "data/isp_map.png",
+        "window_size": (729, 943),
+        "tiles": [("Simple Carto", True), ("Dark Carto", False), ("Street Map", False), ("Satellite", False)],
+        # no WTD basins on the ISP map
+        "layers": [WTD_SERVICE_AREA_LAYER],
+        "site_layers": [
+            {"name": "Sites Supporting ISP, WQBE and WQI", "filter": {"program": "Sites Supporting ISP, WQBE and WQI"},
+             "fill_color": "#D55E00", "color": "black", "weight": 1, "radius": 5},
+            {"name": "Sites Supporting WQI and other programs", "filter": {"program": "Sites Supporting WQI and other programs"},
+             "fill_color": "#F0E442", "color": "black", "weight": 1, "radius": 5},
+            {"name": "SWM Funded ISP Site", "filter": {"program": "SWM Funded ISP Site"},
+             "fill_color": "#009E73", "color": "black", "weight": 1, "radius": 5},
+        ],
+        "legends": [(add_isp_map_legend, "Sites Supporting ISP, WQBE and WQI"),
+                    (add_isp_map_legend, "Sites Supporting WQI and other programs"),
+                    (add_isp_map_legend, "SWM Funded ISP Site")],
+    },
+}
+
+
+# how shared layers are embedded in the pages, topojson quantizes coordinates and stores shared boundaries once
+GEOMETRY_ENCODINGS = ("geojson", "topojson")
+
+
+def shared_layers(layers, encoding="geojson"):
+    """serializes each non-empty layer once for every map that uses it,
+    {key: {"data": geojson or topojson text, "encoding": encoding, "bounds": bounds}}
+    with topojson the layers are encoded together, every layer's data is the same topology (one object per key)
+    so a boundary two layers share is stored once"""
+    if encoding not in GEOMETRY_ENCODINGS:
+        raise ValueError(f"unknown geometry encoding {encoding!r}, expected one of {GEOMETRY_ENCODINGS}")
+    from map_layers import serialize_layer
+    frames = {key: display(gdf) for key, gdf in layers.items() if gdf is not None and not gdf.empty}
+    topology = serialize_topology(frames) if encoding == "topojson" and frames else None
+    return {
+        key: {"data": topology if encoding == "topojson" else serialize_layer(gdf), "encoding": encoding, "bounds": gdf.total_bounds}
+        for key, gdf in frames.items()
+    }
 
-    m.get_root().html.add_child(folium.Element("""
-        <style>
-            .leaflet-tile-pane {
-                filter: brightness(0.9);  /* Adjust value: 0.5 = 50% brightness, 1.0 = normal */
-            }
-        </style>
-    """))
-    # CartoDB Dark Matter (dark theme)
-    folium.TileLayer(
-        tiles="Cartodb dark_matter",
-        name='Dark Carto',
-        overlay=False,
-        control=True,
-        show=False,
-    ).add_to(m)
- 
-    folium.TileLayer(
-        tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-        attr='Esri',
-        name='Satellite',
-        overlay=False,
-        control=True,
-        show=False
-    ).add_to(m)
-    
-    # Add WTD service area boundary
-    if wtd_service_area is not None and not wtd_service_area.empty:
-        wtd_layer = folium.FeatureGroup(name='WTD Service Area', show=True)
-        folium.GeoJson(
-            wtd_service_area,
-            style_function=lambda x: {
-                'fillColor': 'transparent',
-                'color': '#AF6D23',
-                'weight': 2,
-                'dashArray': '10, 5',
-                'fillOpacity': 0
-            },
-            tooltip="WTD Service Area Boundary"
-        ).add_to(wtd_layer)
-        wtd_layer.add_to(m)
-    
-    # Add WTD basins
-    if wtd_basins is not None and not wtd_basins.empty:
-        wtd_basin_layer = folium.FeatureGroup(name='WTD Basins', show=False)
-        folium.GeoJson(
-            wtd_basins,
-            style_function=lambda x: {
-                'fillColor': '#20B2AA',
-                'color': 'black',
-                'weight': 1,
-                'fillOpacity': 0.5
-            },
-            tooltip="WTD Basins"
-        ).add_to(wtd_basin_layer)
-        wtd_basin_layer.add_to(m)
-    
-    # Add sites
-    # https://wondernote.org/color-palettes-for-web-digital-blog-graphic-design-with-hexadecimal-codes/
-    #wtd_sites = sites_gdf[sites_gdf["WTD Service Area"] == True]
-    #add_sites_colored_by_parameter(m, sites_gdf, layer_name='Sites by Parameter', show=True, radius=6)
-    # discharge sites
-    discharge_sites = sites_gdf[(sites_gdf["parameter"] == "discharge") & (sites_gdf["WTD vs SWM"] == "WTD")]
-    non_discharge_sites = sites_gdf[(sites_gdf["parameter"] != "discharge") & (sites_gdf["WTD vs SWM"] == "WTD")]
-   
-    #add_filtered_sites(m, non_wtd_sites, layer_name='Non WTD Sites', color='#969696', show=True, radius=6)
-    add_filtered_sites(m, discharge_sites, layer_name='Stream Gage Sites', fill_color='#009E73', color = 'black', weight = 1,show=True, radius=6)
-    add_filtered_sites(m, non_discharge_sites, layer_name='Rain Gage Sites', fill_color='#56B4E9', color = 'black', weight = 1,show=True, radius=6)
-    # discharge '#00A5E2' other stream gage ##8DD7BF #e4a248'#8DD7BF'
-    # Add legend
-    add_map_legend(m, layer_name='discharge sites', show=True)
-    add_map_legend(m, layer_name='other stream gage sites', show=True)
-    # Add layer control
-    folium.LayerControl(collapsed=False, show=False).add_to(m)
-    
-    return m
 
-def create_isp_map(sites_gdf, wtd_service_area, wtd_basins):
-    """Create Folium map with sites and WTD service area"""
-    # filter out non wtd sites
-    #wtd_sites = sites_gdf[sites_gdf["WTD Service Area"] == True]
-    # Center map on sites
-    #bounds = sites_gdf.total_bounds
-    bounds = wtd_service_area.total_bounds
+@instrumented
+def build_map(spec, sites_gdf, shared, groups=None):
+    """Create a Folium map from a map spec, shared is the output of shared_layers() and groups a SiteGroups of sites_gdf"""
+    import folium
+    from map_layers import GeoJsonLayer, TopologyData, TopoJsonLayer
+    # set bounds to WTD service area
+    bounds = shared[spec.get("bounds_layer", "wtd_service_area")]["bounds"]
     center_lat = (bounds[1] + bounds[3]) / 2
     center_lon = (bounds[0] + bounds[2]) / 2
-    
+
     # Create base map
     m = folium.Map(
-        location=[center_lat, center_lon+ .1],  #center_lat+0.05 moves up/north a bit
+        location=[center_lat, center_lon + .1],
         zoom_start=10,
         zoom_control=True,
         scrollWheelZoom=True,
         doubleClickZoom=True,
         tiles=None
     )
-    folium.TileLayer(
-        tiles="Cartodb Positron",
-        name='Simple Carto',
-        overlay=False,
-        control=True,
-        show = True,
-    ).add_to(m)
-    # Add CSS to reduce brightness
+    for name, show in spec["tiles"]:
+        folium.TileLayer(name=name, overlay=False, control=True, show=show, **BASE_TILES[name]).add_to(m)
     m.get_root().html.add_child(folium.Element("""
         <style>
             .leaflet-tile-pane {
@@ -522,200 +617,143 @@ def create_isp_map(sites_gdf, wtd_service_area, wtd_basins):
             }
         </style>
     """))
-    # CartoDB Dark Matter (dark theme)
-    folium.TileLayer(
-        tiles="Cartodb dark_matter",
-        name='Dark Carto',
-        overlay=False,
-        control=True,
-        show=False,
-    ).add_to(m)
-    # Add base layers
-    folium.TileLayer(
-        tiles='OpenStreetMap',
-        name='Street Map',
-        overlay=False,
-        control=True,
-        show=False,
-    ).add_to(m)
-    
-    folium.TileLayer(
-        tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-        attr='Esri',
-        name='Satellite',
-        overlay=False,
-        control=True,
-        show=False
-    ).add_to(m)
-    
-    # Add WTD service area boundary
-    if wtd_service_area is not None and not wtd_service_area.empty:
-        wtd_layer = folium.FeatureGroup(name='WTD Service Area', show=True)
-        folium.GeoJson(
-            wtd_service_area,
-            style_function=lambda x: {
-                'fillColor': 'transparent',
-                'color': '#AF6D23',
-                'weight': 2,
-                'dashArray': '10, 5',
-                'fillOpacity': 0
-            },
-            tooltip="WTD Service Area Boundary"
-        ).add_to(wtd_layer)
-        wtd_layer.add_to(m)
-    # old orange #FFBF65 new green #48e48c # yellow
-    # Add WTD basins
-    if wtd_basins is not None and not wtd_basins.empty:
-        wtd_basin_layer = folium.FeatureGroup(name='WTD Basins', show=False)
-        folium.GeoJson(
-            wtd_basins,
-            style_function=lambda x: {
-                'fillColor': '#DEA059',
-                'color': 'black',
-                'weight': 1,
-                'fillOpacity': 0.5
-            },
-            tooltip="WTD Basins"
-        ).add_to(wtd_basin_layer)
-        wtd_basin_layer.add_to(m)
-    
-    # Add sites
-    #wtd_sites = sites_gdf[sites_gdf["WTD Service Area"] == True]
-    #add_sites_colored_by_parameter(m, wtd_sites, layer_name='Sites by Parameter', show=True, radius=6)
-    
-    
-    #add_filtered_sites(m, wtd_sites, parameter_filter=None, program_filter="ISP", 
-    #                   exclude_empty_notes=False, layer_name='ISP Sites', 
-    #                   color='grey', show=True, radius=5)
-
-    # New WTD ISP sites
-    # New WTD ISP/WQI sites
-    #  Non ISP sites
-    # SWM ISP sites
-
-    #Sites Supporting ISP, WQBE and WQI  Orange #F58427
-    #Sites Supporting WQI and other programs  tellow # D5C12A
-    #SWM Funded ISP Site  Blue #23AFA5
-
-    isp_wqbe_wqi = sites_gdf.loc[(sites_gdf["program"] == "Sites Supporting ISP, WQBE and WQI")]
-    wqi = sites_gdf.loc[(sites_gdf["program"] == "Sites Supporting WQI and other programs")]
-    swm = sites_gdf.loc[(sites_gdf["program"] == "SWM Funded ISP Site")]
-    
-    #Sites Supporting ISP, WQBE and WQI  Orange
-    add_filtered_sites(m, isp_wqbe_wqi, parameter_filter=None, program_filter=None, 
-                       exclude_empty_notes=False, layer_name="Sites Supporting ISP, WQBE and WQI", 
-                       fill_color='#D55E00', color = 'black', weight = 1,show=True, radius=5) # a red
-   
-   
-                 
-    # Add legend
-    add_isp_map_legend(m, layer_name="Sites Supporting ISP, WQBE and WQI", show=True)
-
-    #Sites Supporting WQI and other programs
-    add_filtered_sites(m, wqi, parameter_filter=None, program_filter=None, 
-                       exclude_empty_notes=False, layer_name="Sites Supporting WQI and other programs", 
-                       fill_color='#F0E442', color = 'black', weight = 1, show=True, radius=5) # yellow
-    # Add legend
-    add_isp_map_legend(m, layer_name="Sites Supporting WQI and other programs", show=True)
-    
-    #SWM funded ISP
-    add_filtered_sites(m, swm, parameter_filter=None, program_filter=None, 
-                       exclude_empty_notes=False, layer_name="SWM Funded ISP Site", 
-                       fill_color='#009E73', color = 'black', weight = 1, show=True, radius=5) # green
-    
-    # Add legend
-    add_isp_map_legend(m, layer_name="SWM Funded ISP Site", show=True)
-            
-    # isp = '#FFEC59' or blue #8bc9fe non isp = '#00B0BA'
-    #non_wtd_sites = sites_gdf[sites_gdf["WTD Service Area"] == False]
-    #add_filtered_sites(m, non_wtd_sites, layer_name='Non WTD Sites', color='#969696', show=True, radius=6)
-    
-    
+
+    # a topology several layers share is defined once in the page
+    topologies = {}
+    for layer in spec["layers"]:
+        if layer["layer"] not in shared:
+            continue
+        data = shared[layer["layer"]]
+        if data.get("encoding") == "topojson" and data["data"] not in topologies:
+            topologies[data["data"]] = TopologyData(data["data"]).add_to(m)
+        feature_group = folium.FeatureGroup(name=layer["name"], show=layer.get("show", True))
+        if data.get("encoding") == "topojson":
+            TopoJsonLayer(topologies[data["data"]], layer["layer"], style=layer.get("style"), tooltip=layer.get("tooltip")).add_to(feature_group)
+        else:
+            GeoJsonLayer(data["data"], style=layer.get("style"), tooltip=layer.get("tooltip")).add_to(feature_group)
+        feature_group.add_to(m)
+
+    groups = groups if groups is not None else SiteGroups(sites_gdf)
+    for site_layer in spec["site_layers"]:
+        add_filtered_sites(m, sites_gdf, site_filter=site_layer.get("filter"), groups=groups, layer_name=site_layer["name"],
+                           color=site_layer.get("color", "black"), fill_color=site_layer.get("fill_color", "black"),
+                           weight=site_layer.get("weight", 0), show=site_layer.get("show", True), radius=site_layer.get("radius", 5),
+                           cluster=site_layer.get("cluster"))
+
+    for add_legend, layer_name in spec.get("legends", []):
+        add_legend(m, layer_name=layer_name, show=True)
     # Add layer control
     folium.LayerControl(collapsed=False, show=False).add_to(m)
-    
     return m
-def save_map_screenshot(html_path, output_path, window_size=(729, 943)):
-    """Save map as static PNG screenshot"""
-    
-    # Read original HTML
-    with open(html_path, 'r', encoding='utf-8') as f:
-        html_content = f.read()
-    
-    # Create static version
-    static_code = """
-    <style>
-    .leaflet-container {
-        cursor: default !important;
-        pointer-events: none !important;
-    }
-    .leaflet-control-zoom,
-    .leaflet-control-attribution,
-    .leaflet-control-layers {
-        display: none !important;
-    }
-    </style>
-    </head>
-    """
-    
-    static_html = html_content.replace('</head>', static_code)
-    
-    # Save static version to temporary file
-    static_html_path = html_path.replace('.html', '_static.html')
-    with open(static_html_path, 'w', encoding='utf-8') as f:
-        f.write(static_html)
-    
-    # Take screenshot of static version
-    """chrome_options = Options()
-    chrome_options.add_argument('--headless')
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument(f'--window-size={window_size[0]},{window_size[1]}')"""
-    """driver = webdriver.Chrome(options=chrome_options)
-    html_uri = Path(static_html_path).resolve().as_uri()
-    driver.get(html_uri)
-    time.sleep(2)"""
-    
-    options = Options()
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--window-size=729,943")
-
-    driver = webdriver.Edge(options=options)
-    html_uri = Path(static_html_path).resolve().as_uri()
-    #driver.get(html_uri)
-    #driver.save_screenshot(output_path)
-    try:
-        driver.get(html_uri)
-        time.sleep(5)
-        driver.save_screenshot(output_path)
-    finally:
-        driver.close()
-        driver.quit()
-    #driver.save_screenshot(output_path)
-  
-
-    
 
-    ## Wait for page to render (optional)
-    #time.sleep(2)
 
-    # Use Chrome DevTools Protocol (CDP) to print to PDF
-    #pdf = driver.execute_cdp_cmd("Page.printToPDF", {
-    #    "printBackground": True,
-    #    "landscape": False
-    #})
-
-    # Save the base64-encoded PDF data to file
-    #with open(pdf_path, "wb") as f:
-    #    f.write(base64.b64decode(pdf['data']))
-
-   
-    # Optionally remove temporary static file
-    # os.remove(static_html_path)
+@instrumented
+def create_map(sites_gdf, wtd_service_area, wtd_basins):
+    """Create Folium map with sites and WTD service area"""
+    return build_map(MAP_SPECS["wtd"], sites_gdf, shared_layers({"wtd_service_area": wtd_service_area, "wtd_basins": wtd_basins}))
+
+
+@instrumented
+def create_isp_map(sites_gdf, wtd_service_area):
+    """Create Folium map with ISP sites and WTD service area"""
+    return build_map(MAP_SPECS["isp"], sites_gdf, shared_layers({"wtd_service_area": wtd_service_area}))
+
+
+def _build_and_save(spec, sites_gdf, shared, groups):
+    start = time.perf_counter()
+    m = build_map(spec, sites_gdf, shared, groups)
+    with stage(f"save {os.path.basename(spec['output'])}"):
+        m.save(spec["output"])
+    return spec["output"], time.perf_counter() - start
+
+
+def _spec_inputs(spec, sites_gdf, shared, groups):
+    """the sites and shared layers one map uses, so a worker process is only sent those
+    the sites are the rows any of the spec's site layers select, a filter picks the same rows from them"""
+    used = {layer["layer"] for layer in spec["layers"]} | {spec.get("bounds_layer", "wtd_service_area")}
+    positions = [groups.positions(site_layer.get("filter")) for site_layer in spec["site_layers"]]
+    rows = np.unique(np.concatenate([np.array([], dtype=np.intp), *positions]))
+    return sites_gdf.iloc[rows], {key: layer for key, layer in shared.items() if key in used}
+
+
+def _build_in_worker(spec, sites_gdf, shared):
+    """_build_and_save in a worker process, returns its stage, io and memory records with the result"""
+    clear_logs()
+    output, seconds = _build_and_save(spec, sites_gdf, shared, None)
+    return output, seconds, worker_records()
+
+
+def export_jobs(spec):
+    """the screenshot and extra exports of a map spec as map_export jobs"""
+    jobs = []
+    if spec.get("screenshot"):
+        jobs.append(export_job(spec["output"], spec["screenshot"], spec.get("window_size", (729, 943))))
+    for export in spec.get("exports", []):
+        jobs.append(export_job(spec["output"], export["output"], export.get("window_size", (729, 943)), export.get("format")))
+    return jobs
+
+
+@instrumented
+def build_maps(specs, sites_gdf, layers, screenshots=True, max_workers=None, geometry_encoding="geojson", publish=True,
+               max_browsers=2):
+    """builds, saves and screenshots every map in specs from one set of layers, returns {output: seconds}
+    layers ({key: GeoDataFrame}) are reprojected and serialized once and the same text goes into each map,
+    geometry_encoding is how (see GEOMETRY_ENCODINGS), max_workers > 1 builds the maps in parallel processes,
+    publish minifies and precompresses the pages and moves the layer data they share to one asset file,
+    the screenshots and exports of every map are rendered together on up to max_browsers headless browsers"""
+    shared = shared_layers(layers, geometry_encoding)
+    # every map's site layers are looked up in one index of the site table
+    groups = SiteGroups(sites_gdf)
+    if max_workers and max_workers > 1 and len(specs) > 1:
+        # each worker gets only its map's sites and layers and builds its own group index from them
+        inputs = [_spec_inputs(spec, sites_gdf, shared, groups) for spec in specs]
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = []
+            for output, seconds, records in pool.map(_build_in_worker, specs, *zip(*inputs)):
+                merge_records(records)
+                results.append((output, seconds))
+    else:
+        results = [_build_and_save(spec, sites_gdf, shared, groups) for spec in specs]
+    for output, seconds in results:
+        print(f"{output}: {seconds:.1f} s")
+    if publish:
+        published = publish_static([spec["output"] for spec in specs], [layer["data"] for layer in shared.values()])
+        for path, sizes in published.items():
+            print(f"{path}: " + ", ".join(f"{suffix or 'raw'} {size / 1e3:.0f} KB" for suffix, size in sizes.items()))
+    jobs = [job for spec in specs for job in export_jobs(spec)] if screenshots else []
+    if jobs:
+        print_exports(export_maps(jobs, max_browsers=max_browsers))
+    return dict(results)
+
+
+@instrumented
+def save_map_screenshot(html_path, output_path, window_size=(729, 943)):
+    """Save map as static PNG screenshot, or PDF when output_path ends in .pdf"""
+    result, = export_maps([export_job(html_path, output_path, window_size)], max_browsers=1)
+    if result["error"] is not None:
+        raise RuntimeError(f"screenshot of {html_path} failed: {result['error']}")
+    return result
 
 
 # Main execution
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="build the WTD and ISP site maps")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only reprocess sites changed since the last run, the outputs are still written in full "
+                             "when anything changed and skipped when nothing did")
+    parser.add_argument("--profile", nargs="?", const=cache_path("profile/wtd_sites"), metavar="DIR",
+                        help="run under the sampling profiler and write flamegraph stacks per stage to DIR")
+    parser.add_argument("--map-workers", type=int, default=None, metavar="N",
+                        help="build the maps in N parallel processes")
+    parser.add_argument("--browsers", type=int, default=2, metavar="N",
+                        help="render the screenshots and exports on up to N headless browsers at once")
+    parser.add_argument("--geometry-encoding", choices=GEOMETRY_ENCODINGS, default="geojson",
+                        help="embed the map layers as GeoJSON or as quantized TopoJSON with shared boundaries")
+    args = parser.parse_args()
+    if args.profile:
+        from profiling import start_profiler, finish_profiler
+        profiler = start_profiler()
+
     # Import data
     #sites_gdf = site_import(file_path="WTD_map/data/WTD_LTM_Gages.xlsx")
     sites_gdf = site_import(file_path="data/WTD_LTM_GageProposalFINAL.xlsx")
@@ -723,12 +761,18 @@ if __name__ == "__main__":
     basins = basin_import()
     
     # Process data
-    sites_gdf = filter_site_basins(sites_gdf, basins)
-    basins_filter, sites_gdf = wtd_basins(sites_gdf, basins, wtd_service_area, intersect_fraction = 0.10)
+    if args.incremental:
+        basins_filter, sites_gdf, site_changes, site_snapshot = update_sites_incremental(sites_gdf, basins, wtd_service_area, intersect_fraction = 0.10)
+        if diff_is_empty(site_changes) and os.path.exists("data/WTD_LTM_Gages_Modified.csv"):
+            print("No site changes, maps are up to date")
+            write_run_report(cache_path("wtd_sites_run_report.json"))
+            if args.profile:
+                finish_profiler(profiler, args.profile)
+            raise SystemExit(0)
+    else:
+        sites_gdf = filter_site_basins(sites_gdf, basins)
+        basins_filter, sites_gdf = wtd_basins(sites_gdf, basins, wtd_service_area, intersect_fraction = 0.10)
     
-    # Create and save map
-    m = create_map(sites_gdf, wtd_service_area, basins_filter)
-    m.save("data/wtd_map.html")
     # Export processed sites to CSV
     output_cols = [
         "site", "site_name", "parameter", "date installed", "latitude", "longitude",
@@ -736,33 +780,25 @@ if __name__ == "__main__":
         "Yearly Hours", "KM verified", "KM notes", "annual equipment cost", "WTD vs SWM"
     ]
     sites_gdf[output_cols].to_csv("data/WTD_LTM_Gages_Modified.csv", index=False)
-    
-    # Save screenshot
-    save_map_screenshot(
-        html_path='data/wtd_map.html',
-        output_path='data/wtd_map.png',
-        window_size=(729, 943)
-    )
-    
-    # remove wtd basins from mapping
-    basins_filter = None
-   
+    precompress("data/WTD_LTM_Gages_Modified.csv")
+
+    # layers the dash app serves by viewport
+    with stage("publish layers"):
+        publish_layer("wtd_sites", sites_gdf)
+        publish_layer("wtd_service_area", wtd_service_area)
+        publish_layer("wtd_basins", basins_filter)
+
+    # Create and save the WTD and ISP maps and their screenshots, the shared layers are serialized once
+    build_maps([MAP_SPECS["wtd"], MAP_SPECS["isp"]], sites_gdf,
+               {"wtd_service_area": wtd_service_area, "wtd_basins": basins_filter}, max_workers=args.map_workers,
+               geometry_encoding=args.geometry_encoding, max_browsers=args.browsers)
+    # only now that the csv, layers and maps are written are these sites processed
+    if args.incremental:
+        save_snapshot(*site_snapshot)
 
-    ### create filterd isp map
-    m = create_isp_map(sites_gdf, wtd_service_area, basins_filter)
-    m.save("data/isp_map.html")
-
-    # Save screenshot
-    #save_map_screenshot(
-    #    html_path='data/isp_map.html',
-    #    output_path='data/isp_map.png',
-    #    pdf_path='data/isp_map.pdf',
-    #    window_size=(729, 943)
-    #)
-    save_map_screenshot(
-        html_path='data/isp_map.html',
-        output_path='data/isp_map.png',
-        window_size=(729, 943)
-    )
     print("Map generation complete!")
-    print(f"Sites processed: {len(sites_gdf)}")
\ No newline at end of file
+    print(f"Sites processed: {len(sites_gdf)}")
+    print_summary()
+    write_run_report(cache_path("wtd_sites_run_report.json"))
+    if args.profile:
+        finish_profiler(profiler, args.profile)
\ No newline at end of file
@@ -0,0 +1,314 @@
+"""ISP map app, served with gunicorn application.app:server (see procfile)
+the map asks for the layers in its current viewport instead of loading a static html page with every feature,
+layer endpoints:
+    GET  /layers                              manifest of published layers and their versions
+    GET  /layers/<name>?bbox=minx,miny,maxx,maxy&zoom=z   simplified GeoJSON for the viewport
+a publish shows up in every worker on its next request (see layer_service), start the app with the pipeline's
+GIS_CACHE_DIR or LAYER_PUBLISH_DIR so it reads the layers the pipeline publishes"""
+import json
+import os
+import sys
+import uuid
+from datetime import datetime
+from dash import Dash, ctx, dcc, html, Input, Output, State, no_update
+from dotenv import load_dotenv
+from flask import Response, abort, jsonify, request
+
+# the pipeline modules live at the repo root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+import layer_service
+from config.reference_entry_config import reference_entry_grid
+from config.transect_entry_config import transect_entry_grid, transect_entry_table_default_rows
+from table_data import get_table_data
+from table_pages import fetch_request
+from table_writes import ChangeBuffer, flush_changes
+from transect_discharge import transect_discharge
+
+load_dotenv()
+USERNAME_PASSWORD_PAIRS = os.environ.get("USERNAME_PASSWORD_PAIRS")
+
+app = Dash(__name__, assets_folder=os.path.join(ROOT, "assets"), title="ISP map")
+server = app.server
+server.secret_key = os.environ.get("SECRET_KEY")
+if USERNAME_PASSWORD_PAIRS:
+    import dash_auth
+    dash_auth.BasicAuth(app, dict(pair.split(":") for pair in USERNAME_PASSWORD_PAIRS.split(",")))
+
+# King County
+DEFAULT_CENTER = {"lat": 47.45, "lon": -121.9}
+DEFAULT_ZOOM = 8
+
+LAYER_STYLES = {
+    "watersheds": {"type": "line", "color": "#1f4e79", "line": {"width": 1}},
+    "site_watersheds": {"type": "fill", "color": "rgba(31, 119, 180, 0.25)"},
+    "census": {"type": "fill", "color": "rgba(202, 176, 229, 0.35)"},
+    "wtd_service_area": {"type": "line", "color": "#d62728", "line": {"width": 2}},
+    "wtd_basins": {"type": "fill", "color": "rgba(44, 160, 44, 0.25)"},
+    "cso_points": {"type": "circle", "color": "#8c564b", "circle": {"radius": 4}},
+    "sites": {"type": "circle", "color": "#ff7f0e", "circle": {"radius": 6}},
+    "wtd_sites": {"type": "circle", "color": "#ff7f0e", "circle": {"radius": 6}},
+}
+DEFAULT_STYLE = {"type": "line", "color": "#444444"}
+
+# database tables behind the entry grids
+SITE_TABLE = "site"
+REFERENCE_TABLE = "reference"
+TRANSECT_TABLE = "transect"
+
+
+def parse_bbox(value):
+    if not value:
+        return None
+    bbox = tuple(float(v) for v in value.split(","))
+    if len(bbox) != 4:
+        raise ValueError("bbox needs minx,miny,maxx,maxy")
+    return bbox
+
+
+@server.route("/layers")
+def layer_manifest():
+    return jsonify(layer_service.manifest())
+
+
+@server.route("/layers/<name>")
+def layer_features(name):
+    try:
+        bbox = parse_bbox(request.args.get("bbox"))
+        zoom = request.args.get("zoom", type=float)
+    except ValueError as e:
+        abort(400, str(e))
+    try:
+        body, version = layer_service.query_layer(name, bbox, zoom)
+    except KeyError:
+        abort(404)
+    # the version changes whenever the pipeline publishes, so the browser can keep its copy until then
+    etag = f"{version}-{zoom}-{request.args.get('bbox', '')}"
+    if etag in request.if_none_match:
+        return Response(status=304)
+    response = Response(body, mimetype="application/geo+json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+app.layout = html.Div([
+    dcc.Dropdown(id="layer-select", multi=True, placeholder="layers"),
+    dcc.Graph(id="layer-map", style={"height": "90vh"}, config={"scrollZoom": True}),
+    dcc.Interval(id="manifest-poll", interval=60 * 1000),
+    html.Div([
+        dcc.Dropdown(id="site-select", placeholder="site"),
+        # the reference grid pages through the site's history from the server, see table_pages
+        reference_entry_grid(infinite=True),
+        # the transect grid holds the site's rows in the browser, the discharge readout and new rows need them
+        transect_entry_grid(),
+        html.Button("add row", id="add-transect-row"),
+        html.Button("new transect", id="new-transect"),
+        html.Div(id="transect-discharge"),
+        html.Button("save", id="save-edits"),
+        html.Div(id="save-status"),
+        # pending grid edits, kept in the browser so any worker can flush them
+        dcc.Store(id="reference-edits"),
+        dcc.Store(id="transect-edits"),
+    ], className="observation-entry-container"),
+])
+
+
+@app.callback(
+    Output("layer-select", "options"),
+    Output("layer-select", "value"),
+    Input("manifest-poll", "n_intervals"),
+    State("layer-select", "value"),
+)
+def layer_options(n_intervals, selected):
+    names = sorted(layer_service.manifest())
+    if selected is None:
+        selected = [name for name in names if name != "census"]
+    return [{"label": name, "value": name} for name in names], [name for name in selected if name in names]
+
+
+def viewport(relayout):
+    """(bbox, zoom, center) from the map's relayoutData, bbox is None before the first pan or zoom"""
+    relayout = relayout or {}
+    zoom = relayout.get("mapbox.zoom", DEFAULT_ZOOM)
+    center = relayout.get("mapbox.center", DEFAULT_CENTER)
+    corners = relayout.get("mapbox._derived", {}).get("coordinates")
+    if not corners:
+        return None, zoom, center
+    lons = [c[0] for c in corners]
+    lats = [c[1] for c in corners]
+    return (min(lons), min(lats), max(lons), max(lats)), zoom, center
+
+
+@app.callback(
+    Output("layer-map", "figure"),
+    Input("layer-select", "value"),
+    Input("layer-map", "relayoutData"),
+)
+def update_map(selected, relayout):
+    bbox, zoom, center = viewport(relayout)
+    layers = []
+    for name in selected or []:
+        try:
+            body, version = layer_service.query_layer(name, bbox, zoom)
+        except KeyError:
+            continue
+        layers.append({"source": json.loads(body), "sourcetype": "geojson", "below": "traces",
+                       **LAYER_STYLES.get(name, DEFAULT_STYLE)})
+    return {
+        # one empty trace so plotly draws the mapbox base map
+        "data": [{"type": "scattermapbox", "lat": [], "lon": [], "mode": "markers"}],
+        "layout": {
+            "mapbox": {"style": "open-street-map", "center": center, "zoom": zoom, "layers": layers},
+            "margin": {"l": 0, "r": 0, "t": 0, "b": 0},
+            # keeps the view where the user left it when the figure is replaced
+            "uirevision": "layer-map",
+        },
+    }
+
+
+@app.callback(
+    Output("site-select", "options"),
+    Input("manifest-poll", "n_intervals"),
+)
+def site_options(n_intervals):
+    sites = get_table_data(SITE_TABLE)
+    return sorted(sites["site"].dropna().astype(str).unique())
+
+
+@app.callback(
+    Output("reference-location-table", "filterModel"),
+    Input("site-select", "value"),
+)
+def site_filter(site):
+    # a new filter model makes the grid drop its loaded blocks and ask for the site's rows
+    if site is None:
+        return {}
+    return {"site": {"filterType": "text", "type": "equals", "filter": site}}
+
+
+@app.callback(
+    Output("reference-location-table", "getRowsResponse"),
+    Input("reference-location-table", "getRowsRequest"),
+    prevent_initial_call=True,
+)
+def reference_rows(request):
+    return fetch_request(REFERENCE_TABLE, request)
+
+
+@app.callback(
+    Output("transect_entry_table", "rowData"),
+    Input("site-select", "value"),
+    Input("save-status", "children"),
+)
+def transect_rows(site, save_status):
+    # reloaded after a save so new rows get the ids the database gave them
+    if site is None:
+        return []
+    return get_table_data(TRANSECT_TABLE, site).to_dict("records")
+
+
+def new_transect_key():
+    """key of a transect started in the grid, the time it was started"""
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+@app.callback(
+    Output("transect_entry_table", "rowTransaction"),
+    Output("transect-edits", "data", allow_duplicate=True),
+    Input("add-transect-row", "n_clicks"),
+    Input("new-transect", "n_clicks"),
+    State("transect_entry_table", "virtualRowData"),
+    State("transect-edits", "data"),
+    State("site-select", "value"),
+    prevent_initial_call=True,
+)
+def add_transect_row(add_clicks, new_clicks, rows, store, site):
+    if site is None:
+        return no_update, no_update
+    # add row continues the transect of the grid's last row, new transect starts another one
+    transect = (rows or [{}])[-1].get("transect") if ctx.triggered_id == "add-transect-row" else None
+    # a browser made id, flush_changes leaves it out and the database assigns the real one
+    row = {**transect_entry_table_default_rows(), "id": f"new-{uuid.uuid4().hex}", "site": site,
+           "transect": transect or new_transect_key()}
+    buffer = ChangeBuffer.from_dict(store, TRANSECT_TABLE)
+    buffer.defaults["site"] = site
+    return {"add": [row]}, buffer.add_rows([row]).to_dict()
+
+
+def _buffer_edits(table_name, changes, store, site):
+    if isinstance(changes, dict):
+        changes = [changes]
+    buffer = ChangeBuffer.from_dict(store, table_name)
+    buffer.defaults["site"] = site
+    return buffer.add(changes).to_dict()
+
+
+@app.callback(
+    Output("reference-edits", "data"),
+    Input("reference-location-table", "cellValueChanged"),
+    State("reference-edits", "data"),
+    State("site-select", "value"),
+    prevent_initial_call=True,
+)
+def buffer_reference_edits(changes, store, site):
+    return _buffer_edits(REFERENCE_TABLE, changes, store, site)
+
+
+@app.callback(
+    Output("transect-edits", "data"),
+    Input("transect_entry_table", "cellValueChanged"),
+    State("transect-edits", "data"),
+    State("site-select", "value"),
+    prevent_initial_call=True,
+)
+def buffer_transect_edits(changes, store, site):
+    return _buffer_edits(TRANSECT_TABLE, changes, store, site)
+
+
+@app.callback(
+    Output("save-status", "children"),
+    Output("reference-edits", "data", allow_duplicate=True),
+    Output("transect-edits", "data", allow_duplicate=True),
+    Input("save-edits", "n_clicks"),
+    State("reference-edits", "data"),
+    State("transect-edits", "data"),
+    prevent_initial_call=True,
+)
+def save_edits(n_clicks, reference_store, transect_store):
+    written = 0
+    errors = []
+    stores = []
+    for store in (reference_store, transect_store):
+        buffer = ChangeBuffer.from_dict(store)
+        try:
+            written += flush_changes(buffer)
+        except Exception as e:
+            errors.append(f"{buffer.table_name}: {e}")
+        # a failed flush keeps its edits so the next save retries them
+        stores.append(buffer.to_dict() if len(buffer) else None)
+    status = f"saved {written} rows" + "".join(f", error saving {error}" for error in errors)
+    return status, *stores
+
+
+@app.callback(
+    Output("transect-discharge", "children"),
+    Input("transect_entry_table", "virtualRowData"),
+)
+def show_transect_discharge(rows):
+    # the grid holds the site's whole history, one line per transect
+    lines = []
+    for transect, summary in transect_discharge(rows or []).items():
+        text = (f"{transect or 'no transect'}: "
+                f"discharge {summary['discharge_mid']:.2f} cfs (mid-section), {summary['discharge_mean']:.2f} cfs (mean-section), "
+                f"area {summary['area_mid']:.2f} sq ft, width {summary['wetted_width']:.2f} ft, "
+                f"mean velocity {summary['mean_velocity']:.2f} ft/s, {summary['verticals']:.0f} verticals")
+        if not summary["vertical_check"]:
+            text += f", one vertical carries {summary['max_vertical_fraction']:.0%} of the flow"
+        lines.append(html.Div(text))
+    return lines
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
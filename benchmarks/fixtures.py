@@ -0,0 +1,129 @@
+"""synthetic King County sized layers for benchmarking, written in the same shape as the cached source files"""
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.geometry import box, MultiPoint
+
+# roughly the extent of King County
+COUNTY_BOUNDS = (-122.55, 47.08, -121.06, 47.78)
+
+SCALES = {
+    # quick check that everything runs
+    "small": {"basins": 40, "tracts": 200, "nhd_lines": 1000, "sites": 150, "cso_points": 40},
+    # close to the real county layers
+    "county": {"basins": 300, "tracts": 3000, "nhd_lines": 20000, "sites": 3000, "cso_points": 450},
+}
+
+EHD_COLUMNS = ['Diesel_PM2_5_Emissions', 'Ozone_Concentration', 'PM2_5', 'Proximity_to_Heavy_Traffic_Ro_1',
+    'Toxic_Release_from_Facilities__', 'Lead_Risk_from_Housing', 'PTSDFs', 'PNPL', 'PRMP', 'PWDIS', 'LEP',
+    'No_HS_Diploma', 'POC', 'Poverty', 'Unaffordable_Housing', 'Unemployed', 'CVD', 'LBW',
+    'Environmental_Exposures_Theme_R', 'Environmental_Effects_Theme_Ran', 'Socioeconomic_Factors_Theme_Ran',
+    'Sensitive_Populations_Theme_Ran', 'Environmental_Health_Disparitie', 'Proximity_to_Heavy_Traffic_Road',
+    'Transportation_Expense']
+
+
+def random_points(rng, n, bounds=COUNTY_BOUNDS):
+    x = rng.uniform(bounds[0], bounds[2], n)
+    y = rng.uniform(bounds[1], bounds[3], n)
+    return x, y
+
+
+def voronoi_cells(rng, n, bounds=COUNTY_BOUNDS):
+    """n polygons tiling the bounds, neighbours share their boundaries like basins and tracts do"""
+    x, y = random_points(rng, n, bounds)
+    extent = box(*bounds)
+    cells = shapely.voronoi_polygons(MultiPoint(np.column_stack([x, y])), extend_to=extent)
+    cells = shapely.intersection(np.asarray(cells.geoms), extent)
+    return list(cells)
+
+
+def make_basins(rng, n):
+    cells = voronoi_cells(rng, n)
+    return gpd.GeoDataFrame({
+        "OBJECTID": np.arange(1, len(cells) + 1),
+        "OBJECTID_1": np.arange(1, len(cells) + 1),
+        "STUDY_UNIT": [f"Basin {i:03d}" for i in range(len(cells))],
+        "CONDITION": rng.choice(["High", "Medium", "Low"], len(cells)),
+    }, geometry=cells, crs="EPSG:4326")
+
+
+def make_tracts(rng, n):
+    cells = voronoi_cells(rng, n)
+    tracts = gpd.GeoDataFrame({
+        "TRACTCE10": [f"{i:06d}" for i in range(len(cells))],
+        "GEOID10": [f"53033{i:06d}" for i in range(len(cells))],
+        "CountyFIPS10": "033",
+        "County10": "King",
+    }, geometry=cells, crs="EPSG:4326")
+    for col in EHD_COLUMNS:
+        tracts[col] = rng.integers(1, 11, len(cells)).astype(float)
+        tracts[f"{col[:26]}Rank"] = tracts[col]
+    return tracts
+
+
+def make_nhd_lines(rng, n):
+    x, y = random_points(rng, n)
+    # short meandering segments, 4 to 12 vertices each
+    lines = []
+    for x0, y0 in zip(x, y):
+        steps = rng.normal(0, 0.002, (rng.integers(4, 13), 2)).cumsum(axis=0)
+        lines.append(shapely.LineString(steps + [x0, y0]))
+    return gpd.GeoDataFrame({
+        "OBJECTID": np.arange(1, n + 1),
+        "GNIS_Name": rng.choice(["Cedar River", "Green River", "Issaquah Creek", None], n),
+        "StreamOrder": rng.integers(1, 7, n).astype(float),
+        "FType": 460,
+        "FCode": 46006,
+    }, geometry=lines, crs="EPSG:4326")
+
+
+def make_sites(rng, n):
+    x, y = random_points(rng, n)
+    parameters = rng.choice(["discharge", "water_temperature", "precipitation"], n)
+    return pd.DataFrame({
+        "site": [f"{i:02d}{chr(65 + i % 26)}" for i in range(n)],
+        "site_name": [f"Synthetic site {i}" for i in range(n)],
+        "project": rng.choice(["ISP", "WQBE", "LTM"], n),
+        "notes": rng.choice(["", "telemetry", "seasonal"], n),
+        "parameter": parameters,
+        "program": rng.choice(["Sites Supporting ISP, WQBE and WQI", "Sites Supporting WQI and other programs", "SWM Funded ISP Site"], n),
+        "WTD vs SWM": rng.choice(["WTD", "SWM"], n),
+        "WRIA": rng.choice([7.0, 8.0, 9.0, 10.0], n),
+        "latitude": y,
+        "longitude": x,
+    })
+
+
+def make_cso_points(rng, n):
+    # combined sewer overflows sit along the west side of the county
+    x, y = random_points(rng, n, (-122.45, 47.45, -122.2, 47.75))
+    return gpd.GeoDataFrame({
+        "OBJECTID": np.arange(1, n + 1),
+        "DSN": [f"{i:03d}" for i in range(n)],
+        "OF_LABEL": [f"CSO {i}" for i in range(n)],
+        "OF_STATUS": rng.choice(["Active", "Controlled"], n),
+        "OF_OWNER": rng.choice(["King County", "Seattle"], n),
+    }, geometry=gpd.points_from_xy(x, y), crs="EPSG:4326")
+
+
+def make_wtd_service_area():
+    return gpd.GeoDataFrame({"NAME": ["WTD"]}, geometry=[box(-122.45, 47.25, -121.9, 47.78)], crs="EPSG:4326")
+
+
+def write_fixtures(cache_dir, scale="county", seed=0):
+    """writes the cached source files the pipeline reads into cache_dir, returns the in-memory sites table"""
+    sizes = SCALES[scale]
+    rng = np.random.default_rng(seed)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    basins = make_basins(rng, sizes["basins"])
+    watersheds = basins.drop(columns=["OBJECTID_1", "CONDITION"]).rename(columns={"STUDY_UNIT": "basin"})
+    watersheds.to_file(f"{cache_dir}/watersheds.geojson", driver="GeoJSON")
+    basins.to_file(f"{cache_dir}/environmental_condition_of_basins.geojson", driver="GeoJSON")
+    make_tracts(rng, sizes["tracts"]).to_file(f"{cache_dir}/EHD.geojson", driver="GeoJSON")
+    make_nhd_lines(rng, sizes["nhd_lines"]).to_file(f"{cache_dir}/nhd_centerlines.geojson", driver="GeoJSON")
+    make_cso_points(rng, sizes["cso_points"]).to_file(f"{cache_dir}/CSO_points.geojson", driver="GeoJSON")
+    make_wtd_service_area().to_file(f"{cache_dir}/WTD_service_area.geojson", driver="GeoJSON")
+    return make_sites(rng, sizes["sites"])
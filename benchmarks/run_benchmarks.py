@@ -0,0 +1,162 @@
+"""times the pipeline stages against synthetic fixtures, runs offline
+run from the repo root with: python -m benchmarks.run_benchmarks --scale county --compare latest
+results are saved to benchmarks/results so runs on different commits can be compared"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+import geopandas as gpd
+
+# the cache directory defaults to a Windows path, point it somewhere writable before any project module
+# is imported so nothing can resolve a cache path against the default
+os.environ.setdefault("GIS_CACHE_DIR", tempfile.mkdtemp(prefix="isp_bench_"))
+
+import gis_io
+import watershed_gis as ws
+import WTD_Sites_vs_2 as wtd
+from benchmarks.fixtures import write_fixtures
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def _rows(out):
+    if isinstance(out, tuple):
+        return [_rows(o) for o in out]
+    try:
+        return len(out)
+    except TypeError:
+        return None
+
+
+def timed(results, name, func, *args, allow_failure=False, **kwargs):
+    """runs func, records wall time and output rows under name and returns its output
+    with allow_failure an exception is recorded instead of stopping the run (for stages nothing else depends on)"""
+    print(f"running {name}")
+    start = time.perf_counter()
+    try:
+        out = func(*args, **kwargs)
+    except Exception as e:
+        if not allow_failure:
+            raise
+        results[name] = {"seconds": None, "rows_out": None, "error": f"{type(e).__name__}: {e}"}
+        print(f"  failed, {results[name]['error']}")
+        return None
+    seconds = time.perf_counter() - start
+    results[name] = {"seconds": round(seconds, 4), "rows_out": _rows(out)}
+    print(f"  {seconds:.2f} s")
+    return out
+
+
+def run_pipeline(sites):
+    """runs the watershed_gis pipeline in the same order as its __main__, timing each stage"""
+    results = {}
+    sites_gdf = gpd.GeoDataFrame(sites, geometry=gpd.points_from_xy(sites["longitude"], sites["latitude"]), crs="EPSG:4326")
+
+    watersheds = timed(results, "watershed_import", ws.watershed_import)
+    cso_gdf, watersheds = timed(results, "filter_cso_points", ws.filter_cso_points, watersheds, buffer_distance=1000)
+    wtd_area, watersheds = timed(results, "wtd_service_area", ws.wtd_service_area, watersheds)
+    sites_gdf = timed(results, "site_basin", ws.site_basin, sites_gdf, watersheds)
+    timed(results, "wtd_basins", wtd.wtd_basins, sites_gdf.copy(), watersheds, wtd_area, 0.10)
+    census_gdf = timed(results, "filter_census_data", ws.filter_census_data, sites_gdf, watersheds)
+    sites_gdf, watersheds, census_gdf = timed(results, "filter_environmental_health", ws.filter_environmental_health, sites_gdf, watersheds, census_gdf)
+    census_gdf, watersheds = timed(results, "watershed_condition", ws.watershed_condition, sites_gdf, census_gdf, watersheds)
+    site_watersheds = timed(results, "filter_watersheds", ws.filter_watersheds, sites_gdf, watersheds)
+    census_site_watersheds = timed(results, "crop_census_data", ws.crop_census_data, census_gdf, site_watersheds)
+    timed(results, "filter_nhd_centerlines", ws.filter_nhd_centerlines, watersheds)
+
+    m = timed(results, "create_map", ws.create_map, sites_gdf, watersheds, site_watersheds.copy(), census_site_watersheds,
+              None, cso_gdf, wtd_area, None, None)
+    timed(results, "create_map_html", lambda: m.get_root().render())
+    timed(results, "create_map_plotly", ws.create_map_plotly, sites_gdf, watersheds, site_watersheds.copy(), census_site_watersheds,
+          None, cso_gdf, wtd_area, None, None, allow_failure=True)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results, scale, seed):
+    import pandas as pd
+    import shapely
+    import folium
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = git_commit()
+    run = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "scale": scale,
+        "seed": seed,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "versions": {"pandas": pd.__version__, "geopandas": gpd.__version__, "shapely": shapely.__version__, "folium": folium.__version__},
+        "results": results,
+    }
+    path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d_%H%M%S}_{commit}_{scale}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"saved {path}")
+    return path
+
+
+def latest_result(scale, exclude=None):
+    paths = [p for p in sorted(glob.glob(os.path.join(RESULTS_DIR, f"*_{scale}.json"))) if p != exclude]
+    return paths[-1] if paths else None
+
+
+def compare_results(current, baseline_path, threshold=1.25, min_seconds=0.1):
+    """prints current timings against a saved run, returns the stages that got slower than threshold
+    stages faster than min_seconds in both runs are too noisy to flag"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\ncompared to {baseline['commit']} ({baseline['timestamp']})")
+    print(f"{'stage':<30}{'now s':>10}{'before s':>10}{'ratio':>8}")
+    regressions = []
+    for name, result in current.items():
+        if result["seconds"] is None:
+            print(f"{name:<30}{'failed':>10}")
+            continue
+        before = baseline["results"].get(name, {}).get("seconds")
+        if not before:
+            print(f"{name:<30}{result['seconds']:>10.2f}{'-':>10}{'-':>8}")
+            continue
+        ratio = result["seconds"] / before
+        slower = ratio > threshold and max(result["seconds"], before) >= min_seconds
+        flag = "  slower" if slower else ""
+        print(f"{name:<30}{result['seconds']:>10.2f}{before:>10.2f}{ratio:>8.2f}{flag}")
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the pipeline against synthetic King County sized layers")
+    parser.add_argument("--scale", choices=["small", "county"], default="county")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", help="where to write the fixtures, defaults to a temporary directory")
+    parser.add_argument("--compare", help="result file to compare against, or 'latest' for the previous run at this scale")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or gis_io.CACHE_DIR
+    # every loader and cache resolves its files through gis_io.cache_path when it is called
+    gis_io.CACHE_DIR = cache_dir
+    print(f"writing {args.scale} fixtures to {cache_dir}")
+    sites = write_fixtures(cache_dir, scale=args.scale, seed=args.seed)
+
+    results = run_pipeline(sites)
+    path = save_results(results, args.scale, args.seed)
+
+    baseline = latest_result(args.scale, exclude=path) if args.compare == "latest" else args.compare
+    if baseline:
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            raise SystemExit(f"slower than {baseline}: {', '.join(regressions)}")
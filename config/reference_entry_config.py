@@ -1,7 +1,14 @@
 import numpy as np
 from dash_ag_grid import AgGrid
 
-def reference_entry_grid():
+# rows per block the infinite row model asks the server for
+BLOCK_SIZE = 100
+
+def reference_entry_grid(infinite=False):
+     """infinite=True loads rows from the server a block at a time (see table_pages) instead of from rowData"""
+     grid_options = {"rowSelection": "single"}
+     if infinite:
+        grid_options.update({"cacheBlockSize": BLOCK_SIZE, "maxBlocksInCache": 10, "infiniteInitialRowCount": BLOCK_SIZE})
      return AgGrid(
         id='reference-location-table',
         columnDefs=[
@@ -13,6 +20,7 @@ def reference_entry_grid():
             {"field": "notes", "headerName": "notes", "editable": True},
         ],
         columnSize="sizeToFit",
-        dashGridOptions={"rowSelection": "single"},
+        dashGridOptions=grid_options,
+        rowModelType="infinite" if infinite else "clientSide",
         style={"height": "300px", "width": "100%"},
     )
\ No newline at end of file
@@ -3,11 +3,34 @@ import numpy as np
 from dash_ag_grid import AgGrid
 
 
-def transect_entry_grid():
+# rows per block the infinite row model asks the server for
+BLOCK_SIZE = 100
+
+
+def transect_entry_grid(infinite=False):
+    """infinite=True loads rows from the server a block at a time (see table_pages) instead of from rowData,
+    for browsing a site's history, delta row updates only apply to client side rows"""
+    grid_options = {
+            "rowSelection": "single",
+            "deltaRowDataMode": not infinite,
+            "enterMovesDown": True,
+            "enterMovesDownAfterEdit": True,
+            "stopEditingWhenCellsLoseFocus": True,
+            "function": "params => params.nextCellPosition",
+            "columnSizeAuto": "function (params) { params.api.sizeColumnsToFit(); }",
+            "singleClickEdit": True,
+    }
+    if infinite:
+        grid_options.update({"cacheBlockSize": BLOCK_SIZE, "maxBlocksInCache": 10, "infiniteInitialRowCount": BLOCK_SIZE})
     return  AgGrid(
         id='transect_entry_table',
         columnDefs=[
             {"field": "id", "headerName": "id", "editable": False, "hide": True, "flex": 1, "cellEditor": "agNumberCellEditor", "cellEditorParams": {"min": 0}},
+            # hidden, the infinite row model filters on it to show one site
+            {"field": "site", "headerName": "site", "editable": False, "hide": True},
+            # the measurement a vertical belongs to, discharge is computed per transect. the database table needs
+            # the column (ALTER TABLE transect ADD COLUMN transect text), flush_changes refuses edits to columns it lacks
+            {"field": "transect", "headerName": "transect", "editable": True, "flex": 1},
             {"field": "location", "headerName": "location", "editable": True, "flex": 1, "cellEditor": "agNumberCellEditor", "cellEditorParams": {"min": 0}},
             {"field": "depth", "headerName": "depth", "editable": True, "flex": 1, "cellEditor": "agNumberCellEditor", "cellEditorParams": {"min": 0}},
             {"field": "velocity", "headerName": "velocity", "editable": True, "flex": 1, "cellEditor": "agNumberCellEditor", "cellEditorParams": {"min": 0}},
@@ -15,17 +38,8 @@ def transect_entry_grid():
         ],
         columnSize="sizeToFit",
         defaultColDef={"sortable": False},
-        dashGridOptions= {
-            "rowSelection": "single",
-            "deltaRowDataMode": True,
-            "enterMovesDown": True,
-            "enterMovesDownAfterEdit": True,
-            "stopEditingWhenCellsLoseFocus": True,
-            "function": "params => params.nextCellPosition",
-            "columnSizeAuto": "function (params) { params.api.sizeColumnsToFit(); }",
-            "singleClickEdit": True,
-            
-                },
+        dashGridOptions=grid_options,
+        rowModelType="infinite" if infinite else "clientSide",
         getRowId="params.data.id", 
         style={"height": "300px", "width": "100%"},
     )
@@ -33,6 +47,7 @@ def transect_entry_table_default_rows():
     """ returns default rows and values for transect entry table"""
     return {
         "id": 0,
+        "transect": None,
         "location": np.nan,
         "depth": np.nan,
         "velocity": np.nan,
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import pandas as pd
+import geopandas as gpd
+from gis_io import cache_path, USE_ARROW
+
+# cleaned tables parsed from excel workbooks, stored as (geo)parquet next to a fingerprint of the workbook
+EXCEL_CACHE_NAME = "excel_cache"
+
+
+def excel_cache_dir():
+    """the cache directory, looked up on every call so a cache directory set after import is used"""
+    return cache_path(EXCEL_CACHE_NAME)
+
+
+def file_hash(path):
+    """sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(path):
+    """size, mtime and content hash of a workbook"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_hash(path)}
+
+
+def _cache_files(path, key):
+    name = hashlib.sha1(f"{os.path.abspath(path)}|{key}".encode("utf-8")).hexdigest()[:16]
+    stem = f"{excel_cache_dir()}/{Path(path).stem}_{name}"
+    return f"{stem}.parquet", f"{stem}.json"
+
+
+def load_cached(path, key=""):
+    """returns the cached table for a workbook, or None if there is no cache or the workbook changed
+    size is checked first, the content hash is only computed when the mtime moved"""
+    data_path, meta_path = _cache_files(path, key)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    stat = os.stat(path)
+    if meta["size"] != stat.st_size:
+        return None
+    if meta["mtime"] != stat.st_mtime:
+        # workbook was saved or copied, only re-read it if the contents changed
+        if meta["sha256"] != file_hash(path):
+            return None
+        meta["mtime"] = stat.st_mtime
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+    if meta.get("geo"):
+        return gpd.read_parquet(data_path)
+    return pd.read_parquet(data_path)
+
+
+def store_cached(path, key, df, workbook_fingerprint=None):
+    """writes a cleaned table and the workbook fingerprint to the cache"""
+    if not USE_ARROW:
+        return None
+    os.makedirs(excel_cache_dir(), exist_ok=True)
+    data_path, meta_path = _cache_files(path, key)
+    meta = workbook_fingerprint or fingerprint(path)
+    meta["geo"] = isinstance(df, gpd.GeoDataFrame)
+    df.to_parquet(data_path)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return data_path
+
+
+def cached_read(path, reader, key=""):
+    """returns reader() for a workbook, re-running it only when the workbook changed since the last call"""
+    df = load_cached(path, key)
+    if df is not None:
+        print(f"loaded cached {Path(path).name}")
+        return df
+    print(f"parsing {Path(path).name}")
+    # fingerprint before parsing so an edit made mid-read invalidates the cache next time
+    workbook_fingerprint = fingerprint(path)
+    df = reader()
+    store_cached(path, key, df, workbook_fingerprint)
+    return df
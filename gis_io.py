@@ -0,0 +1,125 @@
+import hashlib
+import importlib.util
+import json
+import os
+import time
+from collections import deque
+import pandas as pd
+import geopandas as gpd
+
+# pyogrio can hand features back as an arrow table instead of building python rows
+# fall back to the plain pyogrio reader when pyarrow is not installed
+USE_ARROW = importlib.util.find_spec("pyarrow") is not None
+
+# local cache for downloaded and clipped layers, override with GIS_CACHE_DIR
+CACHE_DIR = os.environ.get("GIS_CACHE_DIR", "C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data")
+
+# the last MAX_LOG_ENTRIES read/write calls, see io_summary(), bounded so a long running process (the dash
+# app under gunicorn) doesn't grow without end
+MAX_LOG_ENTRIES = 10000
+IO_LOG = deque(maxlen=MAX_LOG_ENTRIES)
+
+# bytes read and written over the life of the process, stages take their io from the difference
+IO_BYTES = {"read": 0, "written": 0}
+
+
+def cache_path(file_name):
+    """returns the path of a file in the gis cache directory"""
+    return f"{CACHE_DIR}/{file_name}"
+
+
+def _source_name(source):
+    if isinstance(source, (bytes, bytearray)):
+        return "<bytes>"
+    return str(source)
+
+
+def _source_bytes(source):
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    if isinstance(source, (str, os.PathLike)) and os.path.isfile(source):
+        return os.path.getsize(source)
+    return None
+
+
+def record_io(action, source, start, rows, num_bytes):
+    """adds an entry to IO_LOG, start is a time.perf_counter() value"""
+    entry = {
+        "action": action,
+        "source": _source_name(source),
+        "seconds": round(time.perf_counter() - start, 4),
+        "rows": rows,
+        "bytes": num_bytes,
+    }
+    IO_LOG.append(entry)
+    if action in ("read", "download"):
+        IO_BYTES["read"] += num_bytes or 0
+    elif action == "write":
+        IO_BYTES["written"] += num_bytes or 0
+    return entry
+
+
+def read_layer(source, columns=None, bbox=None, **kwargs):
+    """read a layer into a GeoDataFrame using the arrow engine
+    source can be a file path, url, bytes or a geojson string (ie response.text)
+    columns and bbox are pushed down to the reader so unused fields and features are never materialized
+    bbox can be a (minx, miny, maxx, maxy) tuple or a GeoDataFrame, which is reprojected to the file crs"""
+    os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
+    if isinstance(source, str) and source.lstrip().startswith("{"):
+        source = source.encode("utf-8")
+    start = time.perf_counter()
+    gdf = gpd.read_file(source, engine="pyogrio", use_arrow=USE_ARROW, columns=columns, bbox=bbox, **kwargs)
+    record_io("read", source, start, len(gdf), _source_bytes(source))
+    return gdf
+
+
+def write_layer(gdf, path, driver="GeoJSON", **kwargs):
+    """write a GeoDataFrame using the arrow engine"""
+    start = time.perf_counter()
+    gdf.to_file(path, driver=driver, engine="pyogrio", use_arrow=USE_ARROW, **kwargs)
+    record_io("write", path, start, len(gdf), _source_bytes(path))
+    return path
+
+
+def _parquet_crs(path):
+    """crs of the primary geometry column from the GeoParquet metadata, without reading any data"""
+    import pyarrow.parquet as pq
+    from pyproj import CRS
+    geo = json.loads(pq.read_schema(path).metadata[b"geo"])
+    crs = geo["columns"][geo["primary_column"]].get("crs", "OGC:CRS84")
+    return CRS.from_json_dict(crs) if isinstance(crs, dict) else CRS.from_user_input(crs)
+
+
+def read_geoparquet(path, columns=None, bbox=None):
+    """read a GeoParquet file written by write_geoparquet
+    columns and bbox behave like read_layer, bbox uses the covering column so only matching row groups are decoded"""
+    if columns is not None:
+        columns = list(columns) + ["geometry"]
+    if isinstance(bbox, gpd.GeoDataFrame):
+        bbox = tuple(bbox.to_crs(_parquet_crs(path)).total_bounds)
+    start = time.perf_counter()
+    gdf = gpd.read_parquet(path, columns=columns, bbox=bbox)
+    record_io("read", path, start, len(gdf), _source_bytes(path))
+    return gdf
+
+
+def write_geoparquet(gdf, path):
+    """write a GeoParquet file with a bbox covering column so read_geoparquet can filter by bbox"""
+    start = time.perf_counter()
+    gdf.to_parquet(path, write_covering_bbox=True)
+    record_io("write", path, start, len(gdf), _source_bytes(path))
+    return path
+
+
+def layer_fingerprint(gdf):
+    """short hash of a layer's crs, attributes and geometry, changes whenever the layer does"""
+    digest = hashlib.sha256(str(gdf.crs).encode("utf-8"))
+    attributes = gdf.drop(columns=gdf.geometry.name).astype(str)
+    digest.update(pd.util.hash_pandas_object(attributes, index=True).values.tobytes())
+    digest.update(b"".join(gdf.geometry.to_wkb().fillna(b"")))
+    return digest.hexdigest()[:16]
+
+
+def io_summary():
+    """returns the io log as a DataFrame"""
+    return pd.DataFrame(list(IO_LOG), columns=["action", "source", "seconds", "rows", "bytes"])
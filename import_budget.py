@@ -0,0 +1,60 @@
+"""checks how long the pipeline modules take to import and that heavy subsystems are only loaded on first use
+run with: python import_budget.py"""
+import subprocess
+import sys
+
+# cumulative import time budget in milliseconds, measured in a fresh interpreter
+IMPORT_BUDGET_MS = {
+    "gis_io": 1000,
+    "table_schema": 800,
+    "instrumentation": 1000,
+    "watershed_gis": 1000,
+    "WTD_Sites_vs_2": 1000,
+}
+
+# importing the pipeline modules must not pull these in, the functions that need them import them
+LAZY_MODULES = ["folium", "branca", "plotly", "matplotlib", "selenium", "sqlalchemy", "requests", "dotenv"]
+
+
+def measure_import(module):
+    """returns (cumulative import time in ms, set of top level packages imported) for a module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    cumulative_ms = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [f.strip() for f in line[len("import time:"):].split("|")]
+        if not fields[1].isdigit():
+            continue  # header row
+        name = fields[2]
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative_ms = int(fields[1]) / 1000
+    return cumulative_ms, imported
+
+
+def check_budget(budget=IMPORT_BUDGET_MS, lazy_modules=LAZY_MODULES):
+    """prints import times against the budget and returns a list of problems"""
+    problems = []
+    print(f"{'module':<20}{'ms':>10}{'budget':>10}")
+    for module, limit in budget.items():
+        ms, imported = measure_import(module)
+        print(f"{module:<20}{ms:>10.0f}{limit:>10}")
+        if ms > limit:
+            problems.append(f"{module} took {ms:.0f} ms to import, budget is {limit} ms")
+        eager = sorted(imported.intersection(lazy_modules))
+        if eager:
+            problems.append(f"{module} imports {', '.join(eager)} at import time")
+    for problem in problems:
+        print(problem)
+    return problems
+
+
+if __name__ == "__main__":
+    sys.exit(1 if check_budget() else 0)
@@ -0,0 +1,178 @@
+"""per stage timing and memory for the pipeline scripts
+decorate loaders, filters and map builders with @instrumented (or wrap a block in `with stage(name):`),
+then write_run_report() saves the run as json and print_summary() prints a table"""
+import functools
+import json
+import os
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+from gis_io import IO_BYTES, IO_LOG
+from table_schema import MEMORY_LOG, memory_summary
+
+# peak rss comes from getrusage, which windows does not have, psutil is used there when installed
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# one entry per stage in the order the stages started, nested stages follow their parent
+# only the last MAX_STAGES are kept, so a long running process can't grow the log without end
+MAX_STAGES = 10000
+STAGE_LOG = deque(maxlen=MAX_STAGES)
+
+# names of the stages currently running
+_active = []
+
+SUMMARY_COLUMNS = ["stage", "wall_s", "cpu_s", "peak_rss_delta_mb", "rows_in", "rows_out", "bytes_read", "bytes_written"]
+
+
+def peak_rss_mb():
+    """peak resident memory of this process in MB, None when it can't be read"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on mac
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) / 1e6
+
+
+def current_stage():
+    """name of the outermost stage that is running, None outside of any stage"""
+    return _active[0] if _active else None
+
+
+def count_rows(value):
+    """row count of a DataFrame, a list of counts for a tuple of outputs, None for anything else"""
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, (tuple, list)) and any(isinstance(v, pd.DataFrame) for v in value):
+        return [count_rows(v) for v in value]
+    return None
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """records wall time, cpu time, peak rss growth and gis_io bytes for the block
+    the yielded record can be updated, ie record["rows_out"] = len(result)"""
+    record = {"stage": name, "depth": len(_active), "rows_in": rows_in, "rows_out": None}
+    STAGE_LOG.append(record)
+    _active.append(name)
+    read_start, written_start = IO_BYTES["read"], IO_BYTES["written"]
+    rss_start = peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _active.pop()
+        rss_end = peak_rss_mb()
+        record.update({
+            "wall_s": round(time.perf_counter() - wall_start, 4),
+            "cpu_s": round(time.process_time() - cpu_start, 4),
+            # how much this stage raised the process high water mark
+            "peak_rss_delta_mb": None if rss_start is None else round(rss_end - rss_start, 1),
+            "bytes_read": IO_BYTES["read"] - read_start,
+            "bytes_written": IO_BYTES["written"] - written_start,
+        })
+
+
+def instrumented(func=None, *, name=None):
+    """decorator version of stage(), rows in/out are counted from DataFrame arguments and return values"""
+    if func is None:
+        return functools.partial(instrumented, name=name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        frames = [a for a in (*args, *kwargs.values()) if isinstance(a, pd.DataFrame)]
+        with stage(name or func.__name__, rows_in=count_rows(frames)) as record:
+            result = func(*args, **kwargs)
+            record["rows_out"] = count_rows(result)
+        return result
+    return wrapper
+
+
+def clear_logs():
+    """empties the logs, a worker process calls this before a task so it only returns that task's records
+    a forked worker also inherits the parent's running stages, which don't run in the worker"""
+    _active.clear()
+    STAGE_LOG.clear()
+    IO_LOG.clear()
+    MEMORY_LOG.clear()
+    IO_BYTES.update(read=0, written=0)
+
+
+def worker_records():
+    """this process's records for a worker to return with its result, see merge_records()"""
+    return {"stages": list(STAGE_LOG), "io": list(IO_LOG), "tables": list(MEMORY_LOG), "io_bytes": dict(IO_BYTES)}
+
+
+def merge_records(records):
+    """adds worker_records() from a worker process to this process's logs, the worker's stages are nested
+    under the stage running here and its io counts towards it"""
+    depth = len(_active)
+    STAGE_LOG.extend({**record, "depth": record["depth"] + depth} for record in records["stages"])
+    IO_LOG.extend(records["io"])
+    MEMORY_LOG.extend(records["tables"])
+    for key, value in records["io_bytes"].items():
+        IO_BYTES[key] += value
+
+
+def stage_summary():
+    """returns the stage log as a DataFrame, nested stage names are indented"""
+    summary = pd.DataFrame(list(STAGE_LOG)).reindex(columns=SUMMARY_COLUMNS + ["depth"])
+    summary["stage"] = ["  " * int(depth) + str(name) for name, depth in zip(summary["stage"], summary["depth"].fillna(0))]
+    return summary.drop(columns="depth")
+
+
+def print_summary():
+    summary = stage_summary()
+    if summary.empty:
+        print("no stages recorded")
+        return
+    for col in ["bytes_read", "bytes_written"]:
+        summary[col] = (summary[col] / 1e6).round(2)
+    summary = summary.rename(columns={"bytes_read": "read_mb", "bytes_written": "written_mb"})
+    width = summary["stage"].str.len().max()
+    print(summary.to_string(index=False, na_rep="", formatters={"stage": lambda name: f"{name:<{width}}"}))
+    print(f"peak rss {peak_rss_mb() or 0:.0f} MB")
+    if MEMORY_LOG:
+        print_memory_summary()
+
+
+def print_memory_summary():
+    """the apply_schema calls per table, with the rows and memory of the last one"""
+    tables = memory_summary().groupby("table", sort=False).agg(
+        calls=("rows", "size"), rows=("rows", "last"), before_mb=("bytes_before", "last"), after_mb=("bytes_after", "last"))
+    tables[["before_mb", "after_mb"]] = (tables[["before_mb", "after_mb"]] / 1e6).round(2)
+    print(tables.to_string())
+
+
+def run_report(script=None):
+    """stages, io calls and table memory for this run"""
+    return {
+        "script": script or os.path.basename(sys.argv[0]),
+        "finished": datetime.now().isoformat(timespec="seconds"),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": list(STAGE_LOG),
+        "io": list(IO_LOG),
+        "tables": list(MEMORY_LOG),
+    }
+
+
+def write_run_report(path, script=None):
+    """writes run_report() as json, returns the path"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run_report(script), f, indent=2, default=str)
+    return path
@@ -0,0 +1,76 @@
+"""the two crs every layer is used in and a cache of reprojected geometry
+layers are kept in DISPLAY_CRS for joins and mapping, buffers, areas and distances use PROJECTED_CRS,
+a layer's geometry is reprojected once per run and reused however many stages ask for it"""
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import shapely
+import geopandas as gpd
+from pyproj import CRS
+
+DISPLAY_CRS = "EPSG:4326"
+
+# Washington State Plane North (US feet), covers all of King County
+PROJECTED_CRS = "EPSG:2926"
+
+# (geometry key, target crs) -> reprojected GeometryArray
+_PROJECTIONS = OrderedDict()
+MAX_PROJECTIONS = 64
+
+CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+def geometry_key(geometry):
+    """hash of a GeoSeries' crs, geometry types and coordinates
+    columns added or dropped around the geometry do not change it, which is what lets a layer
+    that gains columns between stages still hit the cache"""
+    values = geometry.values
+    digest = hashlib.sha256(str(geometry.crs).encode("utf-8"))
+    digest.update(shapely.get_type_id(values).astype(np.int8).tobytes())
+    digest.update(shapely.get_num_coordinates(values).astype(np.int64).tobytes())
+    digest.update(shapely.get_coordinates(values).tobytes())
+    return digest.hexdigest()
+
+
+def _store(key, values):
+    _PROJECTIONS[key] = values
+    _PROJECTIONS.move_to_end(key)
+    while len(_PROJECTIONS) > MAX_PROJECTIONS:
+        _PROJECTIONS.popitem(last=False)
+
+
+def to_crs_cached(gdf, crs):
+    """gdf in crs, reusing an earlier reprojection of the same geometry
+    the reverse transform is cached too so projecting back to the original crs is free"""
+    crs = CRS.from_user_input(crs)
+    if gdf.crs is None or gdf.crs == crs:
+        return gdf
+    geometry = gdf.geometry
+    key = (geometry_key(geometry), crs.to_string())
+    values = _PROJECTIONS.get(key)
+    if values is None:
+        CACHE_STATS["misses"] += 1
+        projected_geometry = geometry.to_crs(crs)
+        values = projected_geometry.values
+        _store(key, values)
+        _store((geometry_key(projected_geometry), CRS.from_user_input(geometry.crs).to_string()), geometry.values)
+    else:
+        CACHE_STATS["hits"] += 1
+        _PROJECTIONS.move_to_end(key)
+    result = gdf.copy()
+    result[geometry.name] = gpd.GeoSeries(values, index=gdf.index, crs=crs)
+    return result.set_crs(crs, allow_override=True)
+
+
+def projected(gdf):
+    """gdf in the projected working crs, use for buffer, area, length and distance"""
+    return to_crs_cached(gdf, PROJECTED_CRS)
+
+
+def display(gdf):
+    """gdf in the display crs"""
+    return to_crs_cached(gdf, DISPLAY_CRS)
+
+
+def clear_projections():
+    _PROJECTIONS.clear()
@@ -0,0 +1,209 @@
+"""serves the processed pipeline layers to the dash app
+the pipeline publishes layers with publish_layer(), which writes GeoParquet and updates a manifest,
+the app keeps loaded layers and their per-zoom simplified geometry in memory and answers bbox + zoom
+queries from them, a layer whose manifest version changed is dropped and reloaded on the next request.
+every worker checks the manifest's mtime on each request, that is what invalidates a worker's cached layers.
+layers are published to LAYER_PUBLISH_DIR, by default published/ in the gis cache directory (GIS_CACHE_DIR), and
+the app has to be started with the same setting as the pipeline, ie in the environment gunicorn runs with"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+import shapely
+import geopandas as gpd
+from gis_io import cache_path, read_geoparquet, write_geoparquet, layer_fingerprint
+from layer_registry import display
+from table_schema import widen_floats
+
+PUBLISH_DIR_NAME = "published"
+MANIFEST_FILE = "manifest.json"
+
+# versions of a layer kept on disk besides the current one, a worker that read the manifest before a publish
+# can still load the version it was pointed at
+KEEP_VERSIONS = 2
+
+MAX_ZOOM = 18
+
+# simplify to about half a screen pixel at each zoom level
+PIXEL_TOLERANCE = 0.5
+
+# rendered viewport responses kept in memory
+MAX_RESPONSES = 256
+
+CACHE_STATS = {"hits": 0, "misses": 0, "reloads": 0}
+
+_lock = threading.RLock()
+_manifest = {"mtime": None, "layers": {}}
+# name -> {"version", "gdf", "simplified": {zoom: GeometryArray}}
+_layers = {}
+# (name, version, zoom, bbox) -> geojson string
+_responses = OrderedDict()
+
+
+def publish_dir():
+    """where layers are published, looked up on every call so the environment can be set after import"""
+    return os.environ.get("LAYER_PUBLISH_DIR") or cache_path(PUBLISH_DIR_NAME)
+
+
+def manifest_path():
+    return f"{publish_dir()}/{MANIFEST_FILE}"
+
+
+def read_manifest(path=None):
+    path = path or manifest_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def publish_layer(name, gdf, columns=None):
+    """writes a layer for the app and points the manifest at it, returns the new version
+    each version gets its own file so a running app never reads a half written one, the KEEP_VERSIONS before it
+    stay for workers that haven't seen the new manifest yet and older ones are deleted"""
+    gdf = display(gdf)
+    if columns is not None:
+        gdf = gdf[list(columns) + [gdf.geometry.name]]
+    version = layer_fingerprint(gdf)
+    directory = publish_dir()
+    os.makedirs(directory, exist_ok=True)
+    file_name = f"{name}-{version}.parquet"
+    write_geoparquet(gdf, f"{directory}/{file_name}")
+
+    manifest_file = f"{directory}/{MANIFEST_FILE}"
+    manifest = read_manifest(manifest_file)
+    entry = manifest.get(name, {})
+    # newest first, without the version being published
+    previous = [f for f in [entry.get("file"), *entry.get("previous", [])] if f and f != file_name]
+    manifest[name] = {
+        "version": version,
+        "file": file_name,
+        "rows": len(gdf),
+        "bounds": [float(v) for v in gdf.total_bounds],
+        "geometry_type": gdf.geom_type.mode().iat[0] if len(gdf) else None,
+        "published": datetime.now().isoformat(timespec="seconds"),
+        "previous": previous[:KEEP_VERSIONS],
+    }
+    temp_path = f"{manifest_file}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, manifest_file)
+    for old in previous[KEEP_VERSIONS:]:
+        if os.path.exists(f"{directory}/{old}"):
+            os.remove(f"{directory}/{old}")
+    print(f"published {name} ({len(gdf)} rows)")
+    return version
+
+
+def _refresh_manifest():
+    """rereads the manifest when the pipeline has written a new one and drops layers it replaced"""
+    path = manifest_path()
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    if mtime == _manifest["mtime"]:
+        return
+    _manifest["mtime"] = mtime
+    _manifest["layers"] = read_manifest(path)
+    for name in list(_layers):
+        if _manifest["layers"].get(name, {}).get("version") != _layers[name]["version"]:
+            invalidate(name)
+
+
+def manifest():
+    """published layers and their versions"""
+    with _lock:
+        _refresh_manifest()
+        return dict(_manifest["layers"])
+
+
+def invalidate(name=None):
+    """drops one cached layer (all of them when name is None) and its rendered responses"""
+    with _lock:
+        names = list(_layers) if name is None else [name]
+        for layer in names:
+            _layers.pop(layer, None)
+        for key in [k for k in _responses if name is None or k[0] == name]:
+            del _responses[key]
+        if name is None:
+            _manifest["mtime"] = None
+
+
+def get_layer(name):
+    """the published layer as a GeoDataFrame, loaded once per version, KeyError when it isn't published"""
+    with _lock:
+        _refresh_manifest()
+        entry = _manifest["layers"][name]
+        cached = _layers.get(name)
+        if cached is None or cached["version"] != entry["version"]:
+            CACHE_STATS["reloads"] += 1
+            try:
+                gdf = read_geoparquet(f"{publish_dir()}/{entry['file']}")
+            except FileNotFoundError:
+                # published more than KEEP_VERSIONS times since the manifest was read, reread it
+                _manifest["mtime"] = None
+                _refresh_manifest()
+                entry = _manifest["layers"][name]
+                gdf = read_geoparquet(f"{publish_dir()}/{entry['file']}")
+            gdf.sindex
+            cached = _layers[name] = {"version": entry["version"], "gdf": gdf, "simplified": {}}
+        return cached
+
+
+def zoom_tolerance(zoom):
+    """degrees covered by PIXEL_TOLERANCE of a 256 px web map tile at zoom"""
+    return 360 / (256 * 2 ** zoom) * PIXEL_TOLERANCE
+
+
+def _simplified(layer, zoom):
+    simplified = layer["simplified"].get(zoom)
+    if simplified is None:
+        geometry = layer["gdf"].geometry
+        if zoom >= MAX_ZOOM or geometry.geom_type.isin(["Point", "MultiPoint"]).all():
+            simplified = geometry.values
+        else:
+            simplified = geometry.simplify(zoom_tolerance(zoom), preserve_topology=True).values
+        layer["simplified"][zoom] = simplified
+    return simplified
+
+
+def snap_bbox(bbox, zoom):
+    """bbox grown out to the tile grid at zoom so nearby viewports share a cached response"""
+    span = 360 / 2 ** zoom
+    minx, miny, maxx, maxy = bbox
+    return (
+        max(np.floor(minx / span) * span, -180.0),
+        max(np.floor(miny / span) * span, -90.0),
+        min(np.ceil(maxx / span) * span, 180.0),
+        min(np.ceil(maxy / span) * span, 90.0),
+    )
+
+
+def query_layer(name, bbox=None, zoom=None):
+    """GeoJSON string of the features in bbox (minx, miny, maxx, maxy in degrees) simplified for zoom
+    returns (geojson, version), raises KeyError when the layer isn't published"""
+    zoom = MAX_ZOOM if zoom is None else int(min(max(zoom, 0), MAX_ZOOM))
+    with _lock:
+        layer = get_layer(name)
+        bbox = None if bbox is None else snap_bbox(bbox, zoom)
+        key = (name, layer["version"], zoom, bbox)
+        body = _responses.get(key)
+        if body is not None:
+            CACHE_STATS["hits"] += 1
+            _responses.move_to_end(key)
+            return body, layer["version"]
+        CACHE_STATS["misses"] += 1
+
+        gdf = layer["gdf"]
+        if bbox is None:
+            rows = np.arange(len(gdf))
+        else:
+            rows = np.sort(gdf.sindex.query(shapely.box(*bbox), predicate="intersects"))
+        geometry = _simplified(layer, zoom)[rows]
+        features = gpd.GeoDataFrame(gdf.drop(columns=gdf.geometry.name).iloc[rows], geometry=geometry, crs=gdf.crs)
+        body = widen_floats(features).to_json(drop_id=True, na="null")
+
+        _responses[key] = body
+        while len(_responses) > MAX_RESPONSES:
+            _responses.popitem(last=False)
+        return body, layer["version"]
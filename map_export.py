@@ -0,0 +1,173 @@
+"""batch export of map pages to png and pdf with a bounded pool of headless browsers
+a job is a dict {"html": page, "output": file, "window_size": (width, height), "format": "png" or "pdf"}, the
+format defaults to the output's extension. every worker thread starts one browser and renders jobs from a shared
+queue until it is empty, so any number of jobs costs max_browsers browser start ups and the pages render side by
+side. pdfs come from the DevTools Page.printToPDF command, which only chromium browsers (Edge, Chrome) have"""
+import base64
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from instrumentation import instrumented
+
+DEFAULT_WINDOW_SIZE = (729, 943)
+
+# the exported map hides its controls and doesn't react to the mouse
+STATIC_MAP_CSS = """
+    .leaflet-container {
+        cursor: default !important;
+        pointer-events: none !important;
+    }
+    .leaflet-control-zoom,
+    .leaflet-control-attribution,
+    .leaflet-control-layers {
+        display: none !important;
+    }
+"""
+_ADD_STYLE = "var style = document.createElement('style'); style.textContent = arguments[0]; document.head.appendChild(style);"
+
+# true once the page has loaded and no visible tile is still loading
+_RENDERED = """
+    return document.readyState === 'complete'
+        && document.querySelectorAll('.leaflet-tile-container img:not(.leaflet-tile-loaded)').length === 0;
+"""
+
+# css pixels per inch, printToPDF takes the paper size in inches
+CSS_DPI = 96
+
+EXPORT_FORMATS = ("png", "pdf")
+
+
+def export_job(html, output, window_size=DEFAULT_WINDOW_SIZE, format=None):
+    """a job dict with its defaults filled in"""
+    format = (format or os.path.splitext(output)[1].lstrip(".") or "png").lower()
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"unsupported export format {format!r} for {output}, expected one of {EXPORT_FORMATS}")
+    return {"html": html, "output": output, "window_size": tuple(window_size), "format": format}
+
+
+def start_browser(browser="edge", window_size=DEFAULT_WINDOW_SIZE):
+    """a headless selenium driver for browser ("edge" or "chrome")"""
+    from selenium import webdriver
+    if browser == "edge":
+        from selenium.webdriver.edge.options import Options
+        driver_class = webdriver.Edge
+    elif browser == "chrome":
+        from selenium.webdriver.chrome.options import Options
+        driver_class = webdriver.Chrome
+    else:
+        raise ValueError(f"unsupported browser {browser!r}, expected 'edge' or 'chrome'")
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument(f"--window-size={window_size[0]},{window_size[1]}")
+    return driver_class(options=options)
+
+
+def wait_for_map(driver, timeout=10, settle=0.5):
+    """waits until the page's tiles have loaded (at most timeout seconds), then settle seconds for fade ins"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and not driver.execute_script(_RENDERED):
+        time.sleep(0.1)
+    time.sleep(settle)
+
+
+def render(driver, job, timeout=10):
+    """renders one job with an open driver"""
+    width, height = job["window_size"]
+    driver.set_window_size(width, height)
+    driver.get(Path(job["html"]).resolve().as_uri())
+    driver.execute_script(_ADD_STYLE, STATIC_MAP_CSS)
+    wait_for_map(driver, timeout)
+    if job["format"] == "png":
+        driver.save_screenshot(job["output"])
+    elif job["format"] == "pdf":
+        # one page the size of the window, so the pdf shows what the png would
+        pdf = driver.execute_cdp_cmd("Page.printToPDF", {
+            "printBackground": True,
+            "landscape": False,
+            "paperWidth": width / CSS_DPI,
+            "paperHeight": height / CSS_DPI,
+            "marginTop": 0, "marginBottom": 0, "marginLeft": 0, "marginRight": 0,
+            "pageRanges": "1",
+        })
+        with open(job["output"], "wb") as f:
+            f.write(base64.b64decode(pdf["data"]))
+    else:
+        raise ValueError(f"unsupported export format {job['format']!r}, expected one of {EXPORT_FORMATS}")
+
+
+def _driver_error(error):
+    """true for errors from the browser or its driver, after which the driver is started again"""
+    try:
+        from selenium.common.exceptions import WebDriverException
+    except ImportError:
+        return False
+    return isinstance(error, WebDriverException)
+
+
+def _quit(driver):
+    try:
+        driver.quit()
+    except Exception:
+        # the browser may already be gone
+        pass
+
+
+def _worker(jobs, results, browser, timeout, start):
+    driver = None
+    try:
+        while True:
+            try:
+                i, job = jobs.get_nowait()
+            except queue.Empty:
+                return
+            job_start = time.perf_counter()
+            result = {**job, "error": None, "worker": threading.current_thread().name}
+            try:
+                if driver is None:
+                    driver = start(browser, job["window_size"])
+                    result["browser_start_s"] = time.perf_counter() - job_start
+                render(driver, job, timeout)
+            except Exception as e:
+                result["error"] = repr(e)
+                # a crashed or hung browser would fail every job left on this worker, the next job gets a new one
+                if driver is not None and _driver_error(e):
+                    _quit(driver)
+                    driver = None
+            result["seconds"] = time.perf_counter() - job_start
+            results[i] = result
+    finally:
+        if driver is not None:
+            _quit(driver)
+
+
+@instrumented
+def export_maps(jobs, max_browsers=2, browser="edge", timeout=10, start=start_browser):
+    """renders every job (dicts, see export_job) on at most max_browsers headless browsers
+    returns one result per job in the order given: the job with seconds taken (including the browser start up for
+    the first job of a worker) and error, None or the exception text of a job that failed. a failed job doesn't
+    stop the others, and after a WebDriver error the worker starts a new browser for its next job.
+    start(browser, window_size) makes a driver, start_browser by default"""
+    jobs = [export_job(**job) for job in jobs]
+    pending = queue.Queue()
+    for item in enumerate(jobs):
+        pending.put(item)
+    results = [None] * len(jobs)
+    workers = [
+        threading.Thread(target=_worker, args=(pending, results, browser, timeout, start), name=f"browser-{n}")
+        for n in range(max(1, min(max_browsers, len(jobs))))
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def print_exports(results):
+    for result in results:
+        status = "ok" if result["error"] is None else f"failed: {result['error']}"
+        width, height = result["window_size"]
+        print(f"{result['output']} ({result['format']} {width}x{height}): {result['seconds']:.1f} s on {result['worker']}, {status}")
@@ -0,0 +1,236 @@
+"""folium elements for layers that are serialized once and embedded as is
+folium.GeoJson turns its data into json every time a map is rendered, a layer shared by several maps
+is serialized once with serialize_layer() (or as TopoJSON with topology.serialize_topology()) and the same
+string goes into each page. site markers are one FeatureCollection per layer styled in the browser, rather
+than a CircleMarker and Popup object per site, optionally drawn as clusters precomputed by site_clusters"""
+import json
+import numpy as np
+from branca.element import MacroElement
+from jinja2 import Template
+from layer_registry import display
+from table_schema import widen_floats
+
+
+def serialize_layer(gdf):
+    """compact GeoJSON text for a layer in the display crs"""
+    return widen_floats(display(gdf)).to_json(drop_id=True, na="null", separators=(",", ":"))
+
+
+class GeoJsonLayer(MacroElement):
+    """adds preserialized GeoJSON text to its parent with a fixed style and an optional tooltip"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.geoJson({{ this.data }}, {
+            style: function(feature) { return {{ this.style|tojson }}; }
+        }){% if this.tooltip %}.bindTooltip({{ this.tooltip|tojson }}){% endif %}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, data, style=None, tooltip=None):
+        super().__init__()
+        self._name = "GeoJsonLayer"
+        self.data = data
+        self.style = style or {}
+        self.tooltip = tooltip
+
+
+
+class TopologyData(MacroElement):
+    """TopoJSON text defined once in a page, for the TopoJsonLayers of the objects in it
+    add it to the map before the layers that read it"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = {{ this.data }};
+        {% endmacro %}
+    """)
+
+    def __init__(self, data):
+        super().__init__()
+        self._name = "TopologyData"
+        self.data = data
+
+
+class TopoJsonLayer(GeoJsonLayer):
+    """GeoJsonLayer for one object of a TopoJSON text (see topology), decoded to GeoJSON in the page
+    data is the TopoJSON text or a TopologyData several layers share, its arcs are decoded once per page"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function(topology) {
+            var transform = topology.transform;
+            var point = function(p) {
+                return [p[0] * transform.scale[0] + transform.translate[0], p[1] * transform.scale[1] + transform.translate[1]];
+            };
+            var arcs = topology.decodedArcs || (topology.decodedArcs = topology.arcs.map(function(arc) {
+                var x = 0, y = 0;
+                return arc.map(function(delta) { x += delta[0]; y += delta[1]; return point([x, y]); });
+            }));
+            var line = function(ids) {
+                var points = [];
+                ids.forEach(function(i) {
+                    var arc = i < 0 ? arcs[~i].slice().reverse() : arcs[i];
+                    Array.prototype.push.apply(points, points.length ? arc.slice(1) : arc);
+                });
+                return points;
+            };
+            var geometry = function(g) {
+                switch (g.type) {
+                    case "Point": return {type: g.type, coordinates: point(g.coordinates)};
+                    case "MultiPoint": return {type: g.type, coordinates: g.coordinates.map(point)};
+                    case "LineString": return {type: g.type, coordinates: line(g.arcs)};
+                    case "MultiLineString": case "Polygon": return {type: g.type, coordinates: g.arcs.map(line)};
+                    case "MultiPolygon": return {type: g.type, coordinates: g.arcs.map(function(p) { return p.map(line); })};
+                }
+                return null;
+            };
+            var features = topology.objects[{{ this.object_name|tojson }}].geometries.map(function(g) {
+                return {type: "Feature", geometry: geometry(g), properties: g.properties || {}};
+            });
+            return L.geoJson({type: "FeatureCollection", features: features}, {
+                style: function(feature) { return {{ this.style|tojson }}; }
+            }){% if this.tooltip %}.bindTooltip({{ this.tooltip|tojson }}){% endif %}.addTo({{ this._parent.get_name() }});
+        })({{ this.data }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, data, object_name, style=None, tooltip=None):
+        if isinstance(data, TopologyData):
+            data = data.get_name()
+        super().__init__(data, style=style, tooltip=tooltip)
+        self._name = "TopoJsonLayer"
+        self.object_name = object_name
+
+
+def point_features(x, y, properties, precision=6):
+    """GeoJSON FeatureCollection text for points, properties is {name: array of values} aligned with x and y
+    coordinates are rounded to precision decimals (6 is about 10 cm)"""
+    x = np.round(np.asarray(x, dtype=float), precision).tolist()
+    y = np.round(np.asarray(y, dtype=float), precision).tolist()
+    names = list(properties)
+    columns = [list(values) for values in properties.values()]
+    features = [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [px, py]}, "properties": dict(zip(names, values))}
+        for px, py, *values in zip(x, y, *columns)
+    ]
+    return json.dumps({"type": "FeatureCollection", "features": features}, separators=(",", ":"))
+
+
+# geoJson options drawing site features as circle markers with popups and tooltips filled from their properties
+_SITE_MARKER_OPTIONS = """            pointToLayer: function(feature, latlng) {
+                var options = Object.assign({}, {{ this.marker_options|tojson }});
+                if (feature.properties.color) {
+                    options.color = feature.properties.color;
+                    options.fillColor = feature.properties.color;
+                }
+                return L.circleMarker(latlng, options);
+            },
+            onEachFeature: function(feature, layer) {
+                var fill = function(template) {
+                    return template.replace(/\\{(\\w+)\\}/g, function(match, key) {
+                        var value = feature.properties[key];
+                        return String(value === null || value === undefined ? "" : value).replace(/[&<>"]/g, function(c) {
+                            return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}[c];
+                        });
+                    });
+                };
+                {%- if this.popup %}
+                layer.bindPopup(fill({{ this.popup|tojson }}), {maxWidth: {{ this.max_width }}});
+                {%- endif %}
+                {%- if this.tooltip %}
+                layer.bindTooltip(fill({{ this.tooltip|tojson }}), {sticky: true});
+                {%- endif %}
+            }
+"""
+
+
+class SiteMarkerLayer(MacroElement):
+    """every site of a layer as one GeoJSON FeatureCollection drawn as circle markers
+    popups and tooltips are filled in the browser from each feature's properties with one template per layer,
+    {name} in a template is replaced by the (html escaped) property, a "color" property overrides the marker color"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.geoJson({{ this.data }}, {
+""" + _SITE_MARKER_OPTIONS + """        }).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, data, marker_options=None, popup=None, tooltip=None, max_width=300):
+        super().__init__()
+        self._name = "SiteMarkerLayer"
+        self.data = data
+        self.marker_options = marker_options or {}
+        self.popup = popup
+        self.tooltip = tooltip
+        self.max_width = max_width
+
+
+class ClusteredSiteLayer(SiteMarkerLayer):
+    """a site layer drawn as the precomputed clusters of site_clusters.cluster_levels
+    on every zoom change the markers of that zoom's level are swapped in, a cluster is a pie of its sites' colors
+    with the site count and zooms to its sites when clicked, single sites and every site past max_zoom are the
+    same circle markers, popups and tooltips as SiteMarkerLayer"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var clusters = {{ this.clusters|tojson }};
+            var sites = L.geoJson({{ this.data }}, {
+""" + _SITE_MARKER_OPTIONS + """            }).getLayers();
+            var icon = function(cluster) {
+                var count = cluster[2], stops = [], start = 0;
+                clusters.palette.forEach(function(color, i) {
+                    var end = start + 360 * cluster[7 + i] / count;
+                    if (end > start) { stops.push(color + " " + start + "deg " + end + "deg"); }
+                    start = end;
+                });
+                var size = Math.round(24 + 8 * Math.log10(count));
+                return L.divIcon({
+                    className: "site-cluster",
+                    iconSize: [size, size],
+                    html: '<div style="width:' + size + 'px;height:' + size + 'px;border-radius:50%;box-sizing:border-box;'
+                        + 'border:{{ this.marker_options.get("weight", 1) }}px solid {{ this.marker_options.get("color", "black") }};'
+                        + 'background:conic-gradient(' + stops.join(",") + ');display:flex;align-items:center;justify-content:center">'
+                        + '<span style="background:white;border-radius:8px;padding:0 4px;font:bold 11px sans-serif">' + count + '</span></div>'
+                });
+            };
+            var levels = clusters.levels.map(function(level) {
+                return level.clusters.map(function(cluster) {
+                    var marker = L.marker([cluster[1], cluster[0]], {icon: icon(cluster)});
+                    marker.bindTooltip(cluster[2] + " sites");
+                    marker.on("click", function() {
+                        marker._map.fitBounds([[cluster[4], cluster[3]], [cluster[6], cluster[5]]], {maxZoom: clusters.max_zoom + 1});
+                    });
+                    return marker;
+                }).concat(level.points.map(function(i) { return sites[i]; }));
+            });
+            var ClusterGroup = L.LayerGroup.extend({
+                onAdd: function(map) {
+                    L.LayerGroup.prototype.onAdd.call(this, map);
+                    map.on("zoomend", this._redraw, this);
+                    this._redraw();
+                },
+                onRemove: function(map) {
+                    map.off("zoomend", this._redraw, this);
+                    L.LayerGroup.prototype.onRemove.call(this, map);
+                },
+                _redraw: function() {
+                    var zoom = Math.round(this._map.getZoom());
+                    var shown = zoom > clusters.max_zoom ? -1 : clusters.zooms[Math.max(zoom, clusters.min_zoom) - clusters.min_zoom];
+                    if (shown === this._shown) { return; }
+                    this._shown = shown;
+                    this.clearLayers();
+                    (shown === -1 ? sites : levels[shown]).forEach(this.addLayer, this);
+                }
+            });
+            return new ClusterGroup().addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, data, clusters, marker_options=None, popup=None, tooltip=None, max_width=300):
+        super().__init__(data, marker_options=marker_options, popup=popup, tooltip=tooltip, max_width=max_width)
+        self._name = "ClusteredSiteLayer"
+        self.clusters = clusters
@@ -0,0 +1,151 @@
+"""sampling profiler for the --profile mode of the pipeline scripts
+a background thread samples the main thread's stack every few milliseconds and files each sample under
+the running instrumentation stage, the result is written as collapsed stacks (one .folded file per stage)
+that flamegraph.pl, speedscope or inferno can render, plus a breakdown of time by library category"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+import pandas as pd
+from instrumentation import current_stage
+
+# leaf-most frame from one of these packages decides where a sample's time went
+CATEGORIES = {
+    "shapely/GEOS": ("shapely",),
+    "pandas": ("pandas", "numpy", "geopandas"),
+    "folium/serialization": ("folium", "branca", "jinja2", "markupsafe", "json", "plotly"),
+    "io": ("pyogrio", "pyarrow", "fiona", "openpyxl", "requests", "urllib3", "http", "socket", "ssl",
+           "sqlalchemy", "psycopg2", "selenium"),
+}
+_PACKAGE_CATEGORY = {package: category for category, packages in CATEGORIES.items() for package in packages}
+
+NO_STAGE = "(outside stages)"
+
+
+def _path_parts(filename):
+    return re.split(r"[\\/]", filename)
+
+
+def frame_category(codes):
+    """category of a sample, codes are ordered leaf first
+    a frame is matched on its module's file name (single file stdlib modules such as socket.py and ssl.py) and
+    then on the packages it is in, up to site-packages or the stdlib directory"""
+    for code in codes:
+        parts = _path_parts(code.co_filename)
+        module = os.path.splitext(parts[-1])[0]
+        if module in _PACKAGE_CATEGORY:
+            return _PACKAGE_CATEGORY[module]
+        for part in reversed(parts[:-1]):
+            if part in _PACKAGE_CATEGORY:
+                return _PACKAGE_CATEGORY[part]
+            if part in ("site-packages", "lib", "Lib"):
+                break
+    return "python"
+
+
+def frame_label(code):
+    # collapsed stack format splits on ";" and the trailing space
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{code.co_name}({module}:{code.co_firstlineno})".replace(";", ":").replace(" ", "_")
+
+
+class SamplingProfiler:
+    """samples one thread's stack (the main thread by default) on a background thread
+    each sample is weighted by the time since the previous one, so samples delayed while
+    a C extension holds the GIL still count for the time they cover"""
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.main_thread().ident
+        # stage -> stack (tuple of code objects, leaf first) -> seconds
+        self.samples = defaultdict(lambda: defaultdict(float))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            self.samples[current_stage() or NO_STAGE][tuple(stack)] += elapsed
+
+    def category_summary(self):
+        """seconds per stage and category, with a total row"""
+        rows = defaultdict(lambda: dict.fromkeys([*CATEGORIES, "python"], 0.0))
+        for stage, stacks in self.samples.items():
+            for stack, seconds in stacks.items():
+                rows[stage][frame_category(stack)] += seconds
+        summary = pd.DataFrame.from_dict(rows, orient="index").round(2)
+        if not summary.empty:
+            summary.loc["total"] = summary.sum()
+        return summary
+
+    def write(self, out_dir):
+        """writes <stage>.folded per stage, all.folded and categories.json to out_dir, returns the paths
+        counts in the folded files are milliseconds"""
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        combined = []
+        for stage, stacks in self.samples.items():
+            lines = []
+            for stack, seconds in stacks.items():
+                ms = round(seconds * 1000)
+                if ms:
+                    labels = [stage.replace(";", ":").replace(" ", "_")] + [frame_label(code) for code in reversed(stack)]
+                    lines.append(f"{';'.join(labels)} {ms}")
+            combined.extend(lines)
+            path = os.path.join(out_dir, re.sub(r"[^\w.-]+", "_", stage).strip("_") + ".folded")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            paths.append(path)
+        path = os.path.join(out_dir, "all.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(combined) + "\n")
+        paths.append(path)
+        path = os.path.join(out_dir, "categories.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.category_summary().to_dict(orient="index"), f, indent=2)
+        paths.append(path)
+        return paths
+
+
+def start_profiler(interval=0.005):
+    return SamplingProfiler(interval=interval).start()
+
+
+def finish_profiler(profiler, out_dir):
+    """stops the profiler, writes its output and prints where the time went"""
+    profiler.stop()
+    paths = profiler.write(out_dir)
+    print(profiler.category_summary().to_string())
+    print(f"flamegraph stacks written to {out_dir} ({len(paths)} files)")
+    return paths
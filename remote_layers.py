@@ -0,0 +1,114 @@
+"""remote reference layers and a concurrent prefetch for them
+layers are streamed to disk in chunks so a large response is never held in memory and kept as GeoParquet,
+prefetch_layers() downloads several at once so the wait is the slowest download rather than the sum
+run with: python remote_layers.py [names] [--refresh]"""
+import asyncio
+import os
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+from gis_io import cache_path, read_layer, read_geoparquet, write_geoparquet, record_io
+
+REMOTE_LAYERS = {
+    # https://gis-kingcounty.opendata.arcgis.com/datasets/afb2bb73bff048c48554fedd2366d83a_237/explore?location=47.462842%2C-121.887700%2C9.58
+    "watersheds": "https://gisdata.kingcounty.gov/arcgis/rest/services/OpenDataPortal/enviro___base/MapServer/237/query?outFields=*&where=1%3D1&f=geojson",
+    # https://gis-kingcounty.opendata.arcgis.com/datasets/9ff7b65f45c94880bd8a6466c191f264_2587/explore?location=47.463068%2C-121.930050%2C10.19
+    "cao": "https://gisdata.kingcounty.gov/arcgis/rest/services/OpenDataPortal/enviro___base/MapServer/2587/query?outFields=*&where=1%3D1&f=geojson",
+    # https://geo.wa.gov/datasets/c2c929f4bf0046aa814648823ccb6206_0/explore?location=47.224740%2C-120.811974%2C7.54
+    "environmental_health": "https://services8.arcgis.com/rGGrs6HCnw87OFOT/arcgis/rest/services/Environmental_Effects/FeatureServer/0/query?outFields=*&where=1%3D1&f=geojson",
+    # https://geo.wa.gov/datasets/6cc232508784436ab93965f0775b84c6_0/explore?location=47.184033%2C-120.811974%2C7.54
+    "poverty": "https://services8.arcgis.com/rGGrs6HCnw87OFOT/arcgis/rest/services/Population_Living_in_Poverty_v2/FeatureServer/0/query?outFields=*&where=1%3D1&f=geojson",
+    # https://geo.wa.gov/datasets/2259cc832d7a4c2eaa557b7b478e3288_1/explore?location=47.392686%2C-120.869000%2C7.62
+    "nhd_waterbodies": "https://services.arcgis.com/6lCKYNJLvwTXqrmp/arcgis/rest/services/NHD/FeatureServer/5/query?outFields=*&where=1%3D1&f=geojson",
+}
+
+# simultaneous downloads per server, the arcgis services throttle clients that open too many
+PER_HOST_LIMIT = 2
+
+# (connect, read) seconds, read is the longest wait between chunks not the whole download
+TIMEOUT = (10, 300)
+
+CHUNK_SIZE = 1 << 20
+
+
+def download_path(name):
+    return cache_path(f"downloads/{name}.parquet")
+
+
+def download_layer(name, refresh=False, timeout=TIMEOUT):
+    """streams a remote layer to a temporary file, converts it to GeoParquet in the download cache and returns that path
+    the response body is never held as a string, pyogrio reads the temporary file directly into columns,
+    the parquet file is written under a .part name first so an interrupted run is never mistaken for a finished one"""
+    import requests
+    path = download_path(name)
+    if os.path.exists(path) and not refresh:
+        return path
+    download_dir = os.path.dirname(path)
+    os.makedirs(download_dir, exist_ok=True)
+    url = REMOTE_LAYERS[name]
+    print(f"downloading {name}")
+    start = time.perf_counter()
+    with tempfile.NamedTemporaryFile(suffix=".geojson", dir=download_dir, delete=False) as f:
+        temp_path = f.name
+        try:
+            with requests.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+        except BaseException:
+            f.close()
+            os.remove(temp_path)
+            raise
+    try:
+        record_io("download", url, start, None, os.path.getsize(temp_path))
+        part = f"{path}.part"
+        write_geoparquet(read_layer(temp_path), part)
+        os.replace(part, path)
+    finally:
+        os.remove(temp_path)
+    return path
+
+
+async def _download(name, semaphores, refresh, timeout):
+    async with semaphores[urlparse(REMOTE_LAYERS[name]).netloc]:
+        return await asyncio.to_thread(download_layer, name, refresh, timeout)
+
+
+async def _prefetch(names, max_per_host, refresh, timeout):
+    semaphores = defaultdict(lambda: asyncio.Semaphore(max_per_host))
+    results = await asyncio.gather(*(_download(name, semaphores, refresh, timeout) for name in names), return_exceptions=True)
+    return dict(zip(names, results))
+
+
+def prefetch_layers(names=None, max_per_host=PER_HOST_LIMIT, refresh=False, timeout=TIMEOUT):
+    """downloads the named layers (all of them by default) concurrently, returns {name: path or exception}
+    a failed download is printed and returned rather than raised so it doesn't stop the others"""
+    names = list(REMOTE_LAYERS) if names is None else list(names)
+    if not names:
+        return {}
+    start = time.perf_counter()
+    results = asyncio.run(_prefetch(names, max_per_host, refresh, timeout))
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            print(f"Error fetching {name}: {result}")
+    print(f"prefetched {len(names)} layers in {time.perf_counter() - start:.1f} s")
+    return results
+
+
+def remote_layer(name, columns=None, bbox=None, refresh=False):
+    """reads a remote layer from the download cache, downloading it first if needed
+    columns and bbox behave like read_layer"""
+    return read_geoparquet(download_layer(name, refresh=refresh), columns=columns, bbox=bbox)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="download the remote reference layers")
+    parser.add_argument("names", nargs="*", help=f"layers to download, all by default ({', '.join(REMOTE_LAYERS)})")
+    parser.add_argument("--refresh", action="store_true", help="download again even if the layer is cached")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(REMOTE_LAYERS)
+    if unknown:
+        parser.error(f"unknown layers: {', '.join(sorted(unknown))}")
+    prefetch_layers(args.names or None, refresh=args.refresh)
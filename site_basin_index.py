@@ -0,0 +1,165 @@
+"""persisted site -> basin lookup
+basins change maybe once a year, so which basin each site falls in is kept on disk and only worked out
+again for sites that are new or have moved, the index is versioned by the basin geometry so a new basin
+layer rebuilds it. the dash app can read it with load_index() and answer "which basin is this site in"
+with a dictionary lookup. given the basins' intersect fractions and a threshold it also keeps whether each
+site is in the WTD service area, saved with the threshold it was worked out for. a site on the boundary of
+two basins is given the first of them (in basin layer order), where the spatial join this replaces returned
+one row per basin and so duplicated the site"""
+import json
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from gis_io import cache_path
+from layer_registry import geometry_key
+from site_diff import KEY_COLUMN, site_keys
+
+INDEX_FILE = "site_basin_index.parquet"
+
+# basin_pos is the basin's row in the basin layer the index was built against, -1 when the site is in no basin
+# wtd_service_area is whether that basin is at least the saved intersect_fraction inside the service area
+INDEX_COLUMNS = [KEY_COLUMN, "latitude", "longitude", "basin_pos", "basin", "intersect_frac", "wtd_service_area"]
+
+
+def index_path():
+    """where the index is kept, looked up on every call so a cache directory set after import is used"""
+    return cache_path(INDEX_FILE)
+
+
+def _empty_index():
+    return pd.DataFrame({
+        KEY_COLUMN: pd.Series(dtype=str),
+        "latitude": pd.Series(dtype=float),
+        "longitude": pd.Series(dtype=float),
+        "basin_pos": pd.Series(dtype="int32"),
+        "basin": pd.Series(dtype=object),
+        "intersect_frac": pd.Series(dtype="float32"),
+        "wtd_service_area": pd.Series(dtype=bool),
+    })
+
+
+def _load(version, path):
+    """(index, metadata), both empty when there is no index or it was built against other basins"""
+    meta_path = path.replace(".parquet", ".json")
+    if not (os.path.exists(path) and os.path.exists(meta_path)):
+        return _empty_index().set_index(KEY_COLUMN), {}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if version is not None and meta.get("version") != version:
+        return _empty_index().set_index(KEY_COLUMN), {}
+    return pd.read_parquet(path).set_index(KEY_COLUMN), meta
+
+
+def load_index(version=None, path=None):
+    """returns the index keyed by site key, empty when there is none or it was built against other basins"""
+    return _load(version, path or index_path())[0]
+
+
+def save_index(index, version, path=None, basin_fracs=None, intersect_fraction=None):
+    """basin_fracs (intersect fraction per basin row) and intersect_fraction are what wtd_service_area was worked out from"""
+    path = path or index_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    index.reset_index().reindex(columns=INDEX_COLUMNS).to_parquet(path, index=False)
+    with open(path.replace(".parquet", ".json"), "w", encoding="utf-8") as f:
+        json.dump({"version": version, "basin_fracs": basin_fracs, "intersect_fraction": intersect_fraction}, f)
+    return path
+
+
+def _site_keys(sites_gdf):
+    # the incremental site update has already keyed the full table, a subset must keep those keys
+    if KEY_COLUMN in sites_gdf.columns:
+        return sites_gdf[KEY_COLUMN].astype(str)
+    return site_keys(sites_gdf)
+
+
+def update_index(sites_gdf, basins, basin_fracs=None, path=None, intersect_fraction=None):
+    """brings the index up to date for sites_gdf and returns it
+    only sites missing from the index or whose coordinates changed are joined against the basins.
+    basin_fracs (from basin_intersect_frac, same rows as basins) and intersect_fraction replace the ones the index
+    was saved with, the saved ones are used when they are None. with both known every entry has its basin's
+    intersect_frac and wtd_service_area, which are only worked out again when a site or either of them changed"""
+    path = path or index_path()
+    version = geometry_key(basins.geometry)
+    index, meta = _load(version, path)
+    if basin_fracs is None:
+        fracs = meta.get("basin_fracs")
+    else:
+        fracs = [None if np.isnan(v) else float(v) for v in basin_fracs["intersect_frac"]]
+    threshold = meta.get("intersect_fraction") if intersect_fraction is None else float(intersect_fraction)
+    if threshold is not None and fracs is None:
+        raise ValueError("the site basin index has no basin intersect fractions, pass basin_fracs")
+
+    points = sites_gdf.geometry.to_crs(basins.crs) if sites_gdf.crs != basins.crs else sites_gdf.geometry
+    current = pd.DataFrame({
+        "latitude": points.y.values,
+        "longitude": points.x.values,
+    }, index=pd.Index(_site_keys(sites_gdf).values, name=KEY_COLUMN))
+    current = current[~current.index.duplicated()]
+
+    known = current.index.isin(index.index)
+    stale = ~known
+    if known.any():
+        indexed = index.loc[current.index[known]]
+        same_place = (
+            np.isclose(indexed["latitude"].values, current.loc[known, "latitude"].values, equal_nan=True)
+            & np.isclose(indexed["longitude"].values, current.loc[known, "longitude"].values, equal_nan=True)
+        )
+        stale[np.flatnonzero(known)[~same_place]] = True
+
+    changed = stale.any()
+    if changed:
+        refresh = current[stale]
+        refresh_points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(refresh["longitude"], refresh["latitude"]), crs=basins.crs)
+        joined = gpd.sjoin(refresh_points, basins[[basins.geometry.name]].reset_index(drop=True), how="left", predicate="intersects")
+        # a site on a shared boundary keeps the first basin, like the map does
+        joined = joined[~joined.index.duplicated(keep="first")]
+        basin_pos = joined["index_right"].fillna(-1).astype("int32").values
+        refresh = refresh.assign(basin_pos=basin_pos)
+        index = pd.concat([index.drop(index.index.intersection(refresh.index)), refresh])
+
+    basin_pos = index["basin_pos"].astype("int32").values
+    if "basin" in basins.columns:
+        index["basin"] = basins["basin"].astype(object).reset_index(drop=True).reindex(basin_pos).values
+    if changed or fracs != meta.get("basin_fracs") or threshold != meta.get("intersect_fraction"):
+        if fracs is not None:
+            # compared in float64, a float32 fraction can land just under the threshold it equals
+            frac = pd.Series(fracs, dtype=float).reindex(basin_pos).values
+            index["intersect_frac"] = frac.astype("float32")
+            if threshold is not None:
+                index["wtd_service_area"] = frac >= threshold
+        save_index(index, version, path, fracs, threshold)
+    return index
+
+
+def index_values(sites_gdf, index, column, default=np.nan):
+    """a column of the index for each site, default for sites missing from it"""
+    return _site_keys(sites_gdf).map(index[column]).fillna(default).values
+
+
+def basin_positions(sites_gdf, index):
+    """row of each site's basin in the basin layer, -1 for sites outside every basin"""
+    keys = _site_keys(sites_gdf)
+    return keys.map(index["basin_pos"]).fillna(-1).astype("int32").values
+
+
+def attach_basins(sites_gdf, basins, columns=None, path=None):
+    """sites_gdf with the attributes of the basin each site falls in (all basin columns by default)
+    same result as a left sjoin that keeps the first basin of a site on a boundary (one row per site),
+    without the spatial join for known sites"""
+    index = update_index(sites_gdf, basins, path=path)
+    basin_pos = basin_positions(sites_gdf, index)
+    if columns is None:
+        columns = [c for c in basins.columns if c != basins.geometry.name]
+    attributes = basins[columns].reset_index(drop=True).reindex(basin_pos)
+    sites_gdf = sites_gdf.drop(columns=columns, errors="ignore").copy()
+    for col in columns:
+        sites_gdf[col] = attributes[col].values
+    return sites_gdf
+
+
+def site_basin_rows(sites_gdf, basins, path=None):
+    """basins that contain at least one site, in basin layer order"""
+    index = update_index(sites_gdf, basins, path=path)
+    basin_pos = basin_positions(sites_gdf, index)
+    return basins.iloc[np.unique(basin_pos[basin_pos >= 0])]
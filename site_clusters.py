@@ -0,0 +1,81 @@
+"""hierarchical clusters of a site layer, precomputed for every zoom level of the map
+at each zoom the clusters of the zoom below it are merged on a grid of radius pixel cells in web mercator, so a
+cluster always splits into whole clusters when zooming in and the browser only has to swap marker sets. every
+cluster keeps how many of its sites have each color so the layer's color coding survives in the summary icon"""
+import numpy as np
+
+MAX_LATITUDE = 85.0511287798
+
+
+def _mercator(lon, lat):
+    """lon/lat to web mercator in 0..1 map units"""
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    return (lon + 180) / 360, 0.5 - np.log(np.tan(np.pi / 4 + lat / 2)) / (2 * np.pi)
+
+
+def _lon_lat(mx, my):
+    return mx * 360 - 180, np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * my))))
+
+
+def _level(mx, my, count, bounds, color_counts, first, precision):
+    """json rows of one zoom level, sites that are alone are given by position so the page can draw their marker"""
+    lon, lat = _lon_lat(mx, my)
+    clustered = count > 1
+    rows = np.column_stack([lon, lat, bounds])[clustered].round(precision).tolist()
+    counts = count[clustered].astype(int).tolist()
+    colors = color_counts[clustered].tolist()
+    return {
+        "clusters": [row[:2] + [n] + row[2:] + c for row, n, c in zip(rows, counts, colors)],
+        "points": first[~clustered].tolist(),
+    }
+
+
+def cluster_levels(lon, lat, colors, radius=60, min_zoom=0, max_zoom=14, tile_size=256, precision=6):
+    """clusters of the sites at lon, lat for zooms min_zoom..max_zoom, beyond max_zoom every site is drawn
+    colors is each site's marker color, returns the json the ClusteredSiteLayer script reads:
+    palette, levels (each with clusters as [lon, lat, count, west, south, east, north, count per palette color]
+    and points, the positions of unclustered sites) and zooms, the level shown at each zoom from min_zoom.
+    zooms that cluster the same way share one level"""
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    palette, codes = np.unique(np.asarray(colors, dtype=str), return_inverse=True)
+
+    # start with every site as its own cluster
+    mx, my = _mercator(lon, lat)
+    count = np.ones(len(lon))
+    bounds = np.column_stack([lon, lat, lon, lat])
+    color_counts = np.zeros((len(lon), len(palette)), dtype=np.int64)
+    color_counts[np.arange(len(lon)), codes] = 1
+    first = np.arange(len(lon))
+
+    levels, zooms = [], []
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        cell = radius / (tile_size * 2 ** zoom)
+        columns = int(np.ceil(1 / cell)) + 1
+        keys = np.floor(mx / cell).astype(np.int64) * columns + np.floor(my / cell).astype(np.int64)
+        _, inverse = np.unique(keys, return_inverse=True)
+        merged = inverse.max() + 1 < len(count) if len(count) else False
+        if merged:
+            order = np.argsort(inverse, kind="stable")
+            starts = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+            weight = np.bincount(inverse, count)
+            mx = np.bincount(inverse, mx * count) / weight
+            my = np.bincount(inverse, my * count) / weight
+            bounds = np.column_stack([
+                np.minimum.reduceat(bounds[order, :2], starts),
+                np.maximum.reduceat(bounds[order, 2:], starts),
+            ])
+            color_counts = np.add.reduceat(color_counts[order], starts)
+            first = first[order][starts]
+            count = weight
+        if merged or not levels:
+            levels.append(_level(mx, my, count, bounds, color_counts, first, precision))
+        zooms.append(len(levels) - 1)
+
+    return {
+        "min_zoom": min_zoom,
+        "max_zoom": max_zoom,
+        "palette": palette.tolist(),
+        "levels": levels,
+        "zooms": zooms[::-1],
+    }
@@ -0,0 +1,93 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from gis_io import cache_path
+
+# last processed site table (basin, WTD Service Area, Intersect_Frac already assigned)
+SNAPSHOT_FILE = "site_snapshot.parquet"
+
+KEY_COLUMN = "_site_key"
+
+
+def snapshot_path():
+    """where the snapshot is kept, looked up on every call so a cache directory set after import is used"""
+    return cache_path(SNAPSHOT_FILE)
+
+
+def site_keys(sites, key_columns=("site", "site_name")):
+    """stable row key for a site table
+    site codes are not unique (proposed sites are all "NEW") so the name and occurrence number are added"""
+    # missing values and missing columns key as "", astype(str) alone keeps NaN on newer pandas
+    parts = sites.reindex(columns=list(key_columns)).astype(object).fillna("").astype(str)
+    key = parts.iloc[:, 0].str.cat([parts[c] for c in parts.columns[1:]], sep="|")
+    occurrence = key.groupby(key).cumcount().astype(str)
+    return key + "|" + occurrence
+
+
+def load_snapshot(path=None):
+    """returns (snapshot GeoDataFrame, metadata) or (None, {}) when there is no snapshot"""
+    path = path or snapshot_path()
+    meta_path = path.replace(".parquet", ".json")
+    if not (os.path.exists(path) and os.path.exists(meta_path)):
+        return None, {}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return gpd.read_parquet(path), meta
+
+
+def save_snapshot(sites_gdf, meta, path=None):
+    """saves the processed site table and metadata used to decide whether it can be reused"""
+    path = path or snapshot_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    sites_gdf.to_parquet(path)
+    with open(path.replace(".parquet", ".json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return path
+
+
+def diff_sites(new_sites, old_sites, compare_columns=None):
+    """compares a new raw site table against the last snapshot, both keyed by KEY_COLUMN
+    returns lists of keys that were added, removed, moved (coordinates changed) or changed (other attributes changed)"""
+    new = new_sites.drop_duplicates(subset=KEY_COLUMN).set_index(KEY_COLUMN)
+    old = old_sites.drop_duplicates(subset=KEY_COLUMN).set_index(KEY_COLUMN)
+
+    added = new.index.difference(old.index, sort=False)
+    removed = old.index.difference(new.index, sort=False)
+    common = new.index.intersection(old.index, sort=False)
+
+    moved = pd.Index([])
+    if len(common):
+        same_place = (
+            np.isclose(new.loc[common, "latitude"].astype(float), old.loc[common, "latitude"].astype(float))
+            & np.isclose(new.loc[common, "longitude"].astype(float), old.loc[common, "longitude"].astype(float))
+        )
+        moved = common[~same_place]
+
+    if compare_columns is None:
+        # underscore columns are bookkeeping (ie row order), not site attributes
+        compare_columns = [c for c in new.columns if c in old.columns and not c.startswith("_")
+                           and c not in ("latitude", "longitude", new_sites.geometry.name)]
+    unmoved = common.difference(moved, sort=False)
+    changed = pd.Index([])
+    if len(unmoved) and compare_columns:
+        # compare as text so dtype differences after the parquet round trip do not count as edits
+        new_values = new.loc[unmoved, compare_columns].astype(str).fillna("")
+        old_values = old.loc[unmoved, compare_columns].astype(str).fillna("")
+        changed = unmoved[(new_values != old_values).any(axis=1).values]
+
+    return {
+        "added": list(added),
+        "removed": list(removed),
+        "moved": list(moved),
+        "changed": list(changed),
+    }
+
+
+def diff_is_empty(diff):
+    return not any(diff.values())
+
+
+def diff_summary(diff):
+    return ", ".join(f"{len(keys)} {name}" for name, keys in diff.items())
@@ -0,0 +1,70 @@
+"""row positions of a site table grouped by its categorical columns
+the map layers are different slices of the same sites (by parameter, program, WTD vs SWM, ...), the groups are
+built once per column and a layer's filter becomes set operations on small position arrays instead of a boolean
+mask and a copy of the whole GeoDataFrame per layer. filters are dicts of column -> value, list of values,
+{"not": value} or {"not_blank": True}"""
+import json
+import numpy as np
+import pandas as pd
+
+_EMPTY = np.array([], dtype=np.intp)
+
+
+class SiteGroups:
+    """group index over one site table, keep one per table and share it between layers and maps"""
+
+    def __init__(self, sites_gdf):
+        self.sites_gdf = sites_gdf
+        self.all = np.arange(len(sites_gdf))
+        # column -> {value: sorted positions}, missing values are under None
+        self._groups = {}
+        # filter json -> positions
+        self._selections = {}
+        self._xy = None
+
+    def groups(self, column):
+        if column not in self._groups:
+            codes, uniques = pd.factorize(self.sites_gdf[column])
+            order = np.argsort(codes, kind="stable")
+            # codes are -1 for missing values, which sort first
+            counts = np.bincount(codes + 1, minlength=len(uniques) + 1)
+            splits = np.split(order, np.cumsum(counts)[:-1])
+            groups = {None: splits[0]}
+            groups.update(zip(uniques, splits[1:]))
+            self._groups[column] = groups
+        return self._groups[column]
+
+    def _clause(self, column, value):
+        groups = self.groups(column)
+        if isinstance(value, dict):
+            if "not" in value:
+                return np.setdiff1d(self.all, self._clause(column, value["not"]), assume_unique=True)
+            if value.get("not_blank"):
+                blank = [positions for key, positions in groups.items() if key is None or str(key).strip() == ""]
+                return np.setdiff1d(self.all, np.concatenate([_EMPTY, *blank]), assume_unique=True)
+            raise ValueError(f"unsupported site filter {value!r}")
+        if isinstance(value, (list, tuple, set)):
+            return np.sort(np.concatenate([_EMPTY, *(groups.get(v, _EMPTY) for v in set(value))]))
+        return groups.get(value, _EMPTY)
+
+    def positions(self, site_filter=None):
+        """sorted row positions of the sites matching site_filter, every site when it is empty"""
+        key = json.dumps(site_filter or {}, sort_keys=True, default=str)
+        positions = self._selections.get(key)
+        if positions is None:
+            positions = self.all
+            for column, value in (site_filter or {}).items():
+                positions = np.intersect1d(positions, self._clause(column, value), assume_unique=True)
+            self._selections[key] = positions
+        return positions
+
+    def select(self, site_filter=None):
+        """the matching rows as a GeoDataFrame"""
+        return self.sites_gdf.iloc[self.positions(site_filter)]
+
+    def xy(self):
+        """(x, y) coordinate arrays of every site"""
+        if self._xy is None:
+            geometry = self.sites_gdf.geometry
+            self._xy = (geometry.x.to_numpy(), geometry.y.to_numpy())
+        return self._xy
@@ -0,0 +1,167 @@
+"""publish stage for the generated map pages before they go to GitHub Pages
+pages are minified, blocks that several pages embed byte for byte (the layer data both maps share, identical
+style and script blocks) move to assets/<content hash>.js|css next to the pages so a browser downloads them
+once, and every page and asset gets precompressed .gz and .br siblings for hosts that serve them directly.
+brotli is optional, without it only .gz files are written"""
+import gzip
+import hashlib
+import json
+import os
+import re
+from instrumentation import instrumented
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_DIR = "assets"
+
+# which assets each published page uses, kept in the assets directory
+ASSET_MANIFEST = "published.json"
+
+# shared blocks smaller than this stay inline, a separate request costs more than it saves
+MIN_ASSET_BYTES = 1024
+
+_BLOCK = re.compile(r"<(style|script)>(.*?)</\1>", re.S)
+_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.S)
+
+# elements whose content is kept byte for byte, whitespace in them is part of the content
+_VERBATIM = re.compile(r"(<(script|pre|textarea)\b[^>]*>.*?</\2\s*>)", re.S | re.I)
+
+
+def _minify_markup(markup):
+    markup = _COMMENT.sub("", markup)
+    return "\n".join(line for line in (line.strip() for line in markup.splitlines()) if line)
+
+
+def minify_html(html):
+    """drops html comments, indentation and blank lines from the markup
+    scripts, <pre> and <textarea> are left as they are, their whitespace and anything that looks like a comment
+    in them (template literals, strings) is content"""
+    parts = _VERBATIM.split(html)
+    # split puts the tag name group after every verbatim element
+    out = []
+    for i in range(0, len(parts), 3):
+        out.append(_minify_markup(parts[i]))
+        if i + 1 < len(parts):
+            out.append(parts[i + 1])
+    return "\n".join(part for part in out if part)
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def precompress(path):
+    """writes path.gz (and path.br when brotli is installed) next to path, returns {suffix: bytes}"""
+    with open(path, "rb") as f:
+        data = f.read()
+    sizes = {"": len(data)}
+    # mtime=0 so an unchanged file compresses to the same bytes and doesn't show up as changed
+    compressed = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed[".br"] = brotli.compress(data, quality=11)
+    for suffix, payload in compressed.items():
+        with open(path + suffix, "wb") as f:
+            f.write(payload)
+        sizes[suffix] = len(payload)
+    return sizes
+
+
+def _write_asset(assets_dir, name, content):
+    path = os.path.join(assets_dir, name)
+    if not os.path.exists(path):
+        os.makedirs(assets_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+    return path
+
+
+def _shared(candidates, pages):
+    """candidates that appear in at least two pages and are worth a request"""
+    return [c for c in dict.fromkeys(candidates)
+            if len(c.encode("utf-8")) >= MIN_ASSET_BYTES and sum(c in html for html in pages.values()) > 1]
+
+
+def _remove_unused_assets(assets_dir, pages, assets):
+    """records which assets each page published into assets_dir uses, and deletes the assets no page uses
+    any more with their compressed siblings. pages published separately into the same assets_dir keep theirs,
+    files this module didn't write are never touched"""
+    manifest_path = os.path.join(assets_dir, ASSET_MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    known = {asset for used in manifest.values() for asset in used}
+    # a page that was deleted since it was last published no longer holds on to its assets
+    manifest = {page: used for page, used in manifest.items() if os.path.exists(os.path.join(assets_dir, page))}
+    # pages are recorded relative to assets_dir, the manifest is published with them
+    manifest.update({os.path.relpath(page, assets_dir).replace(os.sep, "/"): sorted(used) for page, used in pages.items()})
+    in_use = {asset for used in manifest.values() for asset in used}
+    for name in (known | set(assets)) - in_use:
+        for suffix in ("", ".gz", ".br"):
+            path = os.path.join(assets_dir, name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+    os.makedirs(assets_dir, exist_ok=True)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+@instrumented
+def publish_static(pages, shared_data=(), minify=True, compress=True, assets_dir=None):
+    """rewrites the html files in pages for hosting, returns {path: {suffix: bytes}} of every file written
+    shared_data are data strings the pages embed as javascript values (shared_layers() text), a string found
+    in more than one page becomes a variable defined in an asset script. assets_dir defaults to assets/
+    next to the first page and should be shared by every page that is published together"""
+    pages = list(pages)
+    if not pages:
+        return {}
+    assets_dir = assets_dir or os.path.join(os.path.dirname(pages[0]), ASSET_DIR)
+    html = {}
+    for path in pages:
+        with open(path, encoding="utf-8") as f:
+            html[path] = f.read()
+
+    # {text found in the pages: (asset file, what replaces the text, tag loaded in <head> or None)}
+    replacements = {}
+    for data in _shared(shared_data, html):
+        name = f"layer_{content_hash(data)}"
+        asset = _write_asset(assets_dir, f"{name}.js", f"var {name} = {data};\n")
+        replacements[data] = (asset, name, '<script src="{src}"></script>')
+    blocks = [match.group(0) for text in html.values() for match in _BLOCK.finditer(text)]
+    for block in _shared(blocks, html):
+        kind, content = _BLOCK.fullmatch(block).groups()
+        suffix = ".css" if kind == "style" else ".js"
+        asset = _write_asset(assets_dir, f"{content_hash(content)}{suffix}", content.strip() + "\n")
+        tag = '<link rel="stylesheet" href="{src}">' if kind == "style" else '<script src="{src}"></script>'
+        replacements[block] = (asset, tag, None)
+
+    written = {}
+    # page -> names of the assets it uses
+    used = {}
+    for path, text in html.items():
+        head = []
+        used[path] = set()
+        for old, (asset, new, head_tag) in replacements.items():
+            if old not in text:
+                continue
+            used[path].add(os.path.basename(asset))
+            src = os.path.relpath(asset, os.path.dirname(path) or ".").replace(os.sep, "/")
+            text = text.replace(old, new.format(src=src))
+            if head_tag:
+                head.append(head_tag.format(src=src))
+        if head:
+            text = text.replace("</head>", "\n".join(head) + "\n</head>", 1)
+        if minify:
+            text = minify_html(text)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        written[path] = precompress(path) if compress else {"": len(text.encode("utf-8"))}
+
+    if compress:
+        for asset in {asset for asset, _, _ in replacements.values()}:
+            written[asset] = precompress(asset)
+    _remove_unused_assets(assets_dir, used, {os.path.basename(asset) for asset, _, _ in replacements.values()})
+    return written
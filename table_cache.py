@@ -0,0 +1,156 @@
+"""results of get_table_data kept in a sqlite file so every gunicorn worker shares them
+entries are keyed on (table, site, parameter), expire after TTL_SECONDS and the least recently used ones are
+evicted past MAX_ENTRIES or MAX_BYTES. a write to a table calls invalidate() with the sites it touched, which
+drops those sites' entries and the table wide ones, entries for other sites stay cached"""
+import os
+import pickle
+import sqlite3
+import time
+from gis_io import cache_path
+
+CACHE_FILE = "table_cache.sqlite"
+
+TTL_SECONDS = 300
+MAX_ENTRIES = 512
+MAX_BYTES = 64 * 1024 * 1024
+
+CACHE_STATS = {"hits": 0, "misses": 0, "stale": 0}
+
+# site and parameter are stored as "" when the query wasn't filtered on them
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    table_name TEXT NOT NULL,
+    site TEXT NOT NULL,
+    parameter TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (table_name, site, parameter)
+);
+CREATE TABLE IF NOT EXISTS invalidations (
+    table_name TEXT NOT NULL,
+    site TEXT NOT NULL,
+    at REAL NOT NULL,
+    PRIMARY KEY (table_name, site)
+);
+"""
+
+_connections = {}
+
+
+def cache_file():
+    """the sqlite file, looked up on every call so a cache directory set after import is used"""
+    return cache_path(CACHE_FILE)
+
+
+def _connect(path=None):
+    """one connection per process and path, sqlite connections can't be shared across a fork"""
+    path = path or cache_file()
+    key = (os.getpid(), path)
+    conn = _connections.get(key)
+    if conn is None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _connections[key] = conn
+    return conn
+
+
+def _key(table_name, site, parameter):
+    return (table_name, "" if site is None else str(site), "" if parameter is None else str(parameter))
+
+
+def get(table_name, site=None, parameter=None, ttl=TTL_SECONDS, path=None):
+    """cached DataFrame or None"""
+    conn = _connect(path)
+    key = _key(table_name, site, parameter)
+    row = conn.execute(
+        "SELECT created, data FROM entries WHERE table_name = ? AND site = ? AND parameter = ?", key
+    ).fetchone()
+    if row is None:
+        CACHE_STATS["misses"] += 1
+        return None
+    now = time.time()
+    if now - row[0] > ttl:
+        CACHE_STATS["stale"] += 1
+        conn.execute("DELETE FROM entries WHERE table_name = ? AND site = ? AND parameter = ?", key)
+        return None
+    CACHE_STATS["hits"] += 1
+    conn.execute("UPDATE entries SET last_used = ? WHERE table_name = ? AND site = ? AND parameter = ?", (now, *key))
+    return pickle.loads(row[1])
+
+
+def put(table_name, site, parameter, df, started, path=None):
+    """stores a query result, started is the time.time() the query began
+    a result is dropped if its table or site was invalidated while the query ran, it may be missing the write"""
+    conn = _connect(path)
+    key = _key(table_name, site, parameter)
+    data = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) > MAX_BYTES:
+        return False
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # an unfiltered result covers every site, so any write to the table makes it stale
+        if key[1]:
+            where, params = "table_name = ? AND site IN (?, '')", (table_name, key[1])
+        else:
+            where, params = "table_name = ?", (table_name,)
+        invalidated = conn.execute(f"SELECT MAX(at) FROM invalidations WHERE {where}", params).fetchone()[0]
+        if invalidated is not None and invalidated >= started:
+            conn.execute("COMMIT")
+            return False
+        conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", (*key, now, now, len(data), data))
+        _evict(conn, now)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return True
+
+
+def _evict(conn, now):
+    conn.execute("DELETE FROM entries WHERE created < ?", (now - TTL_SECONDS,))
+    count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+    if count <= MAX_ENTRIES and size <= MAX_BYTES:
+        return
+    evicted = 0
+    for rowid, entry_size in conn.execute("SELECT rowid, size FROM entries ORDER BY last_used").fetchall():
+        if count <= MAX_ENTRIES and size <= MAX_BYTES:
+            break
+        conn.execute("DELETE FROM entries WHERE rowid = ?", (rowid,))
+        count -= 1
+        size -= entry_size
+        evicted += 1
+    return evicted
+
+
+def invalidate(table_name, sites=None, path=None):
+    """drops cached results a write to table_name made stale, sites are the sites the write touched
+    (None when unknown, which drops everything cached for the table)"""
+    conn = _connect(path)
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if sites is None:
+            conn.execute("DELETE FROM entries WHERE table_name = ?", (table_name,))
+            conn.execute("INSERT OR REPLACE INTO invalidations VALUES (?, '', ?)", (table_name, now))
+        else:
+            sites = sorted({str(site) for site in sites})
+            # unfiltered results include the written sites too
+            conn.execute("DELETE FROM entries WHERE table_name = ? AND site = ''", (table_name,))
+            conn.executemany("DELETE FROM entries WHERE table_name = ? AND site = ?", [(table_name, site) for site in sites])
+            conn.executemany("INSERT OR REPLACE INTO invalidations VALUES (?, ?, ?)", [(table_name, site, now) for site in sites])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def clear(path=None):
+    conn = _connect(path)
+    conn.execute("DELETE FROM entries")
+    conn.execute("DELETE FROM invalidations")
@@ -0,0 +1,74 @@
+"""reads from the ISP postgres tables, shared by the pipeline scripts and the dash app
+results go through table_cache so repeated grid selections don't go back to the database"""
+import os
+import time
+from functools import lru_cache
+import pandas as pd
+import table_cache
+
+
+@lru_cache(maxsize=None)
+def _engine(database_url):
+    from sqlalchemy import create_engine
+    return create_engine(database_url, pool_pre_ping=True)
+
+
+def get_engine():
+    """SQLAlchemy engine for DATABASE_URL, created once per process so connections are pooled"""
+    from dotenv import load_dotenv
+    # get connection information
+    load_dotenv()
+    DATABASE_URL = os.environ.get("DATABASE_URL")
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL is not set.")
+    return _engine(DATABASE_URL)
+
+
+@lru_cache(maxsize=None)
+def _reflect(engine, table_name):
+    from sqlalchemy import MetaData, Table
+    return Table(table_name, MetaData(), autoload_with=engine)
+
+
+def reflect_table(table_name, engine=None):
+    """SQLAlchemy Table for a database table, its columns are what grid column names are checked against"""
+    return _reflect(engine or get_engine(), table_name)
+
+
+def query_table(table_name, selected_site=None, parameter=None):
+    """reads a table from the database, optionally filtered to one site and parameter"""
+    from sqlalchemy import text
+    conditions = []
+    params = {}
+    if selected_site is not None:
+        conditions.append("site = :site")
+        params["site"] = selected_site
+    # Add parameter filter if provided
+    if parameter is not None:
+        conditions.append("parameter = :parameter")
+        params["parameter"] = parameter
+    base_query = f'SELECT * FROM "{table_name}"'
+    if conditions:
+        base_query += " WHERE " + " AND ".join(conditions)
+
+    with get_engine().connect() as conn:
+        return pd.read_sql(text(base_query), conn, params=params or None)
+
+
+# not @instrumented, the dash app calls this on every request and the stage log is for pipeline runs
+def get_table_data(table_name, selected_site=None, parameter=None, use_cache=True):
+    """a table as a DataFrame, served from the shared result cache when it has a fresh copy"""
+    if use_cache:
+        df = table_cache.get(table_name, selected_site, parameter)
+        if df is not None:
+            return df
+    started = time.time()
+    df = query_table(table_name, selected_site, parameter)
+    if use_cache:
+        table_cache.put(table_name, selected_site, parameter, df, started)
+    return df
+
+
+def invalidate_table_data(table_name, sites=None):
+    """call after writing to table_name, sites are the sites written (None for all of them)"""
+    table_cache.invalidate(table_name, sites)
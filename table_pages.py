@@ -0,0 +1,198 @@
+"""block requests from the AgGrid infinite row model, answered with keyset paginated SQL
+the grid asks for rows startRow..endRow with its sort and filter models. the sort always ends on the id column so
+every row has a unique position, and the key of the last row of each block is remembered so the next block is
+a WHERE (sort key) > (last key) LIMIT n query that reads only the rows it returns. a block whose start wasn't seen
+before (a jump with the scrollbar, or another worker served the previous block) falls back to OFFSET.
+blocks go through table_cache like get_table_data, keyed on the site the grid filters on, so a save to that site
+(or any save, for blocks not filtered to one site) drops them"""
+import json
+import time
+from collections import OrderedDict
+import table_cache
+from table_data import get_engine, reflect_table
+
+KEY_COLUMN = "id"
+
+BLOCK_SIZE = 100
+
+# (table, sort, filter, start row) -> sort key of the row before start row
+MAX_BOUNDARIES = 4096
+_boundaries = OrderedDict()
+
+CACHE_STATS = {"keyset": 0, "offset": 0}
+
+
+def _column(table, name):
+    if name not in table.columns:
+        raise ValueError(f"{table.name} has no column {name!r}")
+    return table.columns[name]
+
+
+def _order(table, sort_model):
+    """(column, descending) pairs, always ending with the id column as the tie breaker"""
+    order = [(_column(table, s["colId"]), s.get("sort") == "desc") for s in sort_model or [] if s.get("colId") != KEY_COLUMN]
+    descending = next((s.get("sort") == "desc" for s in sort_model or [] if s.get("colId") == KEY_COLUMN), False)
+    return order + [(_column(table, KEY_COLUMN), descending)]
+
+
+def _text_condition(column, filter_type, value):
+    from sqlalchemy import or_
+    if filter_type == "contains":
+        return column.ilike(f"%{value}%")
+    if filter_type == "notContains":
+        return or_(column.is_(None), ~column.ilike(f"%{value}%"))
+    if filter_type == "equals":
+        return column == value
+    if filter_type == "notEqual":
+        return or_(column.is_(None), column != value)
+    if filter_type == "startsWith":
+        return column.ilike(f"{value}%")
+    if filter_type == "endsWith":
+        return column.ilike(f"%{value}")
+    raise ValueError(f"unsupported text filter {filter_type!r}")
+
+
+def _number_condition(column, filter_type, value, value_to=None):
+    from sqlalchemy import or_
+    if filter_type == "equals":
+        return column == value
+    if filter_type == "notEqual":
+        return or_(column.is_(None), column != value)
+    if filter_type == "greaterThan":
+        return column > value
+    if filter_type == "greaterThanOrEqual":
+        return column >= value
+    if filter_type == "lessThan":
+        return column < value
+    if filter_type == "lessThanOrEqual":
+        return column <= value
+    if filter_type == "inRange":
+        return column.between(value, value_to)
+    raise ValueError(f"unsupported number filter {filter_type!r}")
+
+
+def _condition(column, model):
+    """where clause for one column's entry in the grid's filterModel"""
+    from sqlalchemy import and_, or_
+    if "conditions" in model or "condition1" in model:
+        conditions = model.get("conditions") or [model["condition1"], model["condition2"]]
+        combine = or_ if model.get("operator") == "OR" else and_
+        return combine(*(_condition(column, condition) for condition in conditions))
+    filter_type = model.get("type")
+    if filter_type == "blank":
+        return column.is_(None)
+    if filter_type == "notBlank":
+        return column.is_not(None)
+    if model.get("filterType") == "number":
+        return _number_condition(column, filter_type, model.get("filter"), model.get("filterTo"))
+    return _text_condition(column, filter_type, model.get("filter"))
+
+
+def _keyset_condition(order, key):
+    """rows after key in the given order, spelled out column by column so mixed sort directions work
+    nulls sort last in either direction (see fetch_block), so they come after any value and only after a null"""
+    from sqlalchemy import and_, or_
+    branches = []
+    for i, (column, descending) in enumerate(order):
+        equal = [order[j][0].is_(None) if key[j] is None else order[j][0] == key[j] for j in range(i)]
+        if key[i] is None:
+            continue
+        after = column < key[i] if descending else column > key[i]
+        branches.append(and_(*equal, or_(after, column.is_(None))))
+    return or_(*branches)
+
+
+def _boundary_key(table_name, sort_model, filter_model, start_row):
+    return (table_name, json.dumps(sort_model or [], sort_keys=True), json.dumps(filter_model or {}, sort_keys=True), start_row)
+
+
+def _remember(key, value):
+    _boundaries[key] = value
+    _boundaries.move_to_end(key)
+    while len(_boundaries) > MAX_BOUNDARIES:
+        _boundaries.popitem(last=False)
+
+
+def _filtered_site(filter_model):
+    """the site a filter model restricts the rows to, None when it doesn't pin one site"""
+    model = (filter_model or {}).get("site") or {}
+    if model.get("type") == "equals" and model.get("filter") is not None:
+        return model["filter"]
+    return None
+
+
+def _block_parameter(start_row, end_row, sort_model, filter_model):
+    # table_cache's parameter slot, prefixed so it can't meet a get_table_data parameter
+    return "block:" + json.dumps([start_row, end_row, sort_model or [], filter_model or {}], sort_keys=True)
+
+
+def fetch_block(table_name, start_row, end_row, sort_model=None, filter_model=None, engine=None, use_cache=True):
+    """rows start_row..end_row of the table as the grid sorts and filters it
+    returns the getRowsResponse dict dash-ag-grid expects, rowCount stays -1 (unknown) until the last block,
+    so the table is never counted. only blocks read with the default engine are cached"""
+    use_cache = use_cache and engine is None
+    if use_cache:
+        site = _filtered_site(filter_model)
+        parameter = _block_parameter(start_row, end_row, sort_model, filter_model)
+        response = table_cache.get(table_name, site, parameter)
+        if response is not None:
+            _remember_last(table_name, sort_model, filter_model, start_row, response["rowData"], engine)
+            return response
+        started = time.time()
+    response = _query_block(table_name, start_row, end_row, sort_model, filter_model, engine)
+    if use_cache:
+        table_cache.put(table_name, site, parameter, response, started)
+    return response
+
+
+def _remember_last(table_name, sort_model, filter_model, start_row, rows, engine=None):
+    """remembers the sort key of a block's last row, where the next block starts"""
+    if not rows:
+        return
+    order = _order(reflect_table(table_name, engine or get_engine()), sort_model)
+    _remember(_boundary_key(table_name, sort_model, filter_model, start_row + len(rows)),
+              tuple(rows[-1][column.name] for column, _ in order))
+
+
+def _query_block(table_name, start_row, end_row, sort_model=None, filter_model=None, engine=None):
+    from sqlalchemy import select
+    engine = engine or get_engine()
+    table = reflect_table(table_name, engine)
+    order = _order(table, sort_model)
+    limit = max(end_row - start_row, 0)
+
+    query = select(table)
+    for name, model in (filter_model or {}).items():
+        query = query.where(_condition(_column(table, name), model))
+    # postgres puts nulls first when descending, the keyset condition needs them in one place
+    query = query.order_by(*((column.desc() if descending else column.asc()).nulls_last() for column, descending in order))
+
+    boundary = _boundaries.get(_boundary_key(table_name, sort_model, filter_model, start_row))
+    if start_row == 0:
+        pass
+    elif boundary is not None:
+        CACHE_STATS["keyset"] += 1
+        query = query.where(_keyset_condition(order, boundary))
+    else:
+        CACHE_STATS["offset"] += 1
+        query = query.offset(start_row)
+    query = query.limit(limit)
+
+    with engine.connect() as conn:
+        rows = [dict(row) for row in conn.execute(query).mappings()]
+    _remember_last(table_name, sort_model, filter_model, start_row, rows, engine)
+    row_count = start_row + len(rows) if len(rows) < limit else -1
+    return {"rowData": rows, "rowCount": row_count}
+
+
+def fetch_request(table_name, request, engine=None, use_cache=True):
+    """fetch_block for a dash-ag-grid getRowsRequest"""
+    return fetch_block(
+        table_name,
+        request.get("startRow", 0),
+        request.get("endRow", BLOCK_SIZE),
+        request.get("sortModel"),
+        request.get("filterModel"),
+        engine=engine,
+        use_cache=use_cache,
+    )
@@ -0,0 +1,98 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+
+# environmental health disparity ranks, these are small 1-10 scores so float32 is plenty
+EHD_COLUMNS = ['Diesel_PM2_5_Emissions', 'Ozone_Concentration', 'PM2_5',
+    'Proximity_to_Heavy_Traffic', 'Toxic_Release_from_Facilities', 'PTSDFs', 'PNPL', 'PRMP', 'PWDIS', 'LEP',
+    'POC', 'Poverty', 'CVD', 'LBW', 'Lead_Risk_from_Housing', 'No_HS_Diploma', 'Unaffordable_Housing', 'Unemployed',
+    'Environmental_Exposures_Theme', 'Environmental_Effects_Theme', 'Socioeconomic_Factors_Theme',
+    'Sensitive_Populations_Theme', 'Environmental_Health_Disparities']
+
+# dtypes for each table, columns missing from a table are skipped
+# environmental_condition is left as object because create_map recodes it to 1/2/3 in place
+SCHEMAS = {
+    "sites": {
+        "basin": "category",
+        "parameter": "category",
+        "program": "category",
+        "WTD vs SWM": "category",
+        "WRIA": "category",
+        "WTD Service Area": "bool",
+        "Intersect_Frac": "float32",
+        **{col: "float32" for col in EHD_COLUMNS},
+    },
+    "watersheds": {
+        "basin": "category",
+        "CSO_status": "bool",
+        "CSO_count": "int32",
+        "wtd_service_area": "bool",
+        "avg_ppov": "float32",
+        **{col: "float32" for col in EHD_COLUMNS},
+    },
+    "census": {
+        "basin": "category",
+        "TRACTCE10": "category",
+        "GEOID10": "category",
+        **{col: "float32" for col in EHD_COLUMNS},
+    },
+    "cao": {
+        "basin": "category",
+        "HAZARD_TYPE": "category",
+        "HAZARD_SUBTYPE": "category",
+        "HAZARD_BUFFER": "category",
+    },
+}
+
+# the last MAX_LOG_ENTRIES apply_schema calls, see memory_summary()
+MAX_LOG_ENTRIES = 10000
+MEMORY_LOG = deque(maxlen=MAX_LOG_ENTRIES)
+
+
+def memory_usage(df):
+    """deep memory usage of a DataFrame in bytes, geometry is counted as pointers only"""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def apply_schema(df, table, report=False):
+    """cast the columns of df to the dtypes declared for table in SCHEMAS
+    every call is recorded in MEMORY_LOG (shown by instrumentation.print_summary), report also prints it"""
+    before = memory_usage(df)
+    df = df.copy()
+    for col, dtype in SCHEMAS[table].items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        if dtype == "bool":
+            df[col] = df[col].fillna(False).astype(bool)
+        elif dtype == "category":
+            # list valued columns (parameter from the site table) can not be categorical
+            if df[col].map(lambda x: isinstance(x, (list, dict))).any():
+                continue
+            df[col] = df[col].astype("category")
+        else:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+    after = memory_usage(df)
+    MEMORY_LOG.append({"table": table, "rows": len(df), "bytes_before": before, "bytes_after": after})
+    if report:
+        print(f"{table}: {before / 1e6:.2f} MB -> {after / 1e6:.2f} MB ({len(df)} rows)")
+    return df
+
+
+def widen_floats(df):
+    """df with its float32 columns as float64, for writing json
+    the values are the decimals the float32s print as, widening alone keeps the float32 rounding error
+    (3.2 is stored as 3.2000000476837158 in float32) and json shows all of it"""
+    columns = [col for col in df.columns if df[col].dtype == np.float32]
+    if not columns:
+        return df
+    df = df.copy()
+    for col in columns:
+        df[col] = df[col].to_numpy().astype(str).astype(np.float64)
+    return df
+
+
+def memory_summary():
+    """returns the memory log as a DataFrame"""
+    summary = pd.DataFrame(list(MEMORY_LOG), columns=["table", "rows", "bytes_before", "bytes_after"])
+    summary["ratio"] = (summary["bytes_after"] / summary["bytes_before"]).round(2)
+    return summary
@@ -0,0 +1,142 @@
+"""write path for the editable AgGrids
+cell edits collect in a ChangeBuffer that lives in the session's dcc.Store, so it survives whichever gunicorn worker
+answers the next callback. edits to the same row are merged into one pending row, and flush_changes() writes the
+buffer as one multi-row INSERT ... ON CONFLICT (id) DO UPDATE in a single transaction, instead of a round trip
+per cell.
+there is no version check: a flush sets the edited columns to the browser's values, so when two people edit the
+same cell the last save wins. columns one of them didn't edit keep the other's value"""
+import math
+from table_data import get_engine, reflect_table, invalidate_table_data
+
+KEY_COLUMN = "id"
+
+
+def _clean(value):
+    # the default transect rows carry NaN, the database wants NULL
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class ChangeBuffer:
+    """pending edits for one table, keyed by row id
+    each entry keeps the row's latest values and which columns were edited, rows added with add_rows()
+    are new to the database and are inserted with every column they have"""
+
+    def __init__(self, table_name, defaults=None, rows=None, new_ids=None):
+        self.table_name = table_name
+        # column values every written row gets, e.g. the selected site for the transect grid
+        self.defaults = dict(defaults or {})
+        # row id -> {"data": {...}, "changed": [columns]}
+        self.rows = dict(rows or {})
+        self.new_ids = set(new_ids or [])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, cell_changes):
+        """merges dash-ag-grid cellValueChanged events into the buffer, returns self"""
+        for change in cell_changes or []:
+            data = change.get("data") or {}
+            row_id = data.get(KEY_COLUMN, change.get("rowId"))
+            if row_id is None:
+                continue
+            entry = self.rows.setdefault(str(row_id), {"data": {}, "changed": []})
+            entry["data"].update(data)
+            column = change.get("colId")
+            if column and column not in entry["changed"]:
+                entry["changed"].append(column)
+            # a row moved to another site leaves the old site's cached results stale too
+            if column == "site" and change.get("oldValue") is not None:
+                entry.setdefault("old_sites", []).append(change["oldValue"])
+        return self
+
+    def add_rows(self, rows):
+        """rows added in the grid (the transect grid's add row button), written in full on the next flush"""
+        for data in rows or []:
+            row_id = str(data[KEY_COLUMN])
+            self.rows[row_id] = {"data": dict(data), "changed": [c for c in data if c != KEY_COLUMN]}
+            self.new_ids.add(row_id)
+        return self
+
+    def clear(self):
+        self.rows.clear()
+        self.new_ids.clear()
+
+    def to_dict(self):
+        """json-able form for a dcc.Store"""
+        return {"table_name": self.table_name, "defaults": self.defaults, "rows": self.rows, "new_ids": sorted(self.new_ids)}
+
+    @classmethod
+    def from_dict(cls, value, table_name=None, defaults=None):
+        """buffer from a dcc.Store value, an empty one when the store is empty or belongs to another table"""
+        if not value or (table_name is not None and value.get("table_name") != table_name):
+            return cls(table_name, defaults)
+        return cls(value["table_name"], value.get("defaults"), value.get("rows"), value.get("new_ids"))
+
+
+def _insert(dialect_name):
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert
+
+
+def _upsert_groups(buffer, columns):
+    """rows grouped by the columns they update, each group becomes one executemany
+    raises ValueError when a row edits a column the table doesn't have, rather than dropping the edit"""
+    unknown = sorted({c for entry in buffer.rows.values() for c in entry["changed"]} - set(columns))
+    if unknown:
+        raise ValueError(f"table {buffer.table_name} has no column {', '.join(unknown)}, add it before saving these edits")
+    groups = {}
+    for row_id, entry in buffer.rows.items():
+        data = {**buffer.defaults, **entry["data"]}
+        row = {column: _clean(value) for column, value in data.items() if column in columns}
+        if row_id in buffer.new_ids:
+            # ids made up in the browser for new rows, the database assigns the real one
+            row.pop(KEY_COLUMN, None)
+            update = ()
+        else:
+            update = tuple(sorted(c for c in entry["changed"] if c in columns and c != KEY_COLUMN))
+            if not update:
+                continue
+        groups.setdefault((tuple(sorted(row)), update), []).append(row)
+    return groups
+
+
+def upsert_statements(buffer, table, dialect_name="postgresql"):
+    """(statement, rows) pairs that write the buffer to table, one executemany each
+    new rows are plain inserts, edited rows update only their edited columns when the id exists
+    columns the rows carry that the table lacks are left out unless they were edited, see _upsert_groups"""
+    insert = _insert(dialect_name)
+    statements = []
+    for (_, update), rows in _upsert_groups(buffer, set(table.columns.keys())).items():
+        stmt = insert(table)
+        if update:
+            stmt = stmt.on_conflict_do_update(index_elements=[KEY_COLUMN], set_={c: stmt.excluded[c] for c in update})
+        statements.append((stmt, rows))
+    return statements
+
+
+def flush_changes(buffer, engine=None):
+    """writes the buffer in one transaction and empties it, returns the number of rows written
+    existing rows only get the columns that were edited, so two people editing different cells of a row
+    don't overwrite each other (the same cell is last write wins), a failed flush leaves the buffer as it was"""
+    if not len(buffer):
+        return 0
+    engine = engine or get_engine()
+    table = reflect_table(buffer.table_name, engine)
+    columns = set(table.columns.keys())
+
+    written = 0
+    sites = {site for entry in buffer.rows.values() for site in entry.get("old_sites", [])}
+    with engine.begin() as conn:
+        for stmt, rows in upsert_statements(buffer, table, engine.dialect.name):
+            conn.execute(stmt, rows)
+            written += len(rows)
+            sites.update(row["site"] for row in rows if row.get("site") is not None)
+    # the cache is keyed by site, a table without a site column is dropped entirely
+    invalidate_table_data(buffer.table_name, sites if "site" in columns else None)
+    buffer.clear()
+    return written
@@ -0,0 +1,95 @@
+import base64
+import threading
+import pytest
+from map_export import export_job, export_maps
+
+exceptions = pytest.importorskip("selenium.common.exceptions")
+
+
+class FakeDriver:
+    """stands in for a selenium driver, crash makes the next page load fail like a browser that died"""
+
+    def __init__(self, crash=False):
+        self.crash = crash
+        self.quit_called = False
+
+    def set_window_size(self, width, height):
+        self.size = (width, height)
+
+    def get(self, uri):
+        if self.crash:
+            raise exceptions.WebDriverException("chrome not reachable")
+
+    def execute_script(self, script, *args):
+        return True
+
+    def save_screenshot(self, path):
+        with open(path, "w") as f:
+            f.write(f"png {self.size}")
+
+    def execute_cdp_cmd(self, command, params):
+        assert command == "Page.printToPDF"
+        return {"data": base64.b64encode(f"pdf {params['paperWidth']:.2f}".encode()).decode()}
+
+    def quit(self):
+        self.quit_called = True
+
+
+def _jobs(tmp_path, n, format="png"):
+    page = tmp_path / "map.html"
+    page.write_text("<html></html>")
+    return [{"html": str(page), "output": str(tmp_path / f"map_{i}.{format}")} for i in range(n)]
+
+
+def test_export_job_defaults():
+    job = export_job("map.html", "map.PDF")
+    assert job["format"] == "pdf" and job["window_size"] == (729, 943)
+    with pytest.raises(ValueError):
+        export_job("map.html", "map.svg")
+
+
+def test_exports_png_and_pdf(tmp_path, monkeypatch):
+    monkeypatch.setattr("map_export.wait_for_map", lambda driver, timeout: None)
+    drivers = []
+
+    def start(browser, window_size):
+        drivers.append(FakeDriver())
+        return drivers[-1]
+
+    jobs = _jobs(tmp_path, 3) + _jobs(tmp_path, 1, "pdf")
+    results = export_maps(jobs, max_browsers=2, start=start)
+    assert [r["error"] for r in results] == [None] * 4
+    # a second worker may find the queue empty before it starts a browser
+    assert 1 <= len(drivers) <= 2 and all(d.quit_called for d in drivers)
+    assert (tmp_path / "map_0.pdf").read_bytes() == b"pdf 7.59"
+
+
+def test_driver_restarts_after_a_crash(tmp_path, monkeypatch):
+    monkeypatch.setattr("map_export.wait_for_map", lambda driver, timeout: None)
+    drivers = []
+
+    def start(browser, window_size):
+        # the first browser dies on its first page
+        drivers.append(FakeDriver(crash=not drivers))
+        return drivers[-1]
+
+    results = export_maps(_jobs(tmp_path, 4), max_browsers=1, start=start)
+    assert results[0]["error"].startswith("WebDriverException")
+    assert [r["error"] for r in results[1:]] == [None] * 3
+    assert len(drivers) == 2 and drivers[0].quit_called
+    assert {r["worker"] for r in results} == {"browser-0"}
+
+
+def test_job_errors_keep_the_driver(tmp_path, monkeypatch):
+    monkeypatch.setattr("map_export.wait_for_map", lambda driver, timeout: None)
+    starts = []
+
+    def start(browser, window_size):
+        starts.append(threading.current_thread().name)
+        return FakeDriver()
+
+    jobs = _jobs(tmp_path, 2)
+    jobs[0]["output"] = str(tmp_path / "missing" / "map.png")
+    results = export_maps(jobs, max_browsers=1, start=start)
+    assert results[0]["error"] is not None and results[1]["error"] is None
+    assert len(starts) == 1
@@ -0,0 +1,25 @@
+import http.client
+import json
+import os
+import socket
+import ssl
+from profiling import frame_category
+
+
+def _category(function):
+    return frame_category([function.__code__])
+
+
+def test_stdlib_modules_are_matched_on_their_file_name():
+    assert _category(socket.create_connection) == "io"
+    assert _category(ssl.SSLSocket.recv) == "io"
+
+
+def test_packages_are_matched_on_their_directory():
+    assert _category(http.client.HTTPConnection.request) == "io"
+    assert _category(json.dumps) == "folium/serialization"
+
+
+def test_other_code_is_python():
+    assert _category(os.path.join) == "python"
+    assert _category(_category) == "python"
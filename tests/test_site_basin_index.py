@@ -0,0 +1,77 @@
+import json
+import pandas as pd
+import pytest
+import shapely
+import geopandas as gpd
+import site_basin_index
+from site_basin_index import attach_basins, basin_positions, index_values, load_index, update_index
+
+CRS = "EPSG:4326"
+
+
+@pytest.fixture
+def basins():
+    return gpd.GeoDataFrame({"basin": ["west", "east"]}, crs=CRS,
+                            geometry=[shapely.box(-122.2, 47.3, -122.0, 47.5), shapely.box(-122.0, 47.3, -121.8, 47.5)])
+
+
+@pytest.fixture
+def sites():
+    # one site in each basin and one outside both
+    return gpd.GeoDataFrame({"site": ["a", "b", "c"]}, crs=CRS,
+                            geometry=gpd.points_from_xy([-122.1, -121.9, -121.5], [47.4, 47.4, 47.4]))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "site_basin_index.parquet")
+
+
+def _fracs(*values):
+    return pd.DataFrame({"intersect_frac": values})
+
+
+def test_attach_basins(sites, basins, path):
+    result = attach_basins(sites, basins, path=path)
+    assert result["basin"].tolist()[:2] == ["west", "east"] and pd.isna(result["basin"].iat[2])
+    assert basin_positions(sites, load_index(path=path)).tolist() == [0, 1, -1]
+
+
+def test_rebuilt_when_basin_geometry_changes(sites, basins, path, monkeypatch):
+    update_index(sites, basins, path=path)
+    joins = []
+    sjoin = gpd.sjoin
+    monkeypatch.setattr(site_basin_index.gpd, "sjoin", lambda *args, **kwargs: joins.append(len(args[0])) or sjoin(*args, **kwargs))
+
+    # the same basins, known sites are not joined again
+    update_index(sites, basins, path=path)
+    assert joins == []
+
+    # the east basin grows over the third site, every site is joined against the new basins
+    moved = basins.copy()
+    moved.loc[1, "geometry"] = shapely.box(-122.0, 47.3, -121.4, 47.5)
+    index = update_index(sites, moved, path=path)
+    assert joins == [3]
+    assert basin_positions(sites, index).tolist() == [0, 1, 1]
+
+
+def test_service_area_flag_is_kept_with_its_threshold(sites, basins, path):
+    index = update_index(sites, basins, _fracs(0.8, 0.3), path=path, intersect_fraction=0.5)
+    assert index_values(sites, index, "wtd_service_area", False).tolist() == [True, False, False]
+    with open(path.replace(".parquet", ".json")) as f:
+        meta = json.load(f)
+    assert (meta["basin_fracs"], meta["intersect_fraction"]) == ([0.8, 0.3], 0.5)
+
+    # a later call reads the flag and fraction back without being given them
+    index = update_index(sites, basins, path=path)
+    assert index_values(sites, index, "wtd_service_area", False).tolist() == [True, False, False]
+    assert index_values(sites, index, "intersect_frac")[0] == pytest.approx(0.8)
+
+    # a new threshold works the flag out again from the saved fractions
+    index = update_index(sites, basins, path=path, intersect_fraction=0.3)
+    assert index_values(sites, index, "wtd_service_area", False).tolist() == [True, True, False]
+
+
+def test_threshold_needs_fractions(sites, basins, path):
+    with pytest.raises(ValueError):
+        update_index(sites, basins, path=path, intersect_fraction=0.5)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from site_clusters import cluster_levels
+
+
+@pytest.fixture
+def sites():
+    rng = np.random.default_rng(7)
+    # a dense group around Seattle, a looser one to the east and two sites on the same spot
+    lon = np.r_[rng.normal(-122.33, 0.02, 60), rng.normal(-121.9, 0.2, 40), -122.1, -122.1]
+    lat = np.r_[rng.normal(47.6, 0.02, 60), rng.normal(47.4, 0.2, 40), 47.5, 47.5]
+    colors = np.array(["red", "blue", "green"])[np.arange(len(lon)) % 3]
+    return lon, lat, colors
+
+
+def test_every_zoom_counts_every_site_once(sites):
+    lon, lat, colors = sites
+    result = cluster_levels(lon, lat, colors, max_zoom=16)
+    assert len(result["zooms"]) == 17
+    expected_colors = [int((colors == color).sum()) for color in result["palette"]]
+    for level in (result["levels"][i] for i in result["zooms"]):
+        clusters = np.array(level["clusters"]).reshape(-1, 7 + len(result["palette"]))
+        assert clusters[:, 2].sum() + len(level["points"]) == len(lon)
+        # a cluster's color counts add up to its size, and over the level to the site colors
+        assert (clusters[:, 7:].sum(axis=1) == clusters[:, 2]).all()
+        point_colors = [int((colors[level["points"]] == color).sum()) for color in result["palette"]]
+        assert (clusters[:, 7:].sum(axis=0) + point_colors).tolist() == expected_colors
+
+
+def test_zooming_out_only_merges(sites):
+    lon, lat, colors = sites
+    result = cluster_levels(lon, lat, colors)
+    sizes = [len(result["levels"][i]["clusters"]) + len(result["levels"][i]["points"]) for i in result["zooms"]]
+    assert sizes == sorted(sizes)
+    # the whole county is one cluster at zoom 0, the two sites on one spot never separate
+    assert sizes[0] == 1
+    assert sizes[-1] < len(lon)
+
+
+def test_no_sites():
+    result = cluster_levels([], [], [], max_zoom=2)
+    assert result["levels"] == [{"clusters": [], "points": []}]
+    assert result["zooms"] == [0, 0, 0]
@@ -0,0 +1,50 @@
+import pandas as pd
+import geopandas as gpd
+from site_diff import KEY_COLUMN, diff_is_empty, diff_sites, load_snapshot, save_snapshot, site_keys
+
+
+def _sites(rows):
+    df = pd.DataFrame(rows, columns=["site", "site_name", "latitude", "longitude", "program"])
+    sites = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["longitude"], df["latitude"]), crs="EPSG:4326")
+    sites[KEY_COLUMN] = site_keys(sites)
+    return sites
+
+
+OLD = [
+    ("A", "Alpha", 47.1, -122.1, "WTD"),
+    ("NEW", "Bear Creek", 47.2, -122.2, "ISP"),
+    ("NEW", "Bear Creek", 47.3, -122.3, "ISP"),
+    ("C", "Cedar", 47.4, -122.4, "WTD"),
+]
+
+
+def test_site_keys_tell_repeated_sites_apart():
+    keys = site_keys(_sites(OLD + [("D", None, 47.5, -122.5, None)]))
+    assert keys.tolist() == ["A|Alpha|0", "NEW|Bear Creek|0", "NEW|Bear Creek|1", "C|Cedar|0", "D||0"]
+
+
+def test_diff_sites(tmp_path):
+    path = str(tmp_path / "site_snapshot.parquet")
+    save_snapshot(_sites(OLD), {"basins": "key"}, path)
+    old, meta = load_snapshot(path)
+    assert meta == {"basins": "key"}
+    assert diff_is_empty(diff_sites(_sites(OLD), old))
+
+    new = [
+        OLD[0],
+        ("NEW", "Bear Creek", 47.2, -122.25, "ISP"),
+        ("NEW", "Bear Creek", 47.3, -122.3, "WTD"),
+        ("E", "Elk", 47.6, -122.6, "ISP"),
+    ]
+    diff = diff_sites(_sites(new), old)
+    assert diff == {
+        "added": ["E|Elk|0"],
+        "removed": ["C|Cedar|0"],
+        "moved": ["NEW|Bear Creek|0"],
+        "changed": ["NEW|Bear Creek|1"],
+    }
+    assert not diff_is_empty(diff)
+
+
+def test_no_snapshot(tmp_path):
+    assert load_snapshot(str(tmp_path / "missing.parquet")) == (None, {})
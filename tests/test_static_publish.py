@@ -0,0 +1,87 @@
+import json
+import os
+from static_publish import ASSET_DIR, ASSET_MANIFEST, MIN_ASSET_BYTES, minify_html, publish_static
+
+SCRIPT = """<script>
+    var popup = `<b>{site}</b>
+        <br>   {name}`;
+    // a comment with <!-- markup --> in it
+    var text = "  two  spaces  ";
+</script>"""
+
+PAGE = f"""<!DOCTYPE html>
+<html>
+    <head>
+        <!-- dropped -->
+        <script src="https://cdn.example.com/leaflet.js"></script>
+    </head>
+    <body>
+        <pre>
+  indented
+      code
+</pre>
+        <textarea id="notes">  keep
+   this  </textarea>
+        {SCRIPT}
+    </body>
+</html>
+"""
+
+
+def test_minify_keeps_verbatim_elements():
+    html = minify_html(PAGE)
+    assert SCRIPT in html
+    assert "<pre>\n  indented\n      code\n</pre>" in html
+    assert '<textarea id="notes">  keep\n   this  </textarea>' in html
+    assert "dropped" not in html
+    assert "\n<head>\n" in html and "    " not in html.split("<body>")[0]
+
+
+def _page(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"<html>\n<head>\n</head>\n<body>\n<script>\nvar layer = {data};\n</script>\n</body>\n</html>\n")
+
+
+def _assets(assets_dir):
+    return sorted(name for name in os.listdir(assets_dir) if name.endswith(".js"))
+
+
+def test_assets_are_tracked_per_publish(tmp_path):
+    first = '{"layer": "%s"}' % ("a" * MIN_ASSET_BYTES)
+    second = '{"layer": "%s"}' % ("b" * MIN_ASSET_BYTES)
+    maps = [str(tmp_path / "wtd.html"), str(tmp_path / "isp.html")]
+    for path in maps:
+        _page(path, first)
+    assets_dir = str(tmp_path / ASSET_DIR)
+    # a file in the assets directory this module didn't write
+    os.makedirs(assets_dir)
+    with open(os.path.join(assets_dir, "site.js"), "w") as f:
+        f.write("// not published here")
+
+    publish_static(maps, [first], compress=False)
+    (old,) = [name for name in _assets(assets_dir) if name != "site.js"]
+
+    # other pages published into the same assets directory on their own
+    others = [str(tmp_path / "other_a.html"), str(tmp_path / "other_b.html")]
+    for path in others:
+        _page(path, first)
+    publish_static(others, [first], compress=False)
+
+    # the maps move on to new data, the other pages still use the old asset
+    for path in maps:
+        _page(path, second)
+    publish_static(maps, [second], compress=False)
+    assert old in _assets(assets_dir) and "site.js" in _assets(assets_dir)
+    assert len(_assets(assets_dir)) == 3
+
+    with open(os.path.join(assets_dir, ASSET_MANIFEST)) as f:
+        manifest = json.load(f)
+    assert manifest["../other_a.html"] == [old]
+    assert manifest["../wtd.html"] != [old]
+
+    # once no page uses it the asset is deleted
+    for path in others:
+        os.remove(path)
+    publish_static(maps, [second], compress=False)
+    assert old not in _assets(assets_dir)
+    assert "site.js" in _assets(assets_dir)
@@ -0,0 +1,68 @@
+import time
+import pandas as pd
+import pytest
+import table_cache
+
+
+@pytest.fixture
+def path(tmp_path):
+    table_cache.CACHE_STATS.update(hits=0, misses=0, stale=0)
+    return str(tmp_path / "table_cache.sqlite")
+
+
+def _frame(site):
+    return pd.DataFrame({"site": [site], "depth": [1.0]})
+
+
+def _put(table, site, path, parameter=None):
+    return table_cache.put(table, site, parameter, _frame(site), time.time(), path=path)
+
+
+def test_round_trip_and_ttl(path):
+    assert table_cache.get("transect", "A", path=path) is None
+    _put("transect", "A", path)
+    pd.testing.assert_frame_equal(table_cache.get("transect", "A", path=path), _frame("A"))
+    # an entry older than the ttl is dropped on read
+    assert table_cache.get("transect", "A", ttl=-1, path=path) is None
+    assert table_cache.get("transect", "A", path=path) is None
+    assert table_cache.CACHE_STATS == {"hits": 1, "misses": 2, "stale": 1}
+
+
+def test_least_recently_used_is_evicted(path, monkeypatch):
+    monkeypatch.setattr(table_cache, "MAX_ENTRIES", 2)
+    _put("transect", "A", path)
+    time.sleep(0.01)
+    _put("transect", "B", path)
+    time.sleep(0.01)
+    # reading A makes B the least recently used
+    assert table_cache.get("transect", "A", path=path) is not None
+    _put("transect", "C", path)
+    assert table_cache.get("transect", "B", path=path) is None
+    assert table_cache.get("transect", "A", path=path) is not None
+    assert table_cache.get("transect", "C", path=path) is not None
+
+
+def test_invalidating_sites_keeps_the_others(path):
+    for site in ("A", "B", None):
+        _put("transect", site, path)
+    _put("reference", "A", path)
+    table_cache.invalidate("transect", ["A"], path=path)
+    assert table_cache.get("transect", "A", path=path) is None
+    # the unfiltered result included site A
+    assert table_cache.get("transect", None, path=path) is None
+    assert table_cache.get("transect", "B", path=path) is not None
+    assert table_cache.get("reference", "A", path=path) is not None
+
+    table_cache.invalidate("transect", path=path)
+    assert table_cache.get("transect", "B", path=path) is None
+    assert table_cache.get("reference", "A", path=path) is not None
+
+
+def test_result_of_a_query_overtaken_by_a_write_is_not_stored(path):
+    started = time.time()
+    table_cache.invalidate("transect", ["A"], path=path)
+    # the query began before the write, so it may not have seen it
+    assert not table_cache.put("transect", "A", None, _frame("A"), started, path=path)
+    assert not table_cache.put("transect", None, None, _frame("A"), started, path=path)
+    assert table_cache.put("transect", "B", None, _frame("B"), started, path=path)
+    assert table_cache.get("transect", "A", path=path) is None
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+import pytest
+
+sa = pytest.importorskip("sqlalchemy")
+import table_pages
+from table_pages import fetch_block
+
+ROWS = 57
+BLOCK = 10
+
+SORTS = [
+    None,
+    [{"colId": "depth", "sort": "asc"}],
+    [{"colId": "site", "sort": "desc"}, {"colId": "depth", "sort": "asc"}],
+    [{"colId": "notes", "sort": "asc"}, {"colId": "id", "sort": "desc"}],
+]
+FILTERS = [None, {"depth": {"filterType": "number", "type": "lessThan", "filter": 3}}]
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(table_pages, "_boundaries", OrderedDict())
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'isp.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE reference (id INTEGER PRIMARY KEY, site TEXT, depth REAL, notes TEXT)"))
+        # few distinct values and some nulls, so most rows tie on the sort columns
+        conn.execute(sa.text("INSERT INTO reference VALUES (:id, :site, :depth, :notes)"), [
+            {"id": i, "site": "ABC"[i % 3], "depth": None if i % 7 == 0 else i % 5, "notes": None if i % 4 else f"n{i % 2}"}
+            for i in range(1, ROWS + 1)
+        ])
+    return engine
+
+
+def _blocks(engine, sort, filter_model, offset):
+    rows, start = [], 0
+    while True:
+        if offset:
+            # a block this process hasn't seen the start of, as after a jump or on another worker
+            table_pages._boundaries.clear()
+        block = fetch_block("reference", start, start + BLOCK, sort, filter_model, engine=engine)
+        rows.extend(block["rowData"])
+        if block["rowCount"] != -1:
+            return rows, block["rowCount"]
+        start += BLOCK
+
+
+@pytest.mark.parametrize("filter_model", FILTERS)
+@pytest.mark.parametrize("sort", SORTS)
+def test_keyset_pages_match_offset_pages(engine, sort, filter_model):
+    stats = dict(table_pages.CACHE_STATS)
+    keyset, keyset_count = _blocks(engine, sort, filter_model, offset=False)
+    assert table_pages.CACHE_STATS["offset"] == stats["offset"]
+    assert table_pages.CACHE_STATS["keyset"] > stats["keyset"]
+
+    offset, offset_count = _blocks(engine, sort, filter_model, offset=True)
+    assert table_pages.CACHE_STATS["offset"] > stats["offset"]
+    assert keyset == offset
+    assert keyset_count == offset_count == len(keyset)
+    # every row once, all of them when unfiltered
+    assert len({row["id"] for row in keyset}) == len(keyset)
+    if filter_model is None:
+        assert len(keyset) == ROWS
@@ -0,0 +1,24 @@
+import json
+import numpy as np
+import pandas as pd
+from table_schema import MEMORY_LOG, apply_schema, widen_floats
+
+
+def test_apply_schema_records_without_printing(capsys):
+    df = pd.DataFrame({"basin": ["a", "b"], "PM2_5": [3.2, None], "WTD Service Area": [True, None]})
+    count = len(MEMORY_LOG)
+    result = apply_schema(df, "sites")
+    assert capsys.readouterr().out == ""
+    assert len(MEMORY_LOG) == count + 1 and MEMORY_LOG[-1]["table"] == "sites"
+    assert result["PM2_5"].dtype == np.float32
+    assert result["WTD Service Area"].tolist() == [True, False]
+
+
+def test_widen_floats_writes_the_float32_decimals():
+    df = apply_schema(pd.DataFrame({"basin": ["a", "b"], "PM2_5": [3.2, None]}), "sites")
+    assert json.loads(df.to_json(orient="records"))[0]["PM2_5"] != 3.2
+    widened = widen_floats(df)
+    assert widened["PM2_5"].dtype == np.float64
+    assert json.loads(widened.to_json(orient="records")) == [{"basin": "a", "PM2_5": 3.2}, {"basin": "b", "PM2_5": None}]
+    # frames without float32 columns come back as they are
+    assert widen_floats(widened) is widened
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+sa = pytest.importorskip("sqlalchemy")
+from sqlalchemy.dialects import postgresql
+from table_writes import ChangeBuffer, flush_changes, upsert_statements
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    # keeps the result cache flush_changes invalidates out of the real cache directory
+    monkeypatch.setattr("table_cache.cache_file", lambda: str(tmp_path / "table_cache.sqlite"))
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'isp.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE transect (id INTEGER PRIMARY KEY, site TEXT, transect TEXT, "
+                             "location REAL, depth REAL, velocity REAL, angle REAL)"))
+        conn.execute(sa.text("INSERT INTO transect VALUES (1, 'A', 't1', 0, 1, 1, 1), (2, 'A', 't1', 2, 1, 1, 1)"))
+    return engine
+
+
+def _rows(engine):
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(sa.text("SELECT * FROM transect ORDER BY id")).mappings()]
+
+
+def _table():
+    return sa.Table(
+        "transect", sa.MetaData(),
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("site", sa.Text),
+        sa.Column("transect", sa.Text),
+        sa.Column("location", sa.Float),
+        sa.Column("depth", sa.Float),
+        sa.Column("velocity", sa.Float),
+        sa.Column("angle", sa.Float),
+    )
+
+
+def _edit(row_id, column, value, **data):
+    return {"data": {"id": row_id, column: value, **data}, "colId": column, "rowId": row_id}
+
+
+def test_edits_merge_per_row():
+    buffer = ChangeBuffer("transect").add([_edit(1, "depth", 2), _edit(1, "velocity", 3)])
+    buffer.add(_edit(2, "depth", 4) for _ in range(2))
+    assert len(buffer) == 2
+    assert buffer.rows["1"]["changed"] == ["depth", "velocity"]
+    restored = ChangeBuffer.from_dict(buffer.to_dict(), "transect")
+    assert restored.rows == buffer.rows
+    assert ChangeBuffer.from_dict(buffer.to_dict(), "reference").rows == {}
+
+
+def test_flush_updates_only_edited_columns(engine):
+    buffer = ChangeBuffer("transect", {"site": "A"}).add([_edit(1, "depth", 2.5, velocity=9)])
+    assert flush_changes(buffer, engine) == 1
+    assert len(buffer) == 0
+    row = _rows(engine)[0]
+    # velocity came along in the row data but wasn't edited
+    assert (row["depth"], row["velocity"]) == (2.5, 1)
+
+
+def test_flush_inserts_added_rows(engine):
+    new = {"id": "new-1", "site": "A", "transect": "t2", "location": 4, "depth": np.nan, "velocity": np.nan, "angle": 1}
+    buffer = ChangeBuffer("transect").add_rows([new])
+    buffer.add([_edit("new-1", "depth", 0.5, location=4)])
+    assert buffer.new_ids == {"new-1"}
+    assert flush_changes(buffer, engine) == 1
+    row = _rows(engine)[-1]
+    # the database assigned the id, the blank velocity is written as NULL
+    assert (row["id"], row["transect"], row["depth"], row["velocity"]) == (3, "t2", 0.5, None)
+
+
+def test_flush_refuses_columns_the_table_lacks(engine):
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE old_transect AS SELECT id, site, location, depth FROM transect"))
+    buffer = ChangeBuffer("old_transect").add([_edit(1, "transect", "t2"), _edit(2, "depth", 3)])
+    with pytest.raises(ValueError, match="no column transect"):
+        flush_changes(buffer, engine)
+    # nothing was written and the edits wait for the next save
+    assert len(buffer) == 2
+    with engine.connect() as conn:
+        assert conn.execute(sa.text("SELECT depth FROM old_transect WHERE id = 2")).scalar() == 1
+
+
+def test_postgres_upsert_statements():
+    buffer = ChangeBuffer("transect", {"site": "A"}).add([_edit(1, "depth", 2), _edit(2, "depth", 3), _edit(2, "angle", 0.9)])
+    buffer.add_rows([{"id": "new-1", "transect": "t2", "location": 4, "depth": 1}])
+    statements = upsert_statements(buffer, _table(), "postgresql")
+    # compiled for the columns the rows carry, as executemany does
+    sql = {str(stmt.compile(dialect=postgresql.dialect(), column_keys=list(rows[0]))): rows for stmt, rows in statements}
+    assert len(sql) == 3
+
+    (insert_sql, rows), = [(s, r) for s, r in sql.items() if "ON CONFLICT" not in s]
+    assert rows == [{"site": "A", "transect": "t2", "location": 4, "depth": 1}]
+    assert insert_sql.startswith("INSERT INTO transect (site, transect, location, depth) VALUES")
+
+    updates = {s: r for s, r in sql.items() if "ON CONFLICT" in s}
+    depth_only = next(s for s in updates if "angle = excluded.angle" not in s)
+    assert "ON CONFLICT (id) DO UPDATE SET depth = excluded.depth" in depth_only
+    assert updates[depth_only] == [{"id": 1, "depth": 2, "site": "A"}]
+    both = next(s for s in updates if s != depth_only)
+    assert "DO UPDATE SET depth = excluded.depth, angle = excluded.angle" in both
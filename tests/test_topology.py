@@ -0,0 +1,111 @@
+import json
+import numpy as np
+import pytest
+import shapely
+import geopandas as gpd
+from layer_registry import DISPLAY_CRS
+from topology import QUANTIZATION, serialize_topology, topology
+
+
+def decode(topo, name):
+    """the GeoDataFrame of one object of a topology, the way TopoJsonLayer decodes it in the page"""
+    scale = np.array(topo["transform"]["scale"])
+    translate = np.array(topo["transform"]["translate"])
+    arcs = [np.cumsum(np.array(arc, dtype=float), axis=0) * scale + translate for arc in topo["arcs"]]
+
+    def line(ids):
+        points = []
+        for i in ids:
+            arc = arcs[~i][::-1] if i < 0 else arcs[i]
+            points.extend(arc[1:] if points else arc)
+        return np.array(points)
+
+    def point(p):
+        return np.array(p, dtype=float) * scale + translate
+
+    def geometry(g):
+        kind = g["type"]
+        if kind is None:
+            return None
+        if kind == "Point":
+            return shapely.Point(point(g["coordinates"]))
+        if kind == "MultiPoint":
+            return shapely.MultiPoint([point(p) for p in g["coordinates"]])
+        if kind == "LineString":
+            return shapely.LineString(line(g["arcs"]))
+        if kind == "MultiLineString":
+            return shapely.MultiLineString([line(ids) for ids in g["arcs"]])
+        if kind == "Polygon":
+            rings = [line(ids) for ids in g["arcs"]]
+            return shapely.Polygon(rings[0], rings[1:])
+        polygons = [[line(ids) for ids in p] for p in g["arcs"]]
+        return shapely.MultiPolygon([shapely.Polygon(rings[0], rings[1:]) for rings in polygons])
+
+    geometries = topo["objects"][name]["geometries"]
+    return gpd.GeoDataFrame(
+        [g.get("properties", {}) for g in geometries],
+        geometry=[geometry(g) for g in geometries],
+        crs=DISPLAY_CRS,
+    )
+
+
+@pytest.fixture
+def layers():
+    # two basins sharing an edge, one with a hole, inside a service area that shares the basins' west edge
+    west = shapely.Polygon([(-122.2, 47.3), (-122.0, 47.3), (-122.0, 47.5), (-122.2, 47.5)],
+                           [[(-122.15, 47.35), (-122.1, 47.35), (-122.1, 47.4), (-122.15, 47.4)]])
+    east = shapely.Polygon([(-122.0, 47.3), (-121.8, 47.3), (-121.8, 47.5), (-122.0, 47.5)])
+    islands = shapely.MultiPolygon([shapely.box(-121.7, 47.3, -121.6, 47.4), shapely.box(-121.5, 47.3, -121.4, 47.4)])
+    basins = gpd.GeoDataFrame({"basin": ["west", "east", "islands", "none"]},
+                              geometry=[west, east, islands, None], crs=DISPLAY_CRS)
+    area = gpd.GeoDataFrame({"name": ["service area"]}, crs=DISPLAY_CRS, geometry=[
+        shapely.Polygon([(-122.2, 47.2), (-121.3, 47.2), (-121.3, 47.6), (-122.2, 47.6), (-122.2, 47.5), (-122.2, 47.3)])])
+    streams = gpd.GeoDataFrame({"name": ["creek", "river", "gage", "gages"]}, crs=DISPLAY_CRS, geometry=[
+        shapely.LineString([(-122.2, 47.45), (-122.1, 47.42), (-122.0, 47.44)]),
+        shapely.MultiLineString([[(-121.9, 47.31), (-121.85, 47.35)], [(-121.85, 47.35), (-121.82, 47.49)]]),
+        shapely.Point(-122.05, 47.45),
+        shapely.MultiPoint([(-121.95, 47.33), (-121.9, 47.4)]),
+    ])
+    return {"wtd_basins": basins, "wtd_service_area": area, "streams": streams}
+
+
+def _tolerance(topo):
+    # a point moves at most half a grid step in each direction
+    return float(np.hypot(*topo["transform"]["scale"]))
+
+
+def test_round_trip(layers):
+    topo = json.loads(serialize_topology(layers))
+    tolerance = _tolerance(topo)
+    assert tolerance < 1e-5
+    for name, gdf in layers.items():
+        decoded = decode(topo, name)
+        assert decoded.drop(columns="geometry").to_dict("records") == gdf.drop(columns="geometry").to_dict("records")
+        for original, result in zip(gdf.geometry, decoded.geometry):
+            if original is None:
+                assert result is None
+                continue
+            # rings start where they were cut into arcs, normalizing puts both at the same vertex
+            assert shapely.normalize(result).equals_exact(shapely.normalize(original), tolerance), name
+
+
+def test_shared_boundaries_are_one_arc(layers):
+    topo = topology(layers)
+    basins = {g["properties"]["basin"]: g for g in topo["objects"]["wtd_basins"]["geometries"]}
+    west = {i for ring in basins["west"]["arcs"] for i in ring}
+    east = {i for ring in basins["east"]["arcs"] for i in ring}
+    # the edge between the basins runs one way round one ring and the other way round the other
+    assert any(~i in east for i in west)
+    # the service area and the west basin share the basins' west edge across layers
+    area = {i for ring in topo["objects"]["wtd_service_area"]["geometries"][0]["arcs"] for i in ring}
+    assert {i if i >= 0 else ~i for i in area} & {i if i >= 0 else ~i for i in west}
+
+
+def test_quantization(layers):
+    coarse = topology(layers, quantization=1000)
+    fine = topology(layers)
+    assert max(np.abs(np.concatenate(arc)).max() for arc in fine["arcs"]) < QUANTIZATION
+    assert max(np.abs(np.concatenate(arc)).max() for arc in coarse["arcs"]) < 1000
+    tolerance = _tolerance(coarse)
+    for original, result in zip(layers["wtd_basins"].geometry[:3], decode(coarse, "wtd_basins").geometry):
+        assert shapely.normalize(result).equals_exact(shapely.normalize(original), tolerance)
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+from transect_discharge import corrected_velocity, transect_discharge, transect_summary, vertical_discharge
+
+# the grid's blank default row, see config/transect_entry_config.py
+TEMPLATE_ROW = {"id": 0, "transect": None, "location": np.nan, "depth": np.nan, "velocity": np.nan, "angle": 1}
+
+# verticals at 0, 2, 4 and 6 ft, listed out of order
+#   mid-section widths 1, 2, 2, 1 -> area 0*1 + 1*2 + 2*2 + 0*1 = 6, discharge 1*2 + 2*4 = 10
+#   mean-section panels 0-2, 2-4, 4-6: areas 0.5*2 + 1.5*2 + 1*2 = 6,
+#   discharge 0.5*1 + 1.5*3 + 1*2 = 7
+TRANSECT_A = [
+    {"id": 1, "transect": "a", "location": 4, "depth": 2, "velocity": 2, "angle": 1},
+    {"id": 2, "transect": "a", "location": 0, "depth": 0, "velocity": 0, "angle": 1},
+    {"id": 3, "transect": "a", "location": 6, "depth": 0, "velocity": 0, "angle": 1},
+    {"id": 4, "transect": "a", "location": 2, "depth": 1, "velocity": 1, "angle": 1},
+]
+
+# two verticals 10 ft apart, 1 ft deep at 1 ft/s -> 10 cfs either way
+TRANSECT_B = [
+    {"id": 5, "transect": "b", "location": 0, "depth": 1, "velocity": 1, "angle": 1},
+    {"id": 6, "transect": "b", "location": 10, "depth": 1, "velocity": 1, "angle": 1},
+]
+
+
+def test_hand_computed_transect():
+    summary = transect_discharge(TRANSECT_A + [TEMPLATE_ROW])
+    assert list(summary) == ["a"]
+    a = summary["a"]
+    assert a["discharge_mid"] == pytest.approx(10)
+    assert a["discharge_mean"] == pytest.approx(7)
+    assert a["area_mid"] == pytest.approx(6)
+    assert a["area_mean"] == pytest.approx(6)
+    assert a["wetted_width"] == pytest.approx(6)
+    assert a["mean_velocity"] == pytest.approx(10 / 6)
+    assert a["max_depth"] == pytest.approx(2)
+    assert a["verticals"] == 4
+    # the vertical at 4 ft carries 8 of the 10 cfs
+    assert a["max_vertical_fraction"] == pytest.approx(0.8)
+    assert not a["vertical_check"]
+
+
+def test_transects_are_computed_separately():
+    rows = [TEMPLATE_ROW] + TRANSECT_B + TRANSECT_A + [TEMPLATE_ROW]
+    summary = transect_discharge(rows)
+    assert set(summary) == {"a", "b"}
+    assert summary["a"] == transect_discharge(TRANSECT_A)["a"]
+    assert summary["b"]["discharge_mid"] == pytest.approx(10)
+    assert summary["b"]["discharge_mean"] == pytest.approx(10)
+    assert summary["b"]["wetted_width"] == pytest.approx(10)
+
+
+def test_rows_without_a_transect_are_one_transect():
+    rows = [{**row, "transect": None} for row in TRANSECT_A] + TRANSECT_B
+    summary = transect_discharge(rows)
+    assert summary[None]["discharge_mid"] == pytest.approx(10)
+    assert summary["b"]["discharge_mid"] == pytest.approx(10)
+    # a grid without the column at all
+    rows = [{k: v for k, v in row.items() if k != "transect"} for row in TRANSECT_A]
+    assert transect_discharge(rows)[None]["discharge_mid"] == pytest.approx(10)
+
+
+def test_template_rows_only():
+    assert transect_discharge([TEMPLATE_ROW, TEMPLATE_ROW]) == {}
+    assert transect_discharge([]) == {}
+
+
+def test_missing_velocity_is_zero():
+    rows = [dict(row) for row in TRANSECT_A]
+    rows[0]["velocity"] = np.nan
+    # only the vertical at 2 ft is left flowing: 1 ft deep over 2 ft at 1 ft/s
+    assert transect_discharge(rows)["a"]["discharge_mid"] == pytest.approx(2)
+
+
+def test_vertical_discharge():
+    verticals = vertical_discharge(pd.DataFrame(TRANSECT_A + [TEMPLATE_ROW]))
+    # dropped template row, the rest keep their index
+    assert sorted(verticals.index) == [0, 1, 2, 3]
+    assert verticals.loc[[1, 3, 0, 2], "width"].tolist() == [1, 2, 2, 1]
+    assert verticals["discharge"].sum() == pytest.approx(10)
+
+
+def test_corrected_velocity():
+    assert corrected_velocity(2, 0.5) == pytest.approx(1)
+    assert corrected_velocity(2, 60, angle_units="degrees") == pytest.approx(1)
+    assert corrected_velocity(2, np.nan) == pytest.approx(2)
+    with pytest.raises(ValueError):
+        corrected_velocity(2, 1, angle_units="radians")
+
+
+def test_summary_angle():
+    df = pd.DataFrame(TRANSECT_B).assign(angle=0.5)
+    assert transect_summary(df).loc["b", "discharge_mid"] == pytest.approx(5)
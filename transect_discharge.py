@@ -0,0 +1,129 @@
+"""discharge from wading measurement transects (the transect entry grid: transect, location, depth, velocity, angle per vertical)
+every transect in a table is computed at once with array operations, rows are sorted by transect and location and
+each vertical's neighbours are found by shifting the arrays, so thousands of historical transects take one pass.
+location and depth in feet with velocity in ft/s gives discharge in cfs"""
+import numpy as np
+import pandas as pd
+
+TRANSECT_COLUMN = "transect"
+VERTICAL_COLUMNS = ["location", "depth", "velocity", "angle"]
+
+# USGS guidance is that no one vertical should carry more than 10% of the flow
+MAX_VERTICAL_FRACTION = 0.10
+
+
+def corrected_velocity(velocity, angle, angle_units="coefficient"):
+    """velocity normal to the section
+    angle is the cosine coefficient by default (1 = flow straight through the section, the grid's default),
+    or the angle off perpendicular in degrees with angle_units="degrees"""
+    angle = np.asarray(angle, dtype=float)
+    if angle_units == "degrees":
+        coefficient = np.cos(np.radians(angle))
+    elif angle_units == "coefficient":
+        coefficient = angle
+    else:
+        raise ValueError(f"unknown angle_units {angle_units!r}")
+    # a blank angle is taken as perpendicular flow
+    return np.asarray(velocity, dtype=float) * np.where(np.isnan(coefficient), 1.0, coefficient)
+
+
+def _verticals(df, transect_column):
+    """usable verticals sorted by transect and location with group boundaries
+    rows without a location or depth (the grid's blank default rows) are dropped, a missing velocity is zero,
+    as at the edges of water"""
+    df = df.dropna(subset=["location", "depth"])
+    if transect_column is None:
+        transects = np.zeros(len(df), dtype=np.int64)
+        labels = pd.Index([0])
+    else:
+        # rows without a transect are kept together as their own transect rather than dropped
+        transects, labels = pd.factorize(df[transect_column], sort=True, use_na_sentinel=False)
+    x = df["location"].to_numpy(dtype=float)
+    order = np.lexsort((x, transects))
+    transects, x = transects[order], x[order]
+    depth = df["depth"].to_numpy(dtype=float)[order]
+    velocity = df["velocity"].to_numpy(dtype=float)[order] if "velocity" in df else np.zeros(len(df))
+    angle = df["angle"].to_numpy(dtype=float)[order] if "angle" in df else np.ones(len(df))
+    first = np.ones(len(x), dtype=bool)
+    first[1:] = transects[1:] != transects[:-1]
+    last = np.ones(len(x), dtype=bool)
+    last[:-1] = transects[:-1] != transects[1:]
+    return df.index[order], transects, labels, x, depth, np.nan_to_num(velocity), angle, first, last
+
+
+def vertical_discharge(df, transect_column=TRANSECT_COLUMN, angle_units="coefficient"):
+    """mid-section width, area and discharge of every vertical, indexed like df (dropped rows are left out)"""
+    if transect_column not in df:
+        transect_column = None
+    index, transects, labels, x, depth, velocity, angle, first, last = _verticals(df, transect_column)
+    velocity = corrected_velocity(velocity, angle, angle_units)
+    # each vertical covers half way to its neighbours, the edge verticals only reach inward
+    x_prev = np.where(first, x, np.roll(x, 1))
+    x_next = np.where(last, x, np.roll(x, -1))
+    width = (x_next - x_prev) / 2
+    area = depth * width
+    result = pd.DataFrame({
+        "width": width,
+        "area": area,
+        "corrected_velocity": velocity,
+        "discharge": area * velocity,
+    }, index=index)
+    if transect_column is not None:
+        result.insert(0, transect_column, labels[transects])
+    return result
+
+
+def transect_summary(df, transect_column=TRANSECT_COLUMN, angle_units="coefficient"):
+    """one row per transect: mid-section and mean-section discharge and area, wetted width, mean velocity,
+    max depth, number of verticals and the largest share of the flow in one vertical"""
+    if transect_column not in df:
+        transect_column = None
+    index, transects, labels, x, depth, velocity, angle, first, last = _verticals(df, transect_column)
+    velocity = corrected_velocity(velocity, angle, angle_units)
+    n = len(labels)
+
+    x_prev = np.where(first, x, np.roll(x, 1))
+    x_next = np.where(last, x, np.roll(x, -1))
+    mid_area = depth * (x_next - x_prev) / 2
+    mid_discharge = mid_area * velocity
+
+    # mean-section: each panel between a vertical and the next one in the same transect
+    panel_width = np.where(last, 0.0, np.roll(x, -1) - x)
+    panel_area = (depth + np.roll(depth, -1)) / 2 * panel_width
+    panel_discharge = (velocity + np.roll(velocity, -1)) / 2 * panel_area
+
+    discharge_mid = np.bincount(transects, weights=mid_discharge, minlength=n)
+    area_mid = np.bincount(transects, weights=mid_area, minlength=n)
+    largest = np.zeros(n)
+    np.maximum.at(largest, transects, np.abs(mid_discharge))
+    max_depth = np.full(n, np.nan)
+    np.fmax.at(max_depth, transects, depth)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        summary = pd.DataFrame({
+            "discharge_mid": discharge_mid,
+            "discharge_mean": np.bincount(transects, weights=np.where(last, 0.0, panel_discharge), minlength=n),
+            "area_mid": area_mid,
+            "area_mean": np.bincount(transects, weights=np.where(last, 0.0, panel_area), minlength=n),
+            "wetted_width": np.bincount(transects, weights=np.where(last, x, 0.0) - np.where(first, x, 0.0), minlength=n),
+            "mean_velocity": discharge_mid / area_mid,
+            "max_depth": max_depth,
+            "verticals": np.bincount(transects, minlength=n),
+            "max_vertical_fraction": largest / np.abs(discharge_mid),
+        }, index=pd.Index(labels, name=transect_column))
+    summary["vertical_check"] = summary["max_vertical_fraction"] <= MAX_VERTICAL_FRACTION
+    return summary
+
+
+def transect_discharge(rows, transect_column=TRANSECT_COLUMN, angle_units="coefficient"):
+    """summaries of the transects in grid rowData (a list of dicts) or a DataFrame, as {transect: dict}
+    rows are grouped on transect_column, rows without it (or a table without the column) count as one transect
+    keyed None. transects without a usable vertical are left out"""
+    df = pd.DataFrame(rows)
+    transects = df[transect_column] if transect_column in df else pd.Series(None, index=df.index, dtype=object)
+    df = df.reindex(columns=VERTICAL_COLUMNS).apply(pd.to_numeric, errors="coerce")
+    df[TRANSECT_COLUMN] = transects.astype(object).where(transects.notna(), None)
+    if df.dropna(subset=["location", "depth"]).empty:
+        return {}
+    summary = transect_summary(df, transect_column=TRANSECT_COLUMN, angle_units=angle_units)
+    return {(None if pd.isna(transect) else transect): row for transect, row in summary.to_dict("index").items()}
@@ -1,15 +1,20 @@
 import pandas as pd
 import geopandas as gpd
-import requests
 import json
 from shapely.geometry import Point
-import plotly.graph_objects as go
 import os
-from sqlalchemy import create_engine, inspect, text
-import folium
-import json
-from dotenv import load_dotenv
+import argparse
 import numpy as np
+import shapely
+from functools import lru_cache
+from gis_io import read_layer, write_layer, cache_path
+from table_schema import apply_schema, widen_floats
+from instrumentation import instrumented, stage, print_summary, write_run_report
+from remote_layers import prefetch_layers, remote_layer
+from layer_registry import projected, display
+from site_basin_index import attach_basins, site_basin_rows
+from layer_service import publish_layer
+from table_data import get_table_data
 
 # other sources
 # ecology surface water standards
@@ -29,6 +34,7 @@ import numpy as np
 # append stats to clipped census_watersheds
 
 
+@instrumented
 def fetch_nhd_waterbodies_geojson():
    # water bodies
    # https://geo.wa.gov/datasets/2259cc832d7a4c2eaa557b7b478e3288_1/explore?location=47.392686%2C-120.869000%2C7.62
@@ -39,14 +45,14 @@ def fetch_nhd_waterbodies_geojson():
    # https://services.arcgis.com/6lCKYNJLvwTXqrmp/arcgis/rest/services/NHD/FeatureServer/3/query?outFields=*&where=1%3D1&f=geojson
     """Fetch watershed boundaries from King County GIS"""
     try:
-        geojson_url = "https://services.arcgis.com/6lCKYNJLvwTXqrmp/arcgis/rest/services/NHD/FeatureServer/5/query?outFields=*&where=1%3D1&f=geojson"
-        response = requests.get(geojson_url)
-        return response.json()
+        # streamed to disk and read as a GeoDataFrame, see remote_layers.REMOTE_LAYERS for the url
+        return remote_layer("nhd_waterbodies")
     except Exception as e:
         print(f"Error fetching GeoJSON: {e}")
         return None
 
 
+@instrumented
 def fetch_cao_geojson():
     # https://gisdata.kingcounty.gov/arcgis/rest/services/OpenDataPortal/enviro___base/MapServer/2587/query?outFields=*&where=1%3D1&f=geojson
     # https://gis-kingcounty.opendata.arcgis.com/datasets/9ff7b65f45c94880bd8a6466c191f264_2587/explore?location=47.463068%2C-121.930050%2C10.19
@@ -54,13 +60,13 @@ def fetch_cao_geojson():
 
     """Fetch watershed boundaries from King County GIS"""
     try:
-        geojson_url = "https://gisdata.kingcounty.gov/arcgis/rest/services/OpenDataPortal/enviro___base/MapServer/2587/query?outFields=*&where=1%3D1&f=geojson"
-        response = requests.get(geojson_url)
-        return response.json()
+        # streamed to disk and read as a GeoDataFrame, see remote_layers.REMOTE_LAYERS for the url
+        return remote_layer("cao")
     except Exception as e:
         print(f"Error fetching GeoJSON: {e}")
         return None
 
+@instrumented
 def fetch_environmental_health_geojson():
     # shorter version
     # https://geo.wa.gov/datasets/c2c929f4bf0046aa814648823ccb6206_0/explore?location=47.224740%2C-120.811974%2C7.54
@@ -73,60 +79,25 @@ def fetch_environmental_health_geojson():
     #https://deohs.washington.edu/washington-environmental-health-disparities-map-project
     """Fetch watershed boundaries from King County GIS"""
     try:
-        geojson_url = "https://services8.arcgis.com/rGGrs6HCnw87OFOT/arcgis/rest/services/Environmental_Effects/FeatureServer/0/query?outFields=*&where=1%3D1&f=geojson"
-        response = requests.get(geojson_url)
-        return response.json()
+        # streamed to disk and read as a GeoDataFrame, see remote_layers.REMOTE_LAYERS for the url
+        return remote_layer("environmental_health")
     except Exception as e:
         print(f"Error fetching GeoJSON: {e}")
         return None
     
+@instrumented
 def fetch_ppov_geojson():
     # https://geo.wa.gov/datasets/6cc232508784436ab93965f0775b84c6_0/explore?location=47.184033%2C-120.811974%2C7.54
     # https://services8.arcgis.com/rGGrs6HCnw87OFOT/arcgis/rest/services/Population_Living_in_Poverty_v2/FeatureServer/0/query?outFields=*&where=1%3D1&f=geojson
     """Fetch watershed boundaries from King County GIS"""
     try:
-        geojson_url = "https://services8.arcgis.com/rGGrs6HCnw87OFOT/arcgis/rest/services/Population_Living_in_Poverty_v2/FeatureServer/0/query?outFields=*&where=1%3D1&f=geojson"
-        response = requests.get(geojson_url)
-        return response.json()
+        # streamed to disk and read as a GeoDataFrame, see remote_layers.REMOTE_LAYERS for the url
+        return remote_layer("poverty")
     except Exception as e:
         print(f"Error fetching GeoJSON: {e}")
         return None
     
-def get_table_data(table_name, selected_site=None, parameter=None):
-    # get connection information
-    load_dotenv()
-    DATABASE_URL = os.environ.get("DATABASE_URL")
-    USERNAME_PASSWORD_PAIRS = os.environ.get("USERNAME_PASSWORD_PAIRS")
-    USERNAME_PASSWORD_PAIRS = [tuple(pair.split(":")) for pair in USERNAME_PASSWORD_PAIRS.split(",")]
-    SECRET_KEY = os.environ.get("SECRET_KEY")
-
-    if not DATABASE_URL:
-        raise ValueError("DATABASE_URL is not set.")
-    # SQLAlchemy engine
-    engine = create_engine(DATABASE_URL)
-    if selected_site == None:
-        base_query = f'SELECT * FROM "{table_name}"'
-        params = None
-    else:
-        # Build base query
-        base_query = f'SELECT * FROM "{table_name}" WHERE site = :site'
-        params = {"site": selected_site}
-
-    # Add parameter filter if provided
-    if parameter is not None:
-        base_query += " AND parameter = :parameter"
-        params["parameter"] = parameter
-
-    query = text(base_query)
-
-    with engine.connect() as conn:
-        if params == None:
-            df = pd.read_sql(query, conn)
-        else:
-            df = pd.read_sql(query, conn, params=params)
-
-    return df
-
+@instrumented
 def site_import(parameter = None):
     """import sites, filters converts to gef exports"""
     # 1. Load sites data
@@ -148,46 +119,47 @@ def site_import(parameter = None):
 
     # drop columns
     sites_gdf = sites_gdf.dropna(subset=['longitude', 'latitude', 'location'])
-    sites_gdf.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/sites.geojson", driver="GeoJSON")
+    write_layer(sites_gdf, cache_path("sites.geojson"))
     return sites_gdf
 
+@instrumented
 def watershed_import():
-    if os.path.exists("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/watersheds.geojson"):
+    if os.path.exists(cache_path("watersheds.geojson")):
         print("watersheds exists") #print("Clipped file already exists!")
         # Load the existing file
-        watersheds = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/watersheds.geojson")
-        return watersheds
+        watersheds = read_layer(cache_path("watersheds.geojson"))
+        return apply_schema(watersheds, "watersheds")
     else:
         print("importing watersheds")
         # import watersheds 
         #"""Fetch watershed boundaries from King County GIS"""
         try:
             #geojson_url = "https://gisdata.kingcounty.gov/arcgis/rest/services/OpenDataPortal/hydro___base/MapServer/344/query?outFields=*&where=1%3D1&f=geojson"
-            # https://gis-kingcounty.opendata.arcgis.com/datasets/afb2bb73bff048c48554fedd2366d83a_237/explore?location=47.462842%2C-121.887700%2C9.58
-            geojson_url = "https://gisdata.kingcounty.gov/arcgis/rest/services/OpenDataPortal/enviro___base/MapServer/237/query?outFields=*&where=1%3D1&f=geojson"
-            response = requests.get(geojson_url)
-            # Convert response to GeoDataFrame
-            watersheds = gpd.read_file(response.text)
-            watersheds = watersheds.to_crs('EPSG:4326')
+            # url is in remote_layers.REMOTE_LAYERS, downloaded there (or by the prefetch in __main__)
+            watersheds = remote_layer("watersheds")
+            watersheds = display(watersheds)
             watersheds = watersheds.drop(columns=["OBJECTID_1", "CONDITION"])
             watersheds = watersheds.rename(columns={"STUDY_UNIT": "basin"})
             watersheds = watersheds.set_index("OBJECTID")
             # Save to file
-            watersheds.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/watersheds.geojson", driver="GeoJSON")
+            write_layer(watersheds, cache_path("watersheds.geojson"))
         except Exception as e:
             #print(f"Error fetching GeoJSON: {e}")
             return None
-        return watersheds
+        return apply_schema(watersheds, "watersheds")
         
+@instrumented
 def site_basin(sites_gdf, watersheds):
         """assigns basin to sites"""
         #if not "basin" in sites_gdf:
-        sites_gdf = gpd.sjoin(sites_gdf, watersheds, how='left', predicate='intersects')
+        # persisted lookup, only new or moved sites are joined against the watersheds
+        sites_gdf = attach_basins(sites_gdf, watersheds, columns=['basin'])
         sites_gdf = sites_gdf[['site', 'project', 'notes', 'latitude', 'longitude', 'geometry', 'basin']]
-        return sites_gdf
+        return apply_schema(sites_gdf, "sites")
         #else:
         #    return sites_gdf
         
+@instrumented
 def watershed_condition(sites_gdf, census_gdf, watersheds):
         """adds watershed environmental_condition to site watersheds, uses basin"""
         """ this is partially redundent since I am using the environmental condition gdf for the watersheds layer but i want to use a different watersheds layer"""
@@ -206,8 +178,8 @@ def watershed_condition(sites_gdf, census_gdf, watersheds):
         #geojson_url = "https://gisdata.kingcounty.gov/arcgis/rest/services/OpenDataPortal/enviro___base/MapServer/237/query?outFields=*&where=1%3D1&f=geojson"
         #response = requests.get(geojson_url)
         #condition = gpd.read_file(response.text)
-        condition  = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/environmental_condition_of_basins.geojson")
-        condition = condition.to_crs('EPSG:4326')
+        condition  = read_layer(cache_path("environmental_condition_of_basins.geojson"))
+        condition = display(condition)
         condition = condition.drop(columns=["OBJECTID_1"])
         condition = condition.rename(columns={"STUDY_UNIT": "basin"})
         condition = condition.rename(columns={"CONDITION": "environmental_condition"})
@@ -216,17 +188,18 @@ def watershed_condition(sites_gdf, census_gdf, watersheds):
         census_gdf = census_gdf.merge(condition[['basin', "environmental_condition"]], on='basin', how='left')
      
         #site_watersheds.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/site_watersheds.geojson", driver="GeoJSON")
-        return census_gdf, watersheds
+        return apply_schema(census_gdf, "census"), apply_schema(watersheds, "watersheds")
     #else:
         #print("environmental condition found")
         #return watersheds
     #site_watersheds = site_watersheds.loc[site_watersheds.sjoin(watershed_condition, how="inner", predicate='intersects').index.unique()]
 
+@instrumented
 def filter_cao(sites_gdf, watersheds):
-    if os.path.exists("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/cao_clipped.geojson"):
+    if os.path.exists(cache_path("cao_clipped.geojson")):
         print("cao data exists")
         # Load the existing file
-        cao_gdf = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/cao_clipped.geojson")
+        cao_gdf = read_layer(cache_path("cao_clipped.geojson"))
         
     else:
         print("importing cao data")
@@ -237,31 +210,27 @@ def filter_cao(sites_gdf, watersheds):
         # https://gis-kingcounty.opendata.arcgis.com/datasets/9ff7b65f45c94880bd8a6466c191f264_2587/explore?location=47.463068%2C-121.930050%2C10.19
         # fetch cao boundaries from king county gis
 
-        geojson_url = "https://gisdata.kingcounty.gov/arcgis/rest/services/OpenDataPortal/enviro___base/MapServer/2587/query?outFields=*&where=1%3D1&f=geojson"
-        response = requests.get(geojson_url)
-        cao_gdf = gpd.read_file(response.text)
-        cao_gdf = cao_gdf.to_crs('EPSG:4326')
+        cao_gdf = remote_layer("cao", columns=['HAZARD_TYPE', 'HAZARD_SUBTYPE','HAZARD_BUFFER'], bbox=watersheds)
+        cao_gdf = display(cao_gdf)
         cao_gdf = cao_gdf[['HAZARD_TYPE', 'HAZARD_SUBTYPE','HAZARD_BUFFER','geometry']]
         #cao_gdf = cao_gdf.loc[cao_gdf.sjoin(site_watersheds, how="inner", predicate='intersects').index.unique()]
-        cao_gdf = cao_gdf.sjoin(site_watersheds[['basin', 'geometry']], how="inner", predicate='intersects').drop(columns=['index_right'])
+        cao_gdf = cao_gdf.sjoin(watersheds[['basin', 'geometry']], how="inner", predicate='intersects').drop(columns=['index_right'])
         # Clip and save
         #nhd_waterbodies_gdf = nhd_waterbodies_gdf.clip(site_watersheds)
-        cao_gdf.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/cao_clipped.geojson", driver="GeoJSON")
-    return cao_gdf
+        write_layer(cao_gdf, cache_path("cao_clipped.geojson"))
+    return apply_schema(cao_gdf, "cao")
    
+@instrumented
 def filter_nhd_centerlines(watersheds):
     #https://geo.wa.gov/datasets/71fa52e7d6224fde8b09facb12b30f04_3/explore?location=47.775316%2C-120.094375%2C6.99
-    if os.path.exists("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/nhd_centerlines_clipped.geojson"):
+    if os.path.exists(cache_path("nhd_centerlines_clipped.geojson")):
     #    print("nhd centerlines filter exists")
     #    # Load the existing file
-        os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
-        nhd_centerlines = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/nhd_centerlines_clipped.geojson")
+        nhd_centerlines = read_layer(cache_path("nhd_centerlines_clipped.geojson"))
     
     else:
         print("import nhd centerlines")
-        # Set environment variable and process
-        os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
-        nhd_centerlines = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/nhd_centerlines.geojson")
+        nhd_centerlines = read_layer(cache_path("nhd_centerlines.geojson"), bbox=watersheds)
         # Ensure same CRS
         if nhd_centerlines.crs != watersheds.crs:
             nhd_centerlines = nhd_centerlines.to_crs(watersheds.crs)
@@ -283,14 +252,15 @@ def filter_nhd_centerlines(watersheds):
         nhd_centerlines = nhd_centerlines.drop_duplicates(subset='OBJECTID', keep='first')
         nhd_centerlines = nhd_centerlines.loc[nhd_centerlines["StreamOrder"].notna()]
        
-        nhd_centerlines.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/nhd_centerlines_clipped.geojson", driver="GeoJSON")
+        write_layer(nhd_centerlines, cache_path("nhd_centerlines_clipped.geojson"))
     return nhd_centerlines
+@instrumented
 def filter_nhd_waterbodies(sites_gdf, watersheds):
     #"""gets sites, filters by parameter, gets watersheds and finds intersecting watersheds"""
     # get watersheds
     # Check if file exists
 
-    #if os.path.exists("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/nhd_centerlines_clipped.geojson"):
+    #if os.path.exists(cache_path("nhd_centerlines_clipped.geojson")):
         #print("nhd waterbodies filter exists")
     #    # Load the existing file
     #    os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
@@ -298,9 +268,7 @@ def filter_nhd_waterbodies(sites_gdf, watersheds):
     
     #else:
         print("import nhd water bodies")
-        # Set environment variable and process
-        os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
-        nhd_waterbodies = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/wa_nhd_waterbodies.geojson")
+        nhd_waterbodies = read_layer(cache_path("wa_nhd_waterbodies.geojson"))
         # Ensure same CRS
         if nhd_waterbodies.crs != site_watersheds.crs:
             nhd_waterbodies = nhd_waterbodies.to_crs(site_watersheds.crs)
@@ -316,38 +284,40 @@ def filter_nhd_waterbodies(sites_gdf, watersheds):
         #nhd_waterbodies_gdf = nhd_waterbodies_gdf.clip(site_watersheds)
         nhd_waterbodies = nhd_waterbodies[["OBJECTID", "basin", "Elevation", "ReachCode", "geometry"]]
         print(nhd_waterbodies)
-        nhd_waterbodies.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/wa_nhd_waterbodies_clipped.geojson", driver="GeoJSON")
+        write_layer(nhd_waterbodies, cache_path("wa_nhd_waterbodies_clipped.geojson"))
         return nhd_waterbodies
+@instrumented
 def filter_riparian_sun(site_watersheds):
     # https://gis-kingcounty.opendata.arcgis.com/datasets/26b644a6a119428fb27a3165f954ab78_2547/explore?location=47.456010%2C-121.890076%2C10.15
     """gets sites, filters by parameter, gets watersheds and finds intersecting watersheds"""
     # get watersheds
     # Check if file exists
 
-    if os.path.exists("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/king_county_fema_floodplain_100yr_area_clipped.geojson"):
+    if os.path.exists(cache_path("king_county_fema_floodplain_100yr_area_clipped.geojson")):
         print("Clipped file already exists!")
         # Load the existing file
-        clipped_gdf = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/king_county_fema_floodplain_100yr_area_clipped.geojson")
+        clipped_gdf = read_layer(cache_path("king_county_fema_floodplain_100yr_area_clipped.geojson"))
         from shapely.geometry import MultiPoint
 
         
         
     else:
-        # Set environment variable and process
-        os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
-        full_gdf = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/king_county_fema_floodplain_100yr_area.geojson")
+        full_gdf = read_layer(cache_path("king_county_fema_floodplain_100yr_area.geojson"))
         # Ensure same CRS
         if full_gdf.crs != site_watersheds.crs:
             full_gdf = full_gdf.to_crs(site_watersheds.crs)
         # Clip and save
         clipped_gdf = full_gdf.clip(site_watersheds)
-        clipped_gdf.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/king_county_fema_floodplain_100yr_area_clipped.geojson", driver="GeoJSON")
+        write_layer(clipped_gdf, cache_path("king_county_fema_floodplain_100yr_area_clipped.geojson"))
     return clipped_gdf
 
-def filter_cso_points(watersheds, buffer_distance = None):
+@instrumented
+def filter_cso_points(watersheds, buffer_distance = None, distances = None):
+        """flags basins with a CSO outfall within buffer_distance feet and counts them (CSO_status, CSO_count)
+        distances adds a CSO_count_<d>ft column for each extra distance, ie [0, 500, 1000], from the same query"""
    #https://gis-kingcounty.opendata.arcgis.com/datasets/a78ebaf964764515a477b11c2bf2c881_2800/explore?location=47.812494%2C-122.264168%2C11.87
 
-    #if os.path.exists("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/king_county_fema_floodplain_100yr_area_clipped.geojson"):
+    #if os.path.exists(cache_path("king_county_fema_floodplain_100yr_area_clipped.geojson")):
     #    print("Clipped file already exists!")
     #    # Load the existing file
     #    clipped_gdf = gpd.read_file("C:/Users/IHiggins/OneDrive - King County/cache_render_gis_data/CSO_points_clipped.geojson")
@@ -357,9 +327,7 @@ def filter_cso_points(watersheds, buffer_distance = None):
     #    pass
         
     #else:
-        # Set environment variable and process
-        os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
-        full_gdf = gpd.read_file("C:/Users/IHiggins/OneDrive - King County/cache_render_gis_data/CSO_points.geojson")
+        full_gdf = read_layer(cache_path("CSO_points.geojson"))
         
         # Ensure same CRS
         if full_gdf.crs != watersheds.crs:
@@ -369,39 +337,33 @@ def filter_cso_points(watersheds, buffer_distance = None):
         columns_to_drop = ['X_COORD', 'Y_COORD', 'LATITUDE', 'LONGITUDE','OBJECTID', 'DSN']
         full_gdf = full_gdf.drop(columns=columns_to_drop, errors='ignore')
        
-        watersheds_proj = watersheds.to_crs('EPSG:2926')  # Washington State Plane North (feet)
-        full_gdf_proj = full_gdf.to_crs('EPSG:2926')  # Use same CRS
-        full_gdf_proj["CSO_status"] = True
+        # Washington State Plane North (feet), reprojected once per run
+        watersheds_proj = projected(watersheds)
+        full_gdf_proj = projected(full_gdf)
         if not buffer_distance:
             buffer_distance = 0
-        
-        watersheds_buffered = watersheds_proj.copy()
-        watersheds_buffered['geometry'] = watersheds_proj.geometry.buffer(buffer_distance)
-
-        # Perform spatial join
-        joined = full_gdf_proj.sjoin(watersheds_buffered, how='left', predicate='within')
-        # Perform spatial join to find which points fall within buffered watersheds
-        #joined = watersheds.sjoin(full_gdf, how='left', predicate='within')
-        joined.loc[joined["CSO_status"].isna(), "CSO_status"] = False
-        joined = joined[['basin', 'CSO_status']]
-        joined = joined.drop_duplicates(subset = "basin")
-        
-        watersheds = watersheds.merge(joined, on="basin", how="left")
-        watersheds.loc[watersheds["CSO_status"].isna(), "CSO_status"] = False
-        
-        # Set CSO_status to True for points that fall within any watershed
-        #
-
-        # Copy the CSO_status column back to the original full_gdf
-       
-        full_gdf.to_file("C:/Users/IHiggins/OneDrive - King County/cache_render_gis_data/CSO_points_clipped.geojson", driver="GeoJSON")
-        #print(clipped_gdf)
-        return full_gdf, watersheds
-
+        distances = sorted({buffer_distance, *(distances or [])})
+        watersheds = watersheds.copy()
+
+        # one indexed query at the largest distance finds every candidate (basin, point) pair without
+        # building buffered polygons, the exact distances then answer each smaller distance
+        basin_pos, point_pos = full_gdf_proj.sindex.query(watersheds_proj.geometry, predicate="dwithin", distance=max(distances))
+        pair_distance = shapely.distance(watersheds_proj.geometry.values[basin_pos], full_gdf_proj.geometry.values[point_pos])
+        for distance in distances:
+            counts = np.bincount(basin_pos[pair_distance <= distance], minlength=len(watersheds)).astype("int32")
+            if distance == buffer_distance:
+                watersheds["CSO_count"] = counts
+                watersheds["CSO_status"] = counts > 0
+            if len(distances) > 1:
+                watersheds[f"CSO_count_{distance:g}ft"] = counts
+
+        write_layer(full_gdf, cache_path("CSO_points_clipped.geojson"))
+        return full_gdf, apply_schema(watersheds, "watersheds")
+
+@instrumented
 def wtd_service_area(watersheds):
     # https://gis-kingcounty.opendata.arcgis.com/datasets/7da451dd786c4e05a75f568483f87880_2478/explore?location=47.524357%2C-122.101020%2C10.05
-    os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
-    full_gdf = gpd.read_file("C:/Users/IHiggins/OneDrive - King County/cache_render_gis_data/WTD_service_area.geojson")
+    full_gdf = read_layer(cache_path("WTD_service_area.geojson"))
         
     # Ensure same CRS
     if full_gdf.crs != watersheds.crs:
@@ -412,25 +374,25 @@ def wtd_service_area(watersheds):
     watersheds = watersheds.merge(clipped, on="basin", how="left")
     watersheds.loc[watersheds["wtd_service_area"].isna(), "wtd_service_area"] = False
    
-    return full_gdf, watersheds
+    return full_gdf, apply_schema(watersheds, "watersheds")
 
+@instrumented
 def filter_census_data(sites_gdf, watersheds):
     """filter census tracks by basin, return census tract with basin"""
     #https://gis-kingcounty.opendata.arcgis.com/datasets/26b644a6a119428fb27a3165f954ab78_2547/explore?location=47.456010%2C-121.890076%2C10.15
     #"""gets sites, filters by parameter, gets watersheds and finds intersecting watersheds"""
     #"""uses environmental health for census info so a bit redundent but hopefully this makes codee more useable for expansion"""
-    #if os.path.exists("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/census_clipped.geojson"):
+    #if os.path.exists(cache_path("census_clipped.geojson")):
     #    print("census clip eixits")
     #    # Load the existing file
     #    clipped_gdf = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/census_clipped.geojson")
     #else:
         # Set environment variable and process
-    os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '0'
-    full_gdf = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/EHD.geojson")
+    full_gdf = read_layer(cache_path("EHD.geojson"), columns=['TRACTCE10', 'GEOID10'], bbox=watersheds)
     #print("creating census clip")
         # Ensure same CRS
     #if full_gdf.crs != watersheds.crs:
-    full_gdf = full_gdf.to_crs("EPSG:4326")
+    full_gdf = display(full_gdf)
     
     
     clipped_gdf = full_gdf.overlay(watersheds[['basin', 'geometry']], how='intersection')
@@ -438,9 +400,10 @@ def filter_census_data(sites_gdf, watersheds):
     clipped_gdf = clipped_gdf[['TRACTCE10', 'GEOID10', 'geometry', 'basin']]
     clipped_gdf = clipped_gdf.explode(index_parts=False).reset_index(drop=True) # if a census track is bisected by a watershed you wanna create two tracts
     
-    clipped_gdf.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/census_clipped.geojson", driver="GeoJSON")
-    return clipped_gdf
+    write_layer(clipped_gdf, cache_path("census_clipped.geojson"))
+    return apply_schema(clipped_gdf, "census")
      
+@instrumented
 def crop_census_data(census_gdf, site_watersheds):  
     """crops census data to site watersheds"""
     # Clip to watershed boundaries
@@ -454,9 +417,10 @@ def crop_census_data(census_gdf, site_watersheds):
     #clipped_gdf = full_gdf.overlay(site_watersheds[['basin', 'geometry']], how='intersection')
     #clipped_gdf = clipped_gdf.explode(index_parts=False).reset_index(drop=True)
    
-    clipped_gdf.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/census_site_watersheds.geojson", driver="GeoJSON")
-    return clipped_gdf 
+    write_layer(clipped_gdf, cache_path("census_site_watersheds.geojson"))
+    return apply_schema(clipped_gdf, "census")
 
+@instrumented
 def filter_environmental_health(sites_gdf, watersheds, census_gdf):
 
     # shorter version
@@ -475,12 +439,12 @@ def filter_environmental_health(sites_gdf, watersheds, census_gdf):
     #else:
     print("calculating environmental statistics")
         ## clip census tracks to EHD data
-    ehd_data = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/EHD.geojson")
+    ehd_data = read_layer(cache_path("EHD.geojson"), bbox=watersheds)
     censsu_gdf = census_gdf.reset_index(drop = False)
 
     # set crs
-    ehd_data = ehd_data.to_crs("EPSG:4326")
-    census_gdf = census_gdf .to_crs("EPSG:4326")
+    ehd_data = display(ehd_data)
+    census_gdf = display(census_gdf)
     ehd_data = ehd_data.clip(watersheds)
     
     census_gdf = census_gdf.merge(ehd_data, how="left", on = "TRACTCE10", suffixes=('', '_ehd'))
@@ -526,42 +490,41 @@ def filter_environmental_health(sites_gdf, watersheds, census_gdf):
         # calculate average for each in EHD map and add to watersheds and site lsit\
     
     for s in statistics_list:
-        stat = census_gdf.groupby('basin')[f'{s}'].agg(['mean']).round(1)
+        stat = census_gdf.groupby('basin', observed=True)[f'{s}'].agg(['mean']).round(1)
         stat.columns = [f'{s}']
             # Merge back to watersheds
 
         watersheds = watersheds.merge(stat, left_on = "basin", right_index = True, how='left')
         sites_gdf = sites_gdf.merge(stat, left_on = "basin", right_index = True, how = "left")
 
-    return sites_gdf, watersheds, census_gdf
+    return apply_schema(sites_gdf, "sites"), apply_schema(watersheds, "watersheds"), apply_schema(census_gdf, "census")
 
+@instrumented
 def filter_watersheds(sites_gdf, watersheds):
-    #if os.path.exists("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/site_watersheds.geojson"):
+    #if os.path.exists(cache_path("site_watersheds.geojson")):
     #    print("site watersheds exists")
         # Load the existing file
     #    site_watersheds = gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/site_watersheds.geojson")
     #else:
     #    print("clipping site watersheds")
    
-    site_watersheds = watersheds.loc[watersheds.sjoin(sites_gdf, how="inner", predicate='intersects').index.unique()]
+    site_watersheds = site_basin_rows(sites_gdf, watersheds)
         # Save to file
-    site_watersheds.to_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/site_watersheds.geojson", driver="GeoJSON")
+    write_layer(site_watersheds, cache_path("site_watersheds.geojson"))
    
     return site_watersheds
 
+@instrumented
 def filter_percent_pov(site_watersheds):
         # adds average ehd rank to site_watersheds and clips ppov to watershed boundaries
     """Calculate average environmental health rank for each watershed"""
             
     # get environmental health data
-    geojson_data = fetch_ppov_geojson()
-    if not geojson_data:
+    ppov_gdf = fetch_ppov_geojson()
+    if ppov_gdf is None:
         print("Failed to fetch environmental health data")
         return site_watersheds  # return original watersheds
             
-    # Convert to GeoDataFrame
-    ppov_gdf = gpd.GeoDataFrame.from_features(geojson_data['features'], crs='EPSG:4326')
-            
     # Ensure same CRS
     if ppov_gdf.crs != site_watersheds.crs:
         ppov_gdf = ppov_gdf.to_crs(site_watersheds.crs)
@@ -591,23 +554,29 @@ def filter_percent_pov(site_watersheds):
     # Return watersheds with stats and the clipped poverty data
     return site_watersheds, ppov_clipped
 
-def create_map(sites_gdf, watersheds, site_watersheds, census_gdf, cao_gdf = None, cso_gdf = None, wtd_service_area = None, nhd_centerlines = None, nhd_waterbodies = None):
-    import folium
-    import matplotlib.pyplot as plt
-    from matplotlib.colors import LinearSegmentedColormap
+@lru_cache(maxsize=None)
+def _get_cmap(colormap):
+    # matplotlib.colormaps avoids importing pyplot
+    import matplotlib
+    return matplotlib.colormaps[colormap]
+
+def get_color_from_value(value, min_val, max_val, colormap='YlOrRd'):
+    """Get hex color from value using matplotlib colormap"""
     import matplotlib.colors as mcolors
+    if max_val == min_val:
+        normalized = 0.5
+    else:
+        normalized = (value - min_val) / (max_val - min_val)
+    
+    cmap = _get_cmap(colormap)
+    rgb = cmap(normalized)[:3]
+    return mcolors.rgb2hex(rgb)
 
-    # assign color values
-    def get_color_from_value(value, min_val, max_val, colormap='YlOrRd'):
-        """Get hex color from value using matplotlib colormap"""
-        if max_val == min_val:
-            normalized = 0.5
-        else:
-            normalized = (value - min_val) / (max_val - min_val)
-        
-        cmap = plt.get_cmap(colormap)
-        rgb = cmap(normalized)[:3]
-        return mcolors.rgb2hex(rgb)
+@instrumented
+def create_map(sites_gdf, watersheds, site_watersheds, census_gdf, cao_gdf = None, cso_gdf = None, wtd_service_area = None, nhd_centerlines = None, nhd_waterbodies = None):
+    import folium
+    # folium.GeoJson writes every column into the page
+    watersheds, site_watersheds, census_gdf = widen_floats(watersheds), widen_floats(site_watersheds), widen_floats(census_gdf)
 
     # Get bounds
     bounds = sites_gdf.total_bounds
@@ -923,6 +892,8 @@ def create_map(sites_gdf, watersheds, site_watersheds, census_gdf, cao_gdf = Non
             census_layer.add_to(m)
     
     # Watershed condition data processing
+    # object so the text condition can be recoded to numbers (arrow backed string columns reject ints)
+    site_watersheds["environmental_condition"] = site_watersheds["environmental_condition"].astype(object)
     site_watersheds.loc[site_watersheds["environmental_condition"] == "High", "environmental_condition"] = 1
     site_watersheds.loc[site_watersheds["environmental_condition"] == "Medium", "environmental_condition"] = 2
     site_watersheds.loc[site_watersheds["environmental_condition"] == "Low", "environmental_condition"] = 3
@@ -977,26 +948,10 @@ def create_map(sites_gdf, watersheds, site_watersheds, census_gdf, cao_gdf = Non
     # sites
     
     return m
+@instrumented
 def create_map_plotly(sites_gdf, watersheds, site_watersheds, census_gdf, cao_gdf=None, cso_gdf=None, 
                wtd_service_area=None, nhd_centerlines=None, nhd_waterbodies=None):
     import plotly.graph_objects as go
-    import pandas as pd
-    import numpy as np
-    from plotly.subplots import make_subplots
-    import matplotlib.pyplot as plt
-    from matplotlib.colors import LinearSegmentedColormap
-    import matplotlib.colors as mcolors
-
-    def get_color_from_value(value, min_val, max_val, colormap='YlOrRd'):
-        """Get hex color from value using matplotlib colormap"""
-        if max_val == min_val:
-            normalized = 0.5
-        else:
-            normalized = (value - min_val) / (max_val - min_val)
-        
-        cmap = plt.get_cmap(colormap)
-        rgb = cmap(normalized)[:3]
-        return mcolors.rgb2hex(rgb)
 
     # Get bounds for centering
     bounds = sites_gdf.total_bounds
@@ -1008,6 +963,8 @@ def create_map_plotly(sites_gdf, watersheds, site_watersheds, census_gdf, cao_gd
 
     # Watershed condition data processing
     site_watersheds = site_watersheds.copy()
+    # object so the text condition can be recoded to numbers (arrow backed string columns reject ints)
+    site_watersheds["environmental_condition"] = site_watersheds["environmental_condition"].astype(object)
     site_watersheds.loc[site_watersheds["environmental_condition"] == "High", "environmental_condition"] = 1
     site_watersheds.loc[site_watersheds["environmental_condition"] == "Medium", "environmental_condition"] = 2
     site_watersheds.loc[site_watersheds["environmental_condition"] == "Low", "environmental_condition"] = 3
@@ -1436,14 +1393,35 @@ def create_map_plotly(sites_gdf, watersheds, site_watersheds, census_gdf, cao_gd
     )
 
     return fig
+
+
+# remote layers (remote_layers.REMOTE_LAYERS) __main__ reads, with the clipped copy in the cache that replaces the
+# download. filter_environmental_health reads the local EHD.geojson and filter_percent_pov isn't part of the run,
+# so the environmental health and poverty layers are left to the functions that fetch them
+RUN_LAYERS = {
+    "watersheds": "watersheds.geojson",
+    "cao": "cao_clipped.geojson",
+}
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="build the watershed condition map")
+    parser.add_argument("--profile", nargs="?", const=cache_path("profile/watershed_gis"), metavar="DIR",
+                        help="run under the sampling profiler and write flamegraph stacks per stage to DIR")
+    args = parser.parse_args()
+    if args.profile:
+        from profiling import start_profiler, finish_profiler
+        profiler = start_profiler()
+
+    # download the remote layers that aren't cached yet in one go instead of one stage at a time
+    prefetch_layers([name for name, output in RUN_LAYERS.items() if not os.path.exists(cache_path(output))])
+
     # You'll need to implement get_table_data() or replace it with your data loading method
     #result = main()
     # import sites, filter and process to geodataframe
     # import sites
     # import local sites
 
-    sites_gdf =  gpd.read_file("C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/sites.geojson")
+    sites_gdf =  read_layer(cache_path("sites.geojson"))
     #sites_gdf = site_import(parameter = "discharge")
     
     # import
@@ -1472,7 +1450,20 @@ if __name__ == '__main__':
     #m.save('C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/watershed_map.html')
     
     fig = create_map_plotly(sites_gdf, watersheds, site_watersheds, census_site_watersheds, cao_gdf, cso_gdf, wtd_service_area, None, None)
-    fig.save('C:/Users/ihiggins/OneDrive - King County/cache_render_gis_data/WTD_map.html')
+    with stage("save WTD_map.html"):
+        fig.save(cache_path("WTD_map.html"))
+
+    # layers the dash app serves by viewport, publishing replaces whatever it has cached
+    with stage("publish layers"):
+        for name, layer in [("watersheds", watersheds), ("site_watersheds", site_watersheds), ("census", census_site_watersheds),
+                            ("cso_points", cso_gdf), ("wtd_service_area", wtd_service_area), ("sites", sites_gdf)]:
+            if layer is not None:
+                publish_layer(name, layer)
+
+    print_summary()
+    write_run_report(cache_path("watershed_gis_run_report.json"))
+    if args.profile:
+        finish_profiler(profiler, args.profile)
     
     #m = create_map(sites_gdf, watersheds, site_watersheds, census_gdf, cao_gdf, cso_gdf, wtd_service_area, nhd_centerlines, nhd_waterbodies)
      # view map